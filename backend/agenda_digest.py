@@ -0,0 +1,357 @@
+"""🗓 Precomputed daily agendas: one Firestore document per user per day.
+
+DailyAgendaBuilder keeps today's events and tasks for every user in memory, fed by
+Firestore listeners on today's slice of each collection (or, with
+AGENDA_DIGEST_LISTENERS=false, by a periodic full rebuild). Changes only mark their
+user dirty; flush() rewrites just the dirty users' documents in batched writes, so a
+burst of edits to one task costs one write. Each document holds the user's events
+and tasks for the day, sorted by time, as raw timestamps that replies format in the
+asking user's timezone. Recurring series are watched and read as well, and contribute
+their occurrences that day.
+
+AgendaDigests answers same-day event/task lookups that UserAgendaCache couldn't from
+that document — one read in place of a query per collection. A backend write to a
+user's items marks their digest stale with invalidate(), and lookups skip it until
+the builder has rewritten it. send_morning_digests() pushes each user their day at
+AGENDA_DIGEST_HOUR in DEFAULT_TIMEZONE.
+"""
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+import pytz
+
+from log_config import new_request_id
+from metrics import JOBS, span, stream_query
+from queries import RangeQuery, field_filter
+from recurrence import SERIES_FIELDS, expand, is_series
+from task_store import TASK_COLLECTIONS
+from temporal import get_timezone, format_when, utc_day_range
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "daily_agendas"
+# Beyond this many items a day the document is marked truncated and lookups query instead
+MAX_ITEMS = int(os.environ.get("AGENDA_DIGEST_MAX_ITEMS", 500))
+WRITE_BATCH_SIZE = 500
+
+# Collection -> the time field its items are ordered by
+SOURCES = {"events": "start", **{collection: "DueDate" for collection in TASK_COLLECTIONS}}
+SOURCE_FIELDS = ("userId", "title", "location", "token")
+
+
+# Digest days are the UTC days the chat intents mean by "that day"
+day_bounds = utc_day_range
+
+
+def today():
+    return datetime.now(pytz.utc).date()
+
+
+def document_id(user_id, day):
+    return f"{user_id}_{day.isoformat()}"
+
+
+def _entries(collection, snapshot, low, high):
+    """(item key, item) for each thing a document puts on the day: itself, or a series' occurrences."""
+    if is_series(snapshot.to_dict()):
+        return [(f"{snapshot.reference.path}@{occurrence.moment.isoformat()}", _item(collection, occurrence))
+                for occurrence in expand(snapshot, SOURCES[collection], low, high)]
+    return [(snapshot.reference.path, _item(collection, snapshot))]
+
+
+def _series_query(db, collection):
+    # Every user's series; single-field index on rrule (automatic)
+    return db.collection(collection).where(filter=field_filter("rrule", "!=", None))
+
+
+def _item(collection, snapshot):
+    data = snapshot.to_dict()
+    if collection == "events":
+        return {"id": snapshot.id, "title": data.get("title"), "start": data["start"],
+                "location": data.get("location", "Not specified")}
+    return {"id": snapshot.id, "collection": collection, "title": data.get("title"), "DueDate": data["DueDate"]}
+
+
+class DailyAgendaBuilder:
+    """Maintains today's daily_agendas documents for every user with events or tasks today."""
+
+    def __init__(self, db, listen=True):
+        self.db = db
+        self.listen = listen
+        self.day = None
+        self._items = {}  # user id -> {item key: item}
+        self._owners = {}  # document path -> (user id, keys of the items it added)
+        self._tokens = {}  # user id -> most recent FCM token seen on their items
+        self._dirty = set()
+        self._watches = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.roll_over()
+
+    def roll_over(self):
+        """Switches to the current day: drops yesterday's state and loads today's."""
+        day = today()
+        for watch in self._watches:
+            watch.unsubscribe()
+        with self._lock:
+            self.day, self._items, self._owners, self._tokens, self._dirty = day, {}, {}, {}, set()
+        if self.listen:
+            # Each listener's first callback delivers the day's documents as additions
+            self._watches = [self._watch(collection, field) for collection, field in SOURCES.items()]
+            self._watches += [self._watch(collection) for collection in SOURCES]
+        else:
+            self._watches = []
+            self.rebuild()
+
+    def rebuild(self):
+        """Reloads the whole day from Firestore and rewrites every user's document."""
+        new_request_id(f"agenda-rebuild-{uuid.uuid4().hex[:8]}")
+        with JOBS.time(job="agenda_rebuild"):
+            low, high = day_bounds(self.day)
+            items, owners, tokens = {}, {}, {}
+            for collection, field in SOURCES.items():
+                plan = RangeQuery("agenda_day", collection, field, low, high,
+                                  fields=(*SOURCE_FIELDS, field))
+                series = _series_query(self.db, collection).select([*SOURCE_FIELDS, *SERIES_FIELDS])
+                for snapshot in [*plan.stream(self.db), *stream_query(series, collection, "agenda_series")]:
+                    data = snapshot.to_dict()
+                    user_id = data.get("userId")
+                    entries = _entries(collection, snapshot, low, high)
+                    if not user_id or not entries:
+                        continue
+                    items.setdefault(user_id, {}).update(entries)
+                    owners[snapshot.reference.path] = (user_id, [key for key, _ in entries])
+                    tokens[user_id] = data.get("token") or tokens.get(user_id)
+            with self._lock:
+                # Users whose items all went away still get their (now empty) day rewritten
+                self._dirty = set(self._items) | set(items)
+                self._items, self._owners, self._tokens = items, owners, tokens
+            self._flush()
+
+    def flush(self):
+        with JOBS.time(job="agenda_flush"):
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            documents = [(user_id, self._document(user_id)) for user_id in dirty]
+        if not documents:
+            return
+
+        with span("agenda_flush", users=len(documents)):
+            collection = self.db.collection(COLLECTION)
+            for i in range(0, len(documents), WRITE_BATCH_SIZE):
+                batch = self.db.batch()
+                for user_id, document in documents[i:i + WRITE_BATCH_SIZE]:
+                    # merge keeps digestSentAt, which only the morning digest writes
+                    batch.set(collection.document(document_id(user_id, self.day)), document, merge=True)
+                batch.commit()
+        logger.info("🗓 Rewrote %d daily agendas for %s", len(documents), self.day)
+
+    def _document(self, user_id):
+        items = list(self._items.get(user_id, {}).values())
+        events = sorted((item for item in items if "start" in item), key=lambda item: item["start"])
+        tasks = sorted((item for item in items if "DueDate" in item), key=lambda item: item["DueDate"])
+        return {
+            "userId": user_id,
+            "date": self.day.isoformat(),
+            "events": events[:MAX_ITEMS],
+            "tasks": tasks[:MAX_ITEMS],
+            "truncated": len(events) > MAX_ITEMS or len(tasks) > MAX_ITEMS,
+            "stale": False,
+            "token": self._tokens.get(user_id),
+            "builtAt": datetime.now(pytz.utc),
+        }
+
+    def _watch(self, collection, field=None):
+        """Listens to today's slice of a collection, or to its series when there's no field."""
+        low, high = day_bounds(self.day)
+        if field is None:
+            query = _series_query(self.db, collection)
+        else:
+            query = RangeQuery("agenda_day", collection, field, low, high).build(self.db)
+
+        def on_change(snapshots, changes, read_time):
+            with self._lock:
+                for change in changes:
+                    snapshot = change.document
+                    path = snapshot.reference.path
+                    # Drop the old version first: it may have been deleted, moved off today or reassigned
+                    previous_owner, previous_keys = self._owners.pop(path, (None, ()))
+                    if previous_owner is not None:
+                        for key in previous_keys:
+                            self._items[previous_owner].pop(key, None)
+                        self._dirty.add(previous_owner)
+                    if change.type.name == "REMOVED":
+                        continue
+                    data = snapshot.to_dict()
+                    user_id = data.get("userId")
+                    entries = _entries(collection, snapshot, low, high)
+                    if not user_id or not entries:
+                        continue
+                    self._items.setdefault(user_id, {}).update(entries)
+                    self._owners[path] = (user_id, [key for key, _ in entries])
+                    self._tokens[user_id] = data.get("token") or self._tokens.get(user_id)
+                    self._dirty.add(user_id)
+
+        return query.on_snapshot(on_change)
+
+
+class AgendaDigests:
+    """Same-day lookups from the daily_agendas documents, shaped like UserAgendaCache's.
+
+    Each lookup returns None when no digest can answer it: the range isn't inside
+    today, the user has no digest, or theirs was truncated or invalidated.
+    """
+
+    def __init__(self, db, enabled=True):
+        self.db = db
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def events_between(self, user_id, start, end):
+        """Event dicts with start in [start, end]."""
+        reference = self._reference(user_id, start, end)
+        return None if reference is None else _events_in(self._check(reference.get()), start, end)
+
+    def tasks_between(self, user_id, start, end):
+        """(collection, task dict) pairs with DueDate in [start, end]."""
+        reference = self._reference(user_id, start, end)
+        return None if reference is None else _tasks_in(self._check(reference.get()), start, end)
+
+    async def aevents_between(self, adb, user_id, start, end):
+        """events_between() through the async Firestore client."""
+        reference = self._reference(user_id, start, end, adb)
+        return None if reference is None else _events_in(self._check(await reference.get()), start, end)
+
+    async def atasks_between(self, adb, user_id, start, end):
+        reference = self._reference(user_id, start, end, adb)
+        return None if reference is None else _tasks_in(self._check(await reference.get()), start, end)
+
+    def invalidate(self, user_id):
+        """Marks the user's digest stale after the backend wrote to their items; the builder's
+        next rewrite of it (its listeners see the same write) makes it usable again."""
+        if not self.enabled or not user_id:
+            return
+        reference = self.db.collection(COLLECTION).document(document_id(user_id, today()))
+        reference.set({"stale": True}, merge=True)
+
+    def _reference(self, user_id, start, end, client=None):
+        # Only today's digest is kept up to date, and only ranges inside it can be answered
+        day = today()
+        low, high = day_bounds(day)
+        if not self.enabled or not user_id or not (low <= start and end <= high):
+            return None
+        return (client or self.db).collection(COLLECTION).document(document_id(user_id, day))
+
+    def _check(self, snapshot):
+        document = snapshot.to_dict() if snapshot.exists else None
+        if not document or document.get("truncated") or document.get("stale") or "events" not in document:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return document
+
+
+def _events_in(document, start, end):
+    if document is None:
+        return None
+    return [event for event in document["events"] if start <= event["start"] <= end]
+
+
+def _tasks_in(document, start, end):
+    if document is None:
+        return None
+    return [(task["collection"], task) for task in document["tasks"] if start <= task["DueDate"] <= end]
+
+
+def send_morning_digests(db):
+    """Pushes every user with a token their agenda for today, once per day."""
+    new_request_id(f"agenda-digest-{uuid.uuid4().hex[:8]}")
+    with JOBS.time(job="morning_digest"):
+        _send_morning_digests(db)
+
+
+def _send_morning_digests(db):
+    from device_tokens import registry
+    from notifications import send_fcm_batch, commit_updates, is_permanent_failure
+
+    day = today()
+    # Index: daily_agendas (date, userId)
+    plan = RangeQuery("morning_digests", COLLECTION, "userId", equals={"date": day.isoformat()})
+    pending = []
+    for snapshot in plan.stream(db):
+        document = snapshot.to_dict()
+        if document.get("digestSentAt"):
+            continue
+        if not document.get("events") and not document.get("tasks"):
+            continue
+        pending.append((snapshot.reference, document))
+
+    # The token last seen on each user's items, plus their other registered devices
+    devices = registry.resolve(db, [(document["userId"], document.get("token")) for _, document in pending])
+    pending = [(reference, document, tokens) for (reference, document), tokens in zip(pending, devices) if tokens]
+    if not pending:
+        return
+
+    errors = send_fcm_batch([(token, "🌅 Your day at a glance", digest_body(document))
+                             for _, document, tokens in pending for token in tokens])
+    now = datetime.now(pytz.utc)
+    sent, dead, position = [], [], 0
+    for reference, _, tokens in pending:
+        results = errors[position:position + len(tokens)]
+        position += len(tokens)
+        dead += [token for token, error in zip(tokens, results) if error is not None and is_permanent_failure(error)]
+        if None in results:
+            sent.append((reference, {"digestSentAt": now}))
+    try:
+        commit_updates(db, sent)
+    finally:
+        registry.prune(db, dead)
+    logger.info("🌅 Morning digests: %d sent, %d failed", len(sent), len(pending) - len(sent))
+
+
+def digest_body(document):
+    events, tasks = document.get("events") or [], document.get("tasks") or []
+    parts = []
+    if events:
+        parts.append(f"{len(events)} event{'s' if len(events) != 1 else ''}")
+    if tasks:
+        parts.append(f"{len(tasks)} task{'s' if len(tasks) != 1 else ''}")
+    first = min(events + tasks, key=lambda item: item.get("start") or item.get("DueDate"))
+    when = format_when(first.get("start") or first["DueDate"], get_timezone())
+    return f"📅 {' and '.join(parts)} today. First up: {first['title']} at {when[11:]}"
+
+
+def schedule_agenda_jobs(scheduler, db):
+    """Adds the daily agenda jobs to an APScheduler scheduler and loads today's agendas.
+
+    AGENDA_DIGESTS=false turns the whole feature off.
+    """
+    if os.environ.get("AGENDA_DIGESTS", "true").lower() != "true":
+        return None
+
+    builder = DailyAgendaBuilder(db, listen=os.environ.get("AGENDA_DIGEST_LISTENERS", "true").lower() == "true")
+    try:
+        builder.start()
+    except Exception as e:
+        logger.warning("⚠ Initial daily agenda load failed, will retry at the next rollover: %s", e)
+
+    scheduler.add_job(func=builder.flush, trigger="interval",
+                      seconds=int(os.environ.get("AGENDA_DIGEST_FLUSH_SECONDS", 5)), id="agenda_flush")
+    # day_bounds() days are UTC days
+    scheduler.add_job(func=builder.roll_over, trigger="cron", hour=0, minute=0, timezone=pytz.utc,
+                      id="agenda_rollover")
+    if not builder.listen:
+        scheduler.add_job(func=builder.rebuild, trigger="interval",
+                          minutes=int(os.environ.get("AGENDA_DIGEST_REBUILD_MINUTES", 15)), id="agenda_rebuild")
+    scheduler.add_job(func=lambda: send_morning_digests(db), trigger="cron",
+                      hour=int(os.environ.get("AGENDA_DIGEST_HOUR", 8)), minute=0, timezone=get_timezone(),
+                      id="morning_digest")
+    return builder
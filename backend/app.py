@@ -1,85 +1,136 @@
-import requests
+import contextvars
+import functools
+import io
 import json
 import os
-from flask import Flask, request, jsonify
-import firebase_admin
-from firebase_admin import credentials, firestore
+import tempfile
+import threading
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 from datetime import datetime, timedelta
 import pytz
 import random
 from flask_cors import CORS
-from dateutil import parser
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
-import uuid
-from google.cloud.firestore_v1 import FieldFilter
-
-app = Flask(__name__)
-CORS(app)
-
-def check_and_send_reminders():
-    now = datetime.utcnow()
-    print(f"🔍 Checking reminders at {now}")
-
-    # First: Check EVENTS
-    events_ref = db.collection('events')
-    upcoming_events = events_ref \
-    .where('reminderTime', '<=', now) \
-    .where('reminderSent', '==', False) \
-    .stream()
-
-    for event in upcoming_events:
-        data = event.to_dict()
-        token = data.get('token')
-        title = "⏰ Reminder: " + data.get('title', 'No Title')
-        body = "Your event is starting soon!"
-
-        if token:
-            send_fcm_notification(token, title, body)
-            print(f"✅ Reminder sent for event: {data.get('title')}")
-            event.reference.update({'reminderSent': True})
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from holiday_cache import HolidayCache
+from tithi_cache import TithiCache
+from task_store import TASK_COLLECTIONS, query_tasks
+from user_cache import UserAgendaCache
+from agenda_digest import AgendaDigests
+from intents import IntentRouter, DialogflowRequest, fulfillment
+from pagination import ListReply, Cursor, EXPIRED_REPLY, PAGE_ITEMS
+from device_tokens import registry as device_registry
+import bulk_transfer
+from free_slots import (BusyIndex, AvailabilityReply, busy_intervals, first_free_during_work, working_hours,
+                        span_label, DEFAULT_SLOT_MINUTES, LOOKBACK)
+from temporal import (get_timezone, parse_datetime, parse_date_time, extract_date, duration_delta,
+                      format_when, today, TimeRange)
+from lazy import LazyProxy, resolve, created
+import logging
+from log_config import setup_logging, new_request_id, log_payload, request_id_var
+import metrics
+import queries
+from recurrence import user_series, with_occurrences
+from itertools import islice
+
+# 💤 Importing this module only defines things: logging, tracing, Firebase, the HTTP
+# session and the schedulers are set up on first use or by create_app(), so importers
+# (asgi.py, reminder_worker.py, scripts) stay cheap. firebase_admin, google.cloud,
+# requests and apscheduler are imported there too.
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("taskmate", __name__)
+
+_firebase_lock = threading.Lock()
+
+
+def init_firebase():
+    """Initializes the default Firebase app the first time it's needed."""
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+
+        if "GOOGLE_APPLICATION_CREDENTIALS_JSON" in os.environ:
+            cred_info = json.loads(os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"])
+            cred = credentials.Certificate(cred_info)
         else:
-            print("⚠ No FCM token available for event reminder")
+            cred = credentials.Certificate("dialogflow-key.json")  # fallback for local testing
+        return firebase_admin.initialize_app(cred)
+
+
+# 🔐 Endpoints that act on one user's data take their Firebase ID token: Authorization: Bearer <token>
+def verified_uid():
+    """The uid in the request's Firebase ID token, or None when there's none or it doesn't verify."""
+    scheme, _, id_token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not id_token.strip():
+        return None
+    from firebase_admin import auth
+
+    try:
+        return auth.verify_id_token(id_token.strip(), app=init_firebase())['uid']
+    except (ValueError, auth.InvalidIdTokenError, auth.UserDisabledError, auth.CertificateFetchError) as e:
+        logger.warning("🔐 Rejected an ID token: %s", e)
+        return None
+
+
+def signed_in(view):
+    """Calls the view with the signed-in user's uid first; 401 without a valid ID token."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        uid = verified_uid()
+        if uid is None:
+            return jsonify({"error": "Expected 'Authorization: Bearer <Firebase ID token>'"}), 401
+        return view(uid, *args, **kwargs)
+    return wrapper
+
+
+def not_your_data():
+    return jsonify({"error": "user_id doesn't match the signed-in user"}), 403
+
+
+def _create_firestore_client():
+    from firebase_admin import firestore
 
+    init_firebase()
+    return firestore.client()
 
-    # Second: Check TASKS (all 4 collections)
-    task_collections = ["tasks_self", "tasks_team", "tasks_family", "tasks_self_work"]
 
-    for collection_name in task_collections:
-        tasks_ref = db.collection(collection_name)
-        upcoming_tasks = tasks_ref \
-        .where('reminderTime', '<=', now) \
-        .where('reminderSent', '==', False) \
-        .stream()\
+def _create_job_store():
+    from notification_jobs import create_job_store
+    return create_job_store(db)
 
 
-        for task in upcoming_tasks:
-            data = task.to_dict()
-            token = data.get('token')
-            title = "📝 Task Reminder: " + data.get('title', 'No Title')
-            body = "Don't forget your task: " + data.get('title', 'No Title')
+# 🔹 Firestore, created on the first query
+db = LazyProxy(_create_firestore_client, "firestore")
 
-            if token:
-                send_fcm_notification(token, title, body)
-                print(f"✅ Reminder sent for task: {data.get('title')} from {collection_name}")
-                task.reference.update({'reminderSent': True})
-            else:
-                print(f"⚠ No FCM token available for task reminder in {collection_name}")
+# 🗂 Per-user events/tasks for today ± AGENDA_CACHE_DAYS, answered from memory by the chat intents
+agenda_cache = UserAgendaCache(
+    db,
+    max_users=int(os.environ.get("AGENDA_CACHE_USERS", 1000)),
+    ttl_seconds=int(os.environ.get("AGENDA_CACHE_TTL_SECONDS", 60)),
+    window_days=int(os.environ.get("AGENDA_CACHE_DAYS", 7)),
+    listen=os.environ.get("AGENDA_CACHE_LISTENERS", "false").lower() == "true",
+)
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=check_and_send_reminders, trigger="interval", seconds=60)
-scheduler.start()
+# 🗓 Today's precomputed per-user agendas, kept up to date by the scheduler process
+agenda_digests = AgendaDigests(db, enabled=os.environ.get("AGENDA_DIGESTS", "true").lower() == "true")
 
 
-# 🔹 Initialize Firebase
-if "GOOGLE_APPLICATION_CREDENTIALS_JSON" in os.environ:
-    cred_info = json.loads(os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"])
-    cred = credentials.Certificate(cred_info)
-else:
-    cred = credentials.Certificate("dialogflow-key.json")  # fallback for local testing
+def invalidate_user(user_id):
+    """Drops what's cached about a user's events and tasks after the backend writes to them."""
+    agenda_cache.invalidate(user_id)
+    agenda_digests.invalidate(user_id)
+
+
+# 📬 Durable store behind /schedule_notification
+notification_store = LazyProxy(_create_job_store, "notification_store")
 
-firebase_admin.initialize_app(cred)
-db = firestore.client()
 
 # 🌍 Calendarific API Key (For Major Festivals)
 CALENDARIFIC_API_KEY = os.environ.get("CALENDARIFIC_API_KEY")
@@ -92,106 +143,637 @@ CALENDARIFIC_URL = "https://calendarific.com/api/v2/holidays"
 ASTROLOGY_URL = "https://json.freeastrologyapi.com/tithi-durations"
 
 
-@app.route('/')
+def _create_http_client():
+    from http_client import OutboundClient
+
+    client = OutboundClient(pool_size=int(os.environ.get("HTTP_POOL_SIZE", 10)))
+    # Each call, retries included, ends within its deadline — inside Dialogflow's 5s webhook budget
+    deadline = float(os.environ.get("UPSTREAM_DEADLINE_SECONDS", 4.5))
+    client.register("calendarific", CALENDARIFIC_URL, timeout=(3.05, 4), deadline=deadline)
+    client.register("astrology", ASTROLOGY_URL, timeout=(3.05, 4), deadline=deadline)
+    return client
+
+
+# 🔌 Pooled keep-alive client for the holiday APIs, with per-host timeouts + circuit breakers
+http = LazyProxy(_create_http_client, "http")
+
+
+def fetch_calendarific_year(country, year):
+    """Downloads the full Calendarific holiday list for one country and year."""
+    response = http.get(CALENDARIFIC_URL, params={"api_key": CALENDARIFIC_API_KEY, "country": country, "year": year})
+    data = response.json()
+
+    if "response" not in data or "holidays" not in data["response"]:
+        # Raise so an error payload never gets cached as "no holidays"
+        raise ValueError(f"Unexpected Calendarific response: {data.get('meta', data)}")
+
+    return data["response"]["holidays"]
+
+
+# 📦 Holidays are cached per (country, year) — a date lookup is just a dict probe
+holiday_cache = HolidayCache(
+    loader=fetch_calendarific_year,
+    ttl_seconds=int(os.environ.get("HOLIDAY_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+    snapshot_dir=os.environ.get("HOLIDAY_CACHE_DIR"),  # optional on-disk snapshot
+)
+
+
+# 🕉 Tithis are computed for a fixed observation point
+TITHI_LATITUDE = 19.0760  # Example: Mumbai
+TITHI_LONGITUDE = 72.8777  # Example: Mumbai
+TITHI_TIMEZONE = 5.5  # IST
+
+
+def fetch_tithi(date, latitude, longitude, timezone):
+    """Asks the Free Astrology API for the tithi at noon on an ISO date (YYYY-MM-DD)."""
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": ASTROLOGY_API_KEY  # ✅ Free Astrology API Key
+    }
+    payload = {
+        "year": int(date[:4]),
+        "month": int(date[5:7]),
+        "date": int(date[8:10]),
+        "hours": 12,
+        "minutes": 0,
+        "seconds": 0,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timezone": timezone,
+        "config": {
+            "observation_point": "topocentric",
+            "ayanamsha": "lahiri"
+        }
+    }
+    response = http.post(ASTROLOGY_URL, headers=headers, json=payload)
+    data = response.json()
+
+    log_payload(logger, "📢 Free Astrology API raw response", data)
+
+    # ✅ Ensure 'output' exists and is a string; raise otherwise so errors aren't memoized
+    if "output" not in data or not isinstance(data["output"], str):
+        raise ValueError("Unexpected Free Astrology API response format!")
+
+    output_json = json.loads(data["output"])  # ✅ Convert string to JSON
+    tithi_name = output_json.get("name", "Unknown Tithi")  # Extract Tithi name
+    return tithi_name if tithi_name != "Unknown Tithi" else None
+
+
+# 📦 A (date, place) always maps to the same tithi, so memoize and coalesce lookups
+tithi_cache = TithiCache(loader=fetch_tithi, maxsize=int(os.environ.get("TITHI_CACHE_SIZE", 1024)))
+
+
+def warm_tithi_cache():
+    """Prefetches tomorrow's month so the midnight burst of holiday chats hits the cache."""
+    tomorrow = datetime.today() + timedelta(days=1)
+    tithi_cache.prefetch_month(tomorrow.year, tomorrow.month, TITHI_LATITUDE, TITHI_LONGITUDE, TITHI_TIMEZONE)
+
+
+# 🕉 Every web process has its own tithi cache, so each one schedules its own nightly
+# prefetch, whether or not it also runs the reminder jobs
+cache_scheduler = None
+_cache_scheduler_lock = threading.Lock()
+
+
+def start_cache_jobs():
+    global cache_scheduler
+    with _cache_scheduler_lock:
+        if cache_scheduler is not None:
+            return
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        background = BackgroundScheduler()
+        background.add_job(func=warm_tithi_cache, trigger="cron", hour=23, minute=0, id="warm_tithi_cache")
+        background.start()
+        cache_scheduler = background
+
+
+# ⏰ Reminder sweeps and notification dispatch run in one designated process: the
+# reminder_worker.py process, or (with RUN_REMINDER_SCHEDULER=true, the default) the
+# first web worker on the host to take SCHEDULER_LOCK_FILE.
+scheduler = None
+reminder_timer = None
+_scheduler_lock_file = None
+
+
+def add_background_jobs(target_scheduler):
+    """Adds the reminder, scheduled-notification and daily agenda jobs to an APScheduler scheduler."""
+    from reminder_timer import schedule_reminder_jobs
+    from notification_jobs import schedule_notification_jobs
+    from agenda_digest import schedule_agenda_jobs
+
+    timer = schedule_reminder_jobs(target_scheduler, resolve(db))
+    schedule_notification_jobs(target_scheduler, resolve(notification_store), resolve(db))
+    schedule_agenda_jobs(target_scheduler, resolve(db))
+    return timer
+
+
+def start_scheduler():
+    """Starts the background jobs in this process unless another process on the host has them."""
+    global scheduler, reminder_timer
+    if scheduler is not None or not _take_scheduler_lock():
+        return False
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    background = BackgroundScheduler()
+    reminder_timer = add_background_jobs(background)
+    background.start()
+    scheduler = background
+    logger.info("⏰ Background jobs started in process %d", os.getpid())
+    return True
+
+
+def _take_scheduler_lock():
+    global _scheduler_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        return True  # no flock on this platform; every process runs the jobs, claims keep sends unique
+
+    path = os.environ.get("SCHEDULER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "taskmate-scheduler.lock"))
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logger.info("⏰ Background jobs already run by another process on this host")
+        return False
+    _scheduler_lock_file = lock_file  # held (and the lock with it) for the life of the process
+    return True
+
+
+# 🔥 Warm-up: create the clients and fill the holiday caches before the first chat needs them
+_warm_up_state = {}  # step -> "pending" | "ok" | "error: <type>"
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def warm_up():
+    """Creates the Firestore and HTTP clients and loads today's holidays and tithi."""
+    today = datetime.today().strftime('%Y-%m-%d')
+    steps = [
+        ("firestore", lambda: resolve(db)),
+        ("notification_store", lambda: resolve(notification_store)),
+        ("http", lambda: resolve(http)),
+        ("holidays", lambda: _warm_holidays(today)),
+        ("tithis", lambda: tithi_cache.get(today, TITHI_LATITUDE, TITHI_LONGITUDE, TITHI_TIMEZONE)),
+    ]
+    for name, _ in steps:
+        _warm_up_state.setdefault(name, "pending")
+
+    started = time.monotonic()
+    for name, step in steps:
+        try:
+            step()
+            _warm_up_state[name] = "ok"
+        except Exception as e:
+            _warm_up_state[name] = f"error: {type(e).__name__}"
+            logger.warning("⚠ Warm-up step %s failed: %s", name, e)
+    logger.info("🔥 Warm-up finished in %.2fs", time.monotonic() - started)
+
+
+def _warm_holidays(today):
+    holiday_cache.get("IN", today)
+    if not len(holiday_cache):  # the cache answers {} rather than raising when Calendarific is down
+        raise RuntimeError("Calendarific unavailable")
+
+
+def start_warm_up():
+    """Runs warm_up() once, on a background thread."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            _warm_up_thread.start()
+
+
+def readiness():
+    # Upstream holiday APIs being down doesn't make us unready — those replies degrade on their own
+    required = ("firestore", "notification_store", "http")
+    ready = all(_warm_up_state.get(step) == "ok" for step in required)
+    return {
+        "ready": ready,
+        "warm_up": dict(_warm_up_state),
+        "clients": {"firestore": created(db), "notification_store": created(notification_store),
+                    "http": created(http)},
+        "caches": {"agenda_users": agenda_cache.stats()["users"], "device_users": device_registry.stats()["users"],
+                   "holiday_years": len(holiday_cache), "tithis": len(tithi_cache)},
+        "scheduler": "running" if scheduler is not None else "not in this process",
+    }
+
+
+def create_app():
+    """Builds the Flask app: sets up logging and tracing, registers the routes, then starts
+    warm-up (WARM_ON_START, default true), the nightly tithi prefetch (TITHI_PREFETCH,
+    default true) and the background jobs (RUN_REMINDER_SCHEDULER, default true) for this process."""
+    setup_logging()
+    metrics.setup_tracing()
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    flask_app.register_blueprint(bp)
+
+    if os.environ.get("WARM_ON_START", "true").lower() == "true":
+        start_warm_up()
+    if os.environ.get("TITHI_PREFETCH", "true").lower() == "true":
+        start_cache_jobs()
+    # ⏰ Set RUN_REMINDER_SCHEDULER=false on web workers when reminder_worker.py runs the reminders
+    if os.environ.get("RUN_REMINDER_SCHEDULER", "true").lower() == "true":
+        start_scheduler()
+    return flask_app
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """The process-wide app, created on first call."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+        return _app
+
+
+def __getattr__(name):
+    # `gunicorn app:app` keeps working: the app is built when the server first asks for it
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@bp.before_app_request
+def assign_request_id():
+    new_request_id(request.headers.get("X-Request-ID"))
+
+
+@bp.after_app_request
+def echo_request_id(response):
+    response.headers["X-Request-ID"] = request_id_var.get()
+    return response
+
+
+@bp.route('/')
 def home():
     return 'Server is alive!'
 
-@app.route('/schedule_notification', methods=['POST'])
-def handle_schedule_notification():
-    print('🚀 Received POST /schedule_notification')
+@bp.route('/health', methods=['GET'])
+def health():
+    """Readiness: 200 once the clients exist and warm-up has run, 503 while still warming."""
+    start_warm_up()  # a no-op unless WARM_ON_START=false and this is the first check
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint: intents, Firestore queries, upstream APIs and background jobs."""
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+# 📬 One-off notifications — each job belongs to the signed-in user who scheduled it
+NOTIFICATION_BULK_MAX = int(os.environ.get("NOTIFICATION_BULK_MAX", 500))
+
+
+def parse_notification_request(data, uid):
+    """Turns a notification payload into an (owner, token, title, body, send_at, idempotency_key) job."""
+    send_time = parse_datetime(data['send_time'])
+    return uid, data['token'], data['title'], data['body'], send_time, data.get('idempotency_key')
+
+
+def public_job(job):
+    """A job as its owner sees it: the device token it goes to stays on the server."""
+    return {key: value for key, value in job.items() if key not in ("token", "owner")}
+
+
+@bp.route('/schedule_notification', methods=['POST'])
+@signed_in
+def handle_schedule_notification(uid):
+    logger.info('🚀 Received POST /schedule_notification')
     data = request.get_json()
-    print(f"📥 Received data: {data}")
+    log_payload(logger, "📥 Received data", data)
 
     try:
-        token = data['token']
-        title = data['title']
-        body = data['body']
-        send_time = parser.isoparse(data['send_time'])
+        owner, token, title, body, send_time, key = parse_notification_request(data, uid)
+        key = key or request.headers.get('Idempotency-Key')
 
-        print(f"📅 Scheduling notification with: token={token}, title={title}, body={body}, send_time={send_time}")
+        logger.info("📅 Scheduling notification %r for %s", title, send_time)
 
-        schedule_notification(token, title, body, send_time)
+        job, created = notification_store.add_many([(owner, token, title, body, send_time, key)])[0]
 
-        print('✅ Notification scheduled successfully.')
-        return jsonify({"status": "Scheduled", "send_time": send_time.isoformat()})
+        logger.info('✅ Notification scheduled successfully.' if created else '♻ Notification already scheduled.')
+        return jsonify({"status": "Scheduled", "send_time": job["send_time"], "job_id": job["job_id"]})
 
     except Exception as e:
-        print(f"❌ Error in schedule_notification: {e}")
+        logger.warning("❌ Error in schedule_notification: %s", e)
         return jsonify({"error": str(e)}), 400
 
 
-# ✅ Function to Fetch Festivals from Both APIs
-def get_festivals(date):
-    """Fetches holidays for a given date from Calendarific & Free Astrology API."""
-    
-    if isinstance(date, int):  # ✅ Ensure date is a string
-        date = str(date)
+@bp.route('/schedule_notifications/bulk', methods=['POST'])
+@signed_in
+def handle_bulk_schedule_notifications(uid):
+    """Schedules many notifications in one POST: {"notifications": [{token, title, body, send_time}, ...]}."""
+    notifications = (request.get_json() or {}).get('notifications')
+    if not isinstance(notifications, list) or not notifications:
+        return jsonify({"error": "Expected a non-empty 'notifications' list"}), 400
+    if len(notifications) > NOTIFICATION_BULK_MAX:
+        return jsonify({"error": f"At most {NOTIFICATION_BULK_MAX} notifications per request"}), 413
 
-    year = date[:4]  # Extract year
-    month = date[5:7]  # Extract month
-    day = date[8:10]  # Extract day
+    try:
+        jobs = [parse_notification_request(item, uid) for item in notifications]
+    except Exception as e:
+        logger.warning("❌ Error in bulk schedule_notifications: %s", e)
+        return jsonify({"error": f"Invalid notification: {e}"}), 400
 
-    holidays = []
+    results = notification_store.add_many(jobs)
+    logger.info("✅ Scheduled %d/%d notifications in bulk", sum(created for _, created in results), len(results))
+    return jsonify({"status": "Scheduled", "jobs": [
+        {"job_id": job["job_id"], "send_time": job["send_time"], "created": created} for job, created in results
+    ]})
 
-    # 🔹 Fetch from Calendarific API
-    try:
-        calendarific_response = requests.get(f"{CALENDARIFIC_URL}?api_key={CALENDARIFIC_API_KEY}&country=IN&year={year}")
-        data = calendarific_response.json()
-        print("📢 Calendarific API Response:", json.dumps(data, indent=2))
 
-        if "response" in data and "holidays" in data["response"]:
-            holidays += [h['name'] for h in data["response"]["holidays"] if h['date']['iso'] == date]
-    except Exception as e:
-        print(f"⚠ Error fetching Calendarific holidays: {e}")
+# Someone else's job answers 404, the same as a missing one, so job ids can't be probed
+@bp.route('/schedule_notification/<job_id>', methods=['GET'])
+@signed_in
+def get_scheduled_notification(uid, job_id):
+    job = notification_store.get(job_id, uid)
+    if not job:
+        return jsonify({"error": "Notification not found"}), 404
+    return jsonify(public_job(job))
 
-    # 🔹 Fetch from Free Astrology API (For Hindu Tithi-based events)
+
+@bp.route('/schedule_notification/<job_id>', methods=['DELETE'])
+@signed_in
+def cancel_scheduled_notification(uid, job_id):
+    if not notification_store.cancel(job_id, uid):
+        return jsonify({"error": "No pending notification with that id"}), 404
+    return jsonify({"status": "Cancelled", "job_id": job_id})
+
+
+@bp.route('/schedule_notification/<job_id>', methods=['PATCH'])
+@signed_in
+def reschedule_notification(uid, job_id):
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": ASTROLOGY_API_KEY  # ✅ Free Astrology API Key
-        }
-        payload = {
-            "year": int(year),
-            "month": int(month),
-            "date": int(day),
-            "hours": 12,
-            "minutes": 0,
-            "seconds": 0,
-            "latitude": 19.0760,  # Example: Mumbai
-            "longitude": 72.8777,  # Example: Mumbai
-            "timezone": 5.5,  # IST
-            "config": {
-                "observation_point": "topocentric",
-                "ayanamsha": "lahiri"
-            }
-        }
-        response = requests.post(ASTROLOGY_URL, headers=headers, json=payload)
-        data = response.json()
+        send_time = parse_datetime(request.get_json()['send_time'])
+    except Exception as e:
+        return jsonify({"error": f"Invalid send_time: {e}"}), 400
+
+    if not notification_store.reschedule(job_id, uid, send_time):
+        return jsonify({"error": "No pending notification with that id"}), 404
+    return jsonify({"status": "Rescheduled", "job_id": job_id, "send_time": send_time.isoformat()})
+
+
+# 📱 Device tokens — the app registers each device's FCM token (and every refresh of it) once
+def parse_device_request(data, uid):
+    """(user_id, token) from a signed-in user's device request; raises ValueError when the
+    token is missing and PermissionError when user_id names someone else."""
+    user_id, token = data.get('user_id', uid), data.get('token')
+    if not isinstance(token, str) or not token:
+        raise ValueError("Expected 'token'")
+    if user_id != uid:
+        raise PermissionError
+    return user_id, token
+
+
+@bp.route('/devices', methods=['POST'])
+@signed_in
+def register_device(uid):
+    """Registers a device to the signed-in user: {"token", "platform"?, "replaces"?: the token it
+    was refreshed from, "user_id"?: their own}."""
+    data = request.get_json() or {}
+    try:
+        user_id, token = parse_device_request(data, uid)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except PermissionError:
+        return not_your_data()
 
-        print("📢 Free Astrology API Raw Response:", json.dumps(data, indent=2))  # ✅ Debugging
+    device_registry.register(db, user_id, token, platform=data.get('platform'), replaces=data.get('replaces'))
+    return jsonify({"status": "Registered"})
 
-        # ✅ Ensure 'output' exists and is a string
-        if "output" in data and isinstance(data["output"], str):
-            output_json = json.loads(data["output"])  # ✅ Convert string to JSON
 
-            print("📌 Parsed Output:", json.dumps(output_json, indent=2))  # ✅ Debugging
+@bp.route('/devices', methods=['DELETE'])
+@signed_in
+def unregister_device(uid):
+    """Removes one of the signed-in user's devices on sign-out: {"token"}."""
+    try:
+        user_id, token = parse_device_request(request.get_json() or {}, uid)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except PermissionError:
+        return not_your_data()
+
+    if not device_registry.unregister(db, user_id, token):
+        return jsonify({"error": "No such device for this user"}), 404
+    return jsonify({"status": "Unregistered"})
+
+
+# 📦 Bulk import/export — streamed both ways, so file size doesn't matter
+@bp.route('/imports', methods=['POST'])
+@signed_in
+def start_import(uid):
+    """Reserves an import for the signed-in user before the upload: {"source"?} -> its progress,
+    with importId."""
+    data = request.get_json(silent=True) or {}
+    if data.get('user_id', uid) != uid:
+        return not_your_data()
+    return jsonify(bulk_transfer.start_import(db, uid, source=data.get('source'))), 201
+
+
+@bp.route('/import', methods=['POST'])
+@signed_in
+def import_data(uid):
+    """Imports an iCalendar or NDJSON request body into the signed-in user's events and tasks:
+    ?format=ics|ndjson[&collection=tasks_self][&timezone=][&import_id=][&user_id=, their own].
+    The import_id (or an X-Import-Id header) comes from POST /imports, or is any id the
+    client picks; posting the same file with it again resumes an interrupted import."""
+    user_id = request.args.get('user_id', uid)
+    if user_id != uid:
+        return not_your_data()
+    format = request.args.get('format') or bulk_transfer.guess_format(request.content_type)
+    collection = request.args.get('collection', 'tasks_self')
+    if format not in bulk_transfer.FORMATS or collection not in TASK_COLLECTIONS:
+        return jsonify({"error": "Expected format=ics|ndjson and a tasks_* collection"}), 400
+
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace")
+    records = bulk_transfer.parse_records(lines, format, collection, request.args.get('timezone'))
+    try:
+        import_id = request.args.get('import_id') or request.headers.get('X-Import-Id')
+        progress = bulk_transfer.import_records(db, user_id, records, import_id, source=request.args.get('source'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    invalidate_user(user_id)
+    return jsonify(progress)
+
+
+@bp.route('/import/<import_id>', methods=['GET'])
+@signed_in
+def get_import(uid, import_id):
+    snapshot = db.collection(bulk_transfer.IMPORTS_COLLECTION).document(import_id).get()
+    # Someone else's import is "not found" too, so ids can't be probed
+    if not snapshot.exists or snapshot.to_dict().get("userId") != uid:
+        return jsonify({"error": "Import not found"}), 404
+    return jsonify(snapshot.to_dict())
+
+
+@bp.route('/export', methods=['GET'])
+@signed_in
+def export_data(uid):
+    """Streams the signed-in user's events and tasks: ?[format=ndjson|ics][&user_id=, their own]."""
+    user_id = request.args.get('user_id', uid)
+    if user_id != uid:
+        return not_your_data()
+    format = request.args.get('format', 'ndjson')
+    if format not in bulk_transfer.FORMATS:
+        return jsonify({"error": "Expected format=ics|ndjson"}), 400
+
+    filename = f"taskmate-{user_id}.{format}"
+    return Response(stream_with_context(bulk_transfer.export_chunks(db, user_id, format)),
+                    mimetype=bulk_transfer.FORMATS[format],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# 🟢 Free/busy for one user, or the windows a whole team has free (e.g. to place a tasks_team task)
+FREE_SLOT_MAX_DAYS = int(os.environ.get("FREE_SLOT_MAX_DAYS", 31))
+FREE_SLOT_MAX_TEAM = int(os.environ.get("FREE_SLOT_MAX_TEAM", 50))
+free_slot_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("FREE_SLOT_POOL_SIZE", 8)),
+                                    thread_name_prefix="free-slots")
+
+
+def parse_free_slot_request(data):
+    """(start, end, slot length) from a free-slot request; raises KeyError/ValueError when invalid."""
+    if not isinstance(data['start'], str) or not isinstance(data['end'], str):
+        raise ValueError("start and end must be ISO 8601 strings")
+    start_time = parse_datetime(data['start']).astimezone(pytz.utc)
+    end_time = parse_datetime(data['end']).astimezone(pytz.utc)
+    if not start_time < end_time <= start_time + timedelta(days=FREE_SLOT_MAX_DAYS):
+        raise ValueError(f"end must be after start and at most {FREE_SLOT_MAX_DAYS} days later")
+    minutes = data.get('duration_minutes', DEFAULT_SLOT_MINUTES)
+    if isinstance(minutes, bool) or not isinstance(minutes, (int, float, str)):
+        raise ValueError("duration_minutes must be a number")
+    minutes = float(minutes)
+    # Also turns away inf and nan, which no timedelta can hold
+    if not 0 < minutes <= FREE_SLOT_MAX_DAYS * 24 * 60:
+        raise ValueError(f"duration_minutes must be positive and at most {FREE_SLOT_MAX_DAYS} days")
+    return start_time, end_time, timedelta(minutes=minutes)
+
+
+def windows_json(windows):
+    return [{"start": start.isoformat(), "end": end.isoformat()} for start, end in windows]
+
+
+@bp.route('/free_slots', methods=['GET'])
+@signed_in
+def get_free_slots(uid):
+    """The signed-in user's free/busy: ?start=&end=[&duration_minutes=60][&user_id=, their own]."""
+    user_id = request.args.get('user_id', uid)
+    if user_id != uid:
+        return not_your_data()
+    try:
+        start_time, end_time, length = parse_free_slot_request(request.args)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+
+    index = busy_index(user_id, start_time - LOOKBACK, end_time)
+    slot = index.first_free(start_time, end_time, length)
+    return jsonify({
+        "free": index.is_free(start_time, end_time),
+        "busy": [busy.to_json() for busy in index.conflicts(start_time, end_time)],
+        "first_free": windows_json([slot])[0] if slot else None,
+        "free_windows": windows_json(index.free_windows(start_time, end_time, length)),
+    })
+
+
+# 👥 teams/{team id}: {"name", "members": [uid, ...]} — who may see whose free time
+TEAMS_COLLECTION = "teams"
+
+
+def teammates(uid):
+    """Everyone who shares a team with `uid`, themselves included."""
+    # Single-field index on members (automatic)
+    query = db.collection(TEAMS_COLLECTION).where(filter=queries.field_filter("members", "array_contains", uid))
+    members = {uid}
+    for snapshot in metrics.stream_query(query, TEAMS_COLLECTION, "teammates"):
+        members.update(member for member in snapshot.to_dict().get("members") or () if isinstance(member, str))
+    return members
+
+
+@bp.route('/free_slots/team', methods=['POST'])
+@signed_in
+def get_team_free_slots(uid):
+    """Windows every member has free: {"user_ids": [...], "start", "end", "duration_minutes"};
+    every one of them has to share a team (see TEAMS_COLLECTION) with the signed-in user."""
+    data = request.get_json() or {}
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids or not all(isinstance(member, str) and member
+                                                                   for member in user_ids):
+        return jsonify({"error": "Expected a non-empty 'user_ids' list"}), 400
+    if len(user_ids) > FREE_SLOT_MAX_TEAM:
+        return jsonify({"error": f"At most {FREE_SLOT_MAX_TEAM} user_ids per request"}), 400
+    try:
+        start_time, end_time, length = parse_free_slot_request(data)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    # Common free windows give away each member's busy time, so only teammates' are combined
+    if not set(user_ids) <= teammates(uid):
+        return jsonify({"error": "Every user_id has to share a team with the signed-in user"}), 403
+
+    # Every member's index is loaded in parallel, then they're merged into one
+    futures = [free_slot_pool.submit(contextvars.copy_context().run, busy_index, user_id, start_time - LOOKBACK, end_time)
+               for user_id in dict.fromkeys(user_ids)]
+    team = BusyIndex.union(future.result() for future in futures)
+    windows = team.free_windows(start_time, end_time, length)
+    logger.info("🟢 %d common free windows for %d members", len(windows), len(futures))
+    return jsonify({"members": len(futures), "free_windows": windows_json(windows)})
+
+
+# 🧵 Both holiday sources are queried in parallel, each bounded by its own deadline (seconds)
+holiday_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("HOLIDAY_POOL_SIZE", 8)),
+                                  thread_name_prefix="holidays")
+HOLIDAY_SOURCE_DEADLINES = {
+    "calendarific": float(os.environ.get("CALENDARIFIC_DEADLINE_SECONDS", 3.5)),
+    "astrology": float(os.environ.get("ASTROLOGY_DEADLINE_SECONDS", 3.5)),
+}
 
-            tithi_name = output_json.get("name", "Unknown Tithi")  # Extract Tithi name
 
-            if tithi_name != "Unknown Tithi":  # ✅ Only add valid Tithis
-                holidays.append(tithi_name)
+# ✅ Function to Fetch Festivals from Both APIs
+def get_festivals(date):
+    """Fetches holidays for a given date from Calendarific & Free Astrology API."""
+    
+    if isinstance(date, int):  # ✅ Ensure date is a string
+        date = str(date)
 
-        else:
-            print("⚠ Unexpected Free Astrology API response format!")
+    # 🔹 Ask both sources at once; each gets its own deadline so a slow one only drops its half
+    started = time.monotonic()
+    sources = [
+        ("Calendarific holidays", holiday_pool.submit(holiday_cache.get, "IN", date),
+         HOLIDAY_SOURCE_DEADLINES["calendarific"]),
+        ("Free Astrology API data", holiday_pool.submit(
+            tithi_cache.get, date, TITHI_LATITUDE, TITHI_LONGITUDE, TITHI_TIMEZONE),
+         HOLIDAY_SOURCE_DEADLINES["astrology"]),
+    ]
 
-    except Exception as e:
-        print(f"⚠ Error fetching Free Astrology API data: {e}")
+    results = []
+    for source, future, deadline in sources:
+        try:
+            results.append(future.result(timeout=max(0, deadline - (time.monotonic() - started))))
+        except FutureTimeout:
+            # The call keeps running in the pool and still fills the cache for next time
+            logger.warning("⏳ %s missed its %ss deadline, returning partial results", source, deadline)
+            results.append(None)
+        except Exception as e:
+            logger.warning("⚠ Error fetching %s: %s", source, e)
+            results.append(None)
+
+    calendarific_holidays, tithi_name = results
+    holidays = list(calendarific_holidays or [])
+    if tithi_name:  # ✅ Only add valid Tithis
+        holidays.append(tithi_name)
 
     return holidays  # ✅ Returning a list
 
 
 # ✅ API Endpoint to Fetch Holidays for a Given Date
-@app.route('/holidays', methods=['GET'])
+@bp.route('/holidays', methods=['GET'])
 def get_holidays():
     """Returns holidays for the selected date from both APIs."""
     selected_date = request.args.get("date", datetime.today().strftime('%Y-%m-%d'))  # Default to today
@@ -199,353 +781,422 @@ def get_holidays():
     return jsonify({"date": selected_date, "holidays": holidays})  # ✅ Fixed .get() issue
 
 
-# ✅ Webhook for Dialogflow Integration
-@app.route('/webhook', methods=['POST'])
+# ✅ Webhook for Dialogflow Integration — intents are dispatched through a table with a latency budget
+router = IntentRouter(deadline_seconds=float(os.environ.get("WEBHOOK_DEADLINE_SECONDS", 4.5)))
+
+
+@bp.route('/webhook', methods=['POST'])
 def webhook():
-    req = request.get_json()
-    print("📥 Received full request:",req)  # Debugging
+    df_request = DialogflowRequest.from_json(request.get_json())
+    log_payload(logger, "📥 Received full request", df_request.raw)
+    logger.info("✅ Detected intent: %s", df_request.intent,
+                extra={"fields": {"intent": df_request.intent, "user_id": df_request.user_id}})
+    logger.debug("🔍 Extracted parameters: %s", df_request.parameters)
 
-    user_id = req.get("originalDetectIntentRequest", {}).get("payload", {}).get("userId", None)
-    print(f"Received user ID: {user_id}")
+    return jsonify(fulfillment(df_request, router.dispatch(df_request)))
 
 
-    # Extract intent name
-    intent = req.get("queryResult", {}).get("intent", {}).get("displayName", "")
-    parameters = req.get("queryResult", {}).get("parameters", {})
-    print(f"🧪 Duration parameter: {parameters.get('duration')}")
-    print(f"🧪 Date-time parameter: {parameters.get('date-time')}")  # Debugging
-    print(f"👁 Full parameters received: {parameters}")
+# 🔹 Handle Default Welcome Intent
+@router.intent("Default Welcome Intent")
+def welcome_intent(df_request):
+    return dialogflow_messages_reply(df_request, "Hello! Welcome to my service! How can I assist you today?")
 
 
+# 🔹 Check Events Intent
+@router.intent("check_events")
+def check_events_intent(df_request):
+    logger.debug("📅 Handling check_events with date-time")
+    return fetch_events(df_request.parameters, df_request.user_id, df_request.timezone)
 
-    print(f"✅ Detected intent: {intent}")
-    print(f"🔍 Extracted parameters: {parameters}")
 
-    # 🔹 Handle Default Welcome Intent first
-    if intent == "Default Welcome Intent":
-        messages = req.get("queryResult", {}).get("fulfillmentMessages", [])
+@router.intent("check_events_by_time")
+def check_events_by_time_intent(df_request):
+    logger.debug("🕒 Handling check_events_by_time with duration")
+    return fetch_events_by_time(df_request.parameters, df_request.user_id, df_request.timezone)
 
-        if messages:
-            responses = [msg["text"]["text"][0] for msg in messages if "text" in msg and "text" in msg["text"]]
-            return jsonify({"fulfillmentText": " ".join(responses)})
-        else:
-            return jsonify({"fulfillmentText": "Hello! Welcome to my service! How can I assist you today?"})
-
-    # 🔹 Check Events Intent
-    elif intent == "check_events":
-        print("📅 Handling check_events with date-time")
-        response = fetch_events(parameters)
-        return jsonify({"fulfillmentText": response})
-
-    elif intent == "check_events_by_time":
-        print("🕒 Handling check_events_by_time with duration")
-        response = fetch_events_by_time(parameters)
-        return jsonify({"fulfillmentText": response})
-
-    # 🔹 Get Tasks Intent
-    elif intent == "get_tasks":
-        print("📅 Fetching tasks...")
-        response = get_tasks(parameters)
-        return jsonify({"fulfillmentText": response})
-
-   
-    # 🔹 Get Tasks by Time
-    elif intent == "get_tasks_by_time":
-        print("📅 Checking tasks due in the specified time range...")
-        response = get_tasks_by_time(parameters)
-        return jsonify({"fulfillmentText": response})
-
-    # 🔹 Get Holidays Intent
-    elif intent == "get_holidays":
-        print("🎉 Fetching holiday data...")
-        selected_date = datetime.today().strftime('%Y-%m-%d')
-        holidays = get_festivals(selected_date)
-        return jsonify({"fulfillmentText": f"Today's holidays: {', '.join(holidays) if holidays else 'No holidays today.'}"})
-
-    elif intent == "mundane_intent":
-        print("🧘 Mundane/acknowledgment intent detected.")
-        response = handle_acknowledgment_response(parameters)
-        return jsonify({"fulfillmentText": response})
-
-    # 🔹 Handle Default Fallback Intent
-    elif intent == "Default Fallback Intent":
-        messages = req.get("queryResult", {}).get("fulfillmentMessages", [])
-
-        if messages:
-            responses = [msg["text"]["text"][0] for msg in messages if "text" in msg and "text" in msg["text"]]
-            return jsonify({"fulfillmentText": " ".join(responses)})
-        else:
-            return jsonify({"fulfillmentText": "Sorry, I didn't understand that. Can you rephrase?"})
 
-    # 🔹 Unrecognized Intent (Final Catch-All)
-    print("⚠ Intent not recognized.")
-    return jsonify({"fulfillmentText": "I'm not sure how to help with that. Can you try rephrasing?"})
+# 🔹 Get Tasks Intent
+@router.intent("get_tasks")
+def get_tasks_intent(df_request):
+    logger.debug("📅 Fetching tasks...")
+    return get_tasks(df_request.parameters, df_request.user_id, df_request.timezone)
 
-def fetch_events(parameters):
-    """Handles specific date or time range queries — supports both full-day and time-specific requests."""
-    user_id = request.json.get('originalDetectIntentRequest', {}).get('payload', {}).get('userId')  # 👈 ADD THIS
-    ist = pytz.timezone("Asia/Kolkata")
-    is_range = False
-    user_start_ist_str = ""
-    user_end_ist_str = ""
 
-    try:
-        dt_range = parameters.get("date-time")
+# 🔹 Get Tasks by Time
+@router.intent("get_tasks_by_time")
+def get_tasks_by_time_intent(df_request):
+    logger.debug("📅 Checking tasks due in the specified time range...")
+    return get_tasks_by_time(df_request.parameters, df_request.user_id, df_request.timezone)
 
-        # Normalize structure (list or dict)
-        if isinstance(dt_range, list) and len(dt_range) > 0:
-            dt_range = dt_range[0]
 
-        if isinstance(dt_range, dict) and "startTime" in dt_range and "endTime" in dt_range:
-            # Time range provided by user
-            start_time = parser.isoparse(dt_range["startTime"]).astimezone(pytz.utc)
-            end_time = parser.isoparse(dt_range["endTime"]).astimezone(pytz.utc)
-            is_range = True
+# 🔹 Show More — the next page of the last event/task list
+@router.intent("show_more")
+def show_more_intent(df_request):
+    logger.debug("📄 Resuming a paged list...")
+    resumed = resume_list(df_request)
+    if isinstance(resumed, str):
+        return resumed
+    plan, kind, cursor = resumed
+    return run_plan(plan, {"events": find_events, "tasks": find_tasks}[kind], df_request.user_id,
+                    cursor.intent, cursor.parameters, cursor)
 
-            user_start_ist_str = parser.isoparse(dt_range["startTime"]).astimezone(ist).strftime('%I:%M %p')
-            user_end_ist_str = parser.isoparse(dt_range["endTime"]).astimezone(ist).strftime('%I:%M %p')
 
-            print(f"⏰ Time range: {start_time} to {end_time}")
+# 🔹 Availability — "am I free at 3pm?" and "find me an hour tomorrow"
+@router.intent("check_availability")
+def check_availability_intent(df_request):
+    logger.debug("🟢 Checking availability...")
+    return run_availability(plan_check_availability(df_request.parameters, df_request.timezone), df_request.user_id)
 
-        elif isinstance(dt_range, dict) and "startDate" in dt_range and "endDate" in dt_range:
-            # Date range provided by user (like "next weekend")
-            start_time = parser.isoparse(dt_range["startDate"]).astimezone(pytz.utc)
-            end_time = parser.isoparse(dt_range["endDate"]).astimezone(pytz.utc)
-            is_range = True
 
-            user_start_ist_str = parser.isoparse(dt_range["startDate"]).astimezone(ist).strftime('%d %b %Y')
-            user_end_ist_str = parser.isoparse(dt_range["endDate"]).astimezone(ist).strftime('%d %b %Y')
+@router.intent("find_free_slot")
+def find_free_slot_intent(df_request):
+    logger.debug("🟢 Looking for a free slot...")
+    return run_availability(plan_find_free_slot(df_request.parameters, df_request.timezone), df_request.user_id)
 
-            print(f"📅 Date range: {start_time} to {end_time}")
 
-        elif isinstance(dt_range, str):
-            # Single date without range
-            selected_date = parser.parse(dt_range).date()
-            start_time = datetime.combine(selected_date, datetime.min.time()).replace(tzinfo=pytz.utc)
-            end_time = datetime.combine(selected_date, datetime.max.time()).replace(tzinfo=pytz.utc)
-            print(f"📅 Single date query: {start_time} to {end_time}")
+# 🔹 Get Holidays Intent
+@router.intent("get_holidays")
+def get_holidays_intent(df_request):
+    logger.debug("🎉 Fetching holiday data...")
+    return todays_holidays_reply()
 
-        else:
-            return "To help you better, please specify a date or time range like 'April 25' or 'from 2pm to 6pm'."
 
-    except Exception as e:
-        print(f"❌ Error parsing date-time: {e}")
+@router.intent("mundane_intent")
+def mundane_intent(df_request):
+    logger.debug("🧘 Mundane/acknowledgment intent detected.")
+    return handle_acknowledgment_response(df_request.parameters)
+
+
+# 🔹 Handle Default Fallback Intent
+@router.intent("Default Fallback Intent")
+def fallback_intent(df_request):
+    return dialogflow_messages_reply(df_request, "Sorry, I didn't understand that. Can you rephrase?")
+
+
+def dialogflow_messages_reply(df_request, default):
+    """Echoes the text responses configured on the intent in Dialogflow, if any."""
+    messages = df_request.fulfillment_messages
+    responses = [msg["text"]["text"][0] for msg in messages if "text" in msg and "text" in msg["text"]]
+    return " ".join(responses) if messages else default
+
+
+def todays_holidays_reply():
+    holidays = get_festivals(datetime.today().strftime('%Y-%m-%d'))
+    return f"Today's holidays: {', '.join(holidays) if holidays else 'No holidays today.'}"
+
+
+def find_events(user_id, start_time, end_time, limit=queries.MAX_CHAT_RESULTS):
+    """Returns up to `limit` of a user's event dicts starting between start_time and end_time.
+
+    Ranges inside the cached window around today come from the agenda cache (loaded
+    on a miss). Only when the cache can't answer is today's agenda digest tried (one
+    read); anything else goes to Firestore, which stops reading once `limit` events are in.
+    """
+    events = agenda_cache.events_between(user_id, start_time, end_time)
+    if events is None:
+        events = agenda_digests.events_between(user_id, start_time, end_time)
+    if events is None:
+        plan = queries.events_between(user_id, start_time, end_time)
+        found = with_occurrences(plan.stream(db, max_results=limit), user_series(db, "events", user_id),
+                                 "start", start_time, end_time)
+        events = [event.to_dict() for event in islice(found, limit)]
+    return events[:limit]
+
+
+def find_tasks(user_id, start_time, end_time, limit=queries.MAX_CHAT_RESULTS):
+    """Returns up to `limit` (collection, task dict) pairs due between start_time and end_time,
+    looked up in the same order as find_events."""
+    tasks = agenda_cache.tasks_between(user_id, start_time, end_time)
+    if tasks is None:
+        tasks = agenda_digests.tasks_between(user_id, start_time, end_time)
+    if tasks is None:
+        tasks = [(collection, task.to_dict())
+                 for collection, task in query_tasks(db, user_id, start_time, end_time, max_results=limit)]
+    return tasks[:limit]
+
+
+def run_plan(plan, find, user_id, intent, parameters, cursor=None):
+    """Runs an intent plan: either a ready reply, or a ListReply answered one page at a time."""
+    if isinstance(plan, str):
+        return plan
+    start_time, end_time, limit = plan.read_range(cursor)
+    return plan.page(find(user_id, start_time, end_time, limit), intent, parameters, user_id, cursor)
+
+
+def busy_index(user_id, start_time, end_time):
+    """A BusyIndex covering start_time..end_time: the cached window's, built once per window,
+    or one built from a live read of just this range.
+
+    The agenda digest is never used here: its items carry no end, allDay or completed.
+    """
+    index = agenda_cache.busy_index(user_id, start_time, end_time)
+    if index is None:
+        plan = queries.events_between(user_id, start_time, end_time, name="busy_events",
+                                      fields=queries.BUSY_EVENT_FIELDS)
+        found = with_occurrences(plan.stream(db), user_series(db, "events", user_id), "start", start_time, end_time)
+        tasks = query_tasks(db, user_id, start_time, end_time, max_results=None, fields=queries.BUSY_TASK_FIELDS)
+        index = BusyIndex(busy_intervals([event.to_dict() for event in found],
+                                         [(collection, task.to_dict()) for collection, task in tasks]))
+    return index
+
+
+def run_availability(plan, user_id):
+    """Runs an availability plan: either a ready reply, or an AvailabilityReply answered from a BusyIndex."""
+    if isinstance(plan, str):
+        return plan
+    return plan.answer(busy_index(user_id, *plan.read_range()))
+
+
+def resume_list(df_request):
+    """Works out (plan, "events"|"tasks", cursor) from a show_more request's continuation
+    token, or a ready reply when there's no list to resume."""
+    token = df_request.continuation_token()
+    if not token:
+        return "There's nothing more to show right now — ask me about your events or tasks first. 🙂"
+    try:
+        cursor = Cursor.decode(token)
+    except ValueError as e:
+        logger.warning("⚠ %s", e)
+        return EXPIRED_REPLY
+    if cursor.user_id != df_request.user_id or cursor.intent not in LIST_INTENTS:
+        return EXPIRED_REPLY
+
+    plan_list, kind = LIST_INTENTS[cursor.intent]
+    plan = plan_list(cursor.parameters, cursor.timezone)
+    if isinstance(plan, str):
+        return EXPIRED_REPLY
+    # "Next 3 days" keeps meaning the window of the first page, not one counted from now
+    plan.start_time, plan.end_time = cursor.start_time, cursor.end_time
+    return plan, kind, cursor
+
+
+def fetch_events(parameters, user_id, timezone=None):
+    """Handles specific date or time range queries — supports both full-day and time-specific requests."""
+    return run_plan(plan_fetch_events(parameters, timezone), find_events, user_id, "check_events", parameters)
+
+
+def plan_fetch_events(parameters, timezone=None):
+    """Works out the range for fetch_events and how to word the reply (no I/O here)."""
+    tz = get_timezone(timezone)
+
+    try:
+        time_range = parse_date_time(parameters.get("date-time"))
+    except ValueError as e:
+        logger.warning("❌ Error parsing date-time: %s", e)
         return "Sorry, I couldn’t understand the time range. Could you rephrase it?"
 
-    # Firestore query
-    events_query = db.collection("events") \
-    .where("start", ">=", start_time) \
-    .where("start", "<=", end_time) \
-    .where("userId", "==", user_id) \
-    .stream()
-    events = []
-
-    for event in events_query:
-        data = event.to_dict()
-        event_time = data["start"].astimezone(ist).strftime("%Y-%m-%d %I:%M %p IST")
-        events.append(f"📌 {data['title']}\n📅 When: {event_time}\n📍 Location: {data.get('location', 'Not specified')}\n")
-
-    if not events:
-        if is_range:
-            return f"No events found between {user_start_ist_str} and {user_end_ist_str}. 🎉"
-        else:
-            return "No events found for that day. 📅"
+    if time_range is None:
+        return "To help you better, please specify a date or time range like 'April 25' or 'from 2pm to 6pm'."
+    logger.debug("📅 %s query: %s to %s", time_range.kind, time_range.start, time_range.end)
 
-    summary = (
-        f"Here are your events from {user_start_ist_str} to {user_end_ist_str}:\n\n"
-        if is_range else
-        "Here’s your event list for that day:\n\n"
-    )
+    def render_event(data):
+        event_time = format_when(data["start"], tz)
+        return f"📌 {data['title']}\n📅 When: {event_time}\n📍 Location: {data.get('location', 'Not specified')}\n"
 
-    return summary + "\n".join(events)
+    if time_range.is_range:
+        user_start_str, user_end_str = time_range.labels(tz)
+        empty = f"No events found between {user_start_str} and {user_end_str}. 🎉"
+        summary = f"Here are your events from {user_start_str} to {user_end_str}:\n\n"
+    else:
+        empty = "No events found for that day. 📅"
+        summary = "Here’s your event list for that day:\n\n"
+
+    return ListReply(time_range.start, time_range.end, summary, empty, render_event,
+                     key=lambda data: data["start"], timezone=timezone)
 
 
 
-def get_tasks(parameters):
+def get_tasks(parameters, user_id, timezone=None):
     """Fetches tasks from Firestore based on a time range or a full-day query."""
-    from dateutil import parser
-    user_id = request.json.get('originalDetectIntentRequest', {}).get('payload', {}).get('userId')  # 👈 ADD THIS
-    try:
-        # 1. Handle time-range if Dialogflow sends a startTime & endTime
-        dt_range = parameters.get("date-time")
-        if (
-            isinstance(dt_range, list) and len(dt_range) > 0 and
-            "startTime" in dt_range[0] and "endTime" in dt_range[0]
-        ):
-            start_time = parser.isoparse(dt_range[0]["startTime"]).astimezone(pytz.utc)
-            end_time = parser.isoparse(dt_range[0]["endTime"]).astimezone(pytz.utc)
-            is_range = True
-            print(f"⏰ Using custom time window: {start_time} to {end_time}")
-        else:
-            # 2. Otherwise fallback to full day search
-            selected_date = extract_date(parameters)
-            start_time = datetime.combine(selected_date, datetime.min.time()).replace(tzinfo=pytz.utc)
-            end_time = datetime.combine(selected_date, datetime.max.time()).replace(tzinfo=pytz.utc)
-            is_range = False
-            print(f"📅 Using full day: {start_time} to {end_time}")
-    except Exception as e:
-        print(f"❌ Error parsing date/time: {e}")
-        return "Sorry, I couldn't understand the time you meant. Could you rephrase?"
+    return run_plan(plan_get_tasks(parameters, timezone), find_tasks, user_id, "get_tasks", parameters)
 
-    # 🔍 Query tasks from all relevant collections
-    task_collections = {
-        "tasks_self": "Personal",
-        "tasks_team": "Team",
-        "tasks_family": "Family",
-        "tasks_self_work": "Work"
-    }
 
-    task_list = []
-
-    for collection, label in task_collections.items():
-        tasks_ref = db.collection(collection)
-        tasks_query = db.collection(collection) \
-        .where("DueDate", ">=", start_time) \
-        .where("DueDate", "<=", end_time) \
-        .where("userId", "==", user_id) \
-        .stream()
-
-        for task in tasks_query:
-            task_data = task.to_dict()
-            title = task_data.get("title", "Untitled")
-            due = task_data.get("DueDate")
-            due_str = due.strftime('%Y-%m-%d %I:%M %p') if due else "Unknown time"
-
-            task_list.append(
-                f"📌 {title}\n🕒 Due: {due_str}\n📂 Category: {label}\n"
-            )
-
-    # 🧠 Build final response
-    if not task_list:
-        if is_range:
-            return "You're all clear during that time — no tasks found. 😌"
-        else:
-            return "Looks like you have no tasks scheduled for that day. 📅 Maybe time to chill?"
+def plan_get_tasks(parameters, timezone=None):
+    """Works out the range for get_tasks and how to word the reply (no I/O here)."""
+    tz = get_timezone(timezone)
 
-    # 📝 Summary header
-    summary = (
-        "Here are your tasks between the selected time range:\n\n"
-        if is_range else
-        "Here’s your task list for that day:\n\n"
-    )
+    try:
+        # 1. A time or date range if Dialogflow sent one, 2. otherwise the full day asked about (or today)
+        time_range = parse_date_time(parameters.get("date-time")) or TimeRange.day(extract_date(parameters, tz))
+    except ValueError as e:
+        logger.warning("❌ Error parsing date/time: %s", e)
+        return "Sorry, I couldn't understand the time you meant. Could you rephrase?"
+    logger.debug("📅 Using %s: %s to %s", time_range.kind, time_range.start, time_range.end)
+
+    # 🔍 Tasks from all relevant collections, merged by due date
+    def render_task(item):
+        collection, task_data = item
+        title = task_data.get("title", "Untitled")
+        due_str = format_when(task_data["DueDate"], tz) if task_data.get("DueDate") else "Unknown time"
+        return f"📌 {title}\n🕒 Due: {due_str}\n📂 Category: {TASK_COLLECTIONS[collection]}\n"
+
+    # 🧠 Empty reply and 📝 summary header
+    if time_range.is_range:
+        empty = "You're all clear during that time — no tasks found. 😌"
+        summary = "Here are your tasks between the selected time range:\n\n"
+    else:
+        empty = "Looks like you have no tasks scheduled for that day. 📅 Maybe time to chill?"
+        summary = "Here’s your task list for that day:\n\n"
 
-    return summary + "\n".join(task_list)
+    return ListReply(time_range.start, time_range.end, summary, empty, render_task,
+                     key=lambda item: item[1]["DueDate"], timezone=timezone)
 
 
-def fetch_events_by_time(parameters):
+def fetch_events_by_time(parameters, user_id, timezone=None):
     """Handles queries like 'events in the next X hours/days/minutes' using @sys.duration."""
-    user_id = request.json.get('originalDetectIntentRequest', {}).get('payload', {}).get('userId')  # 👈 ADD THIS
-    ist = pytz.timezone("Asia/Kolkata")
-    start_time = datetime.now(pytz.utc)  # Current time in UTC
+    return run_plan(plan_fetch_events_by_time(parameters, timezone), find_events, user_id,
+                    "check_events_by_time", parameters)
+
+
+def plan_fetch_events_by_time(parameters, timezone=None):
+    """Works out the window for fetch_events_by_time and how to word the reply (no I/O here)."""
+    tz = get_timezone(timezone)
     duration = parameters.get("duration")
     if not duration or "amount" not in duration or "unit" not in duration:
         return "Please tell me how far ahead to check. For example: 'next 2 hours'."
 
-    amount = duration["amount"]
-    unit = duration["unit"].lower()
-
-    # Convert unit to timedelta
-    if unit in ["h", "hour", "hours"]:
-        delta = timedelta(hours=amount)
-    elif unit in ["min", "minute", "minutes"]:
-        delta = timedelta(minutes=amount)
-    elif unit in ["d", "day", "days"]:
-        delta = timedelta(days=amount)
-    else:
+    delta = duration_delta(duration)
+    if delta is None:
         return "I didn't understand the time duration you mentioned. Try saying something like '2 hours' or '3 days'."
+    amount, unit = duration["amount"], duration["unit"].lower()
 
-    now = datetime.now(pytz.utc)
-    end_time = now + delta
-    print(f"⏱ Fetching events from {now} to {end_time}")
+    start_time = datetime.now(pytz.utc)
+    end_time = start_time + delta
+    logger.debug("⏱ Fetching events from %s to %s", start_time, end_time)
 
-    events_query = db.collection("events") \
-    .where("start", ">=", start_time) \
-    .where("start", "<=", end_time) \
-    .where("userId", "==", user_id) \
-    .stream()
+    def render_event(data):
+        event_time = format_when(data["start"], tz)
+        return f"📌 {data['title']}\n📅 When: {event_time}\n📍 Location: {data.get('location', 'Not specified')}\n"
 
-    events = []
+    return ListReply(start_time, end_time,
+                     f"Here’s what’s coming up in the next {amount} {unit}:\n\n",
+                     f"You have no events in the next {amount} {unit}. Enjoy your free time! 😊",
+                     render_event, key=lambda data: data["start"], timezone=timezone)
 
-    for event in events_query:
-        data = event.to_dict()
-        event_time = data["start"].astimezone(ist).strftime("%Y-%m-%d %I:%M %p IST")
-        events.append(f"📌 {data['title']}\n📅 When: {event_time}\n📍 Location: {data.get('location', 'Not specified')}\n")
 
-    if not events:
-        return f"You have no events in the next {amount} {unit}. Enjoy your free time! 😊"
-
-    return f"Here’s what’s coming up in the next {amount} {unit}:\n\n" + "\n".join(events)
 
 
+def get_tasks_by_time(parameters, user_id, timezone=None):
+    """Fetches tasks happening within the specified duration from Firestore."""
+    return run_plan(plan_get_tasks_by_time(parameters, timezone), find_tasks, user_id,
+                    "get_tasks_by_time", parameters)
 
 
-def get_tasks_by_time(parameters):
-    """Fetches tasks happening within the specified duration from Firestore."""
-    user_id = request.json.get('originalDetectIntentRequest', {}).get('payload', {}).get('userId')  # 👈 ADD THIS
-    start_time = datetime.now(pytz.utc)  # Current time in UTC
-    # Extract duration
+def plan_get_tasks_by_time(parameters, timezone=None):
+    """Works out the window for get_tasks_by_time and how to word the reply (no I/O here)."""
+    tz = get_timezone(timezone)
     duration_data = parameters.get("duration")
-    
+
     if not duration_data:
         return "Please specify a time duration, like '30 minutes' or '2 hours'."
 
-    time_duration = duration_data.get("amount", 0)
-    time_unit = duration_data.get("unit", "").lower()
-
-    # Convert duration to timedelta
-    time_units_map = {
-        "h": "hours", "hour": "hours", "hours": "hours",
-        "min": "minutes", "minute": "minutes", "minutes": "minutes"
-    }
-    
-    if time_unit in time_units_map:
-        time_arg = {time_units_map[time_unit]: time_duration}
-        time_delta = timedelta(**time_arg)
-    else:
+    time_delta = duration_delta(duration_data)
+    if time_delta is None:
         return "Oops! I couldn't understand the time duration you provided. Try saying something like '2 hours' or '30 minutes'."
+    time_duration, time_unit = duration_data.get("amount", 0), duration_data.get("unit", "").lower()
 
     # Define time range
-    now = datetime.now(pytz.utc)
-    end_time = now + time_delta
+    start_time = datetime.now(pytz.utc)
+    end_time = start_time + time_delta
+
+    logger.debug("🔍 Searching for tasks due between %s and %s...", start_time, end_time)
+
+    # Firestore task collections, searched together and merged by due date
+    def render_task(item):
+        collection, task_data = item
+        task_due_time = format_when(task_data["DueDate"], tz) if task_data.get("DueDate") else "No due date specified"
+        return f"📌 *{task_data.get('title', 'Unnamed Task')}\n📅 *Due: {task_due_time}\n📂 Category: {TASK_COLLECTIONS[collection]}\n"
+
+    return ListReply(start_time, end_time,
+                     f"Here’s what’s due in the next {time_duration} {time_unit}:\n\n",
+                     f"Great news! You have no pending tasks in the next {time_duration} {time_unit}. Enjoy your free time! 😊",
+                     render_task, key=lambda item: item[1]["DueDate"], timezone=timezone)
+
+
+# 📄 The list intents show_more can resume: intent -> (plan function, what it lists)
+LIST_INTENTS = {
+    "check_events": (plan_fetch_events, "events"),
+    "check_events_by_time": (plan_fetch_events_by_time, "events"),
+    "get_tasks": (plan_get_tasks, "tasks"),
+    "get_tasks_by_time": (plan_get_tasks_by_time, "tasks"),
+}
+
+def plan_check_availability(parameters, timezone=None):
+    """Works out the range an "am I free…?" question is about and how to word the answer (no I/O here)."""
+    tz = get_timezone(timezone)
+    value = parameters.get("date-time")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    length = duration_delta(parameters.get("duration")) or timedelta(minutes=DEFAULT_SLOT_MINUTES)
 
-    print(f"🔍 Searching for tasks due between {now} and {end_time}...")
+    try:
+        if isinstance(value, str) and value:
+            # Here a single date-time is a moment ("at 3pm"), not a whole day
+            start_time = parse_datetime(value).astimezone(pytz.utc)
+            end_time = start_time + length
+        else:
+            time_range = parse_date_time(value)
+            if time_range is None:
+                return "When should I check? Try something like 'Am I free at 3pm tomorrow?'"
+            start_time, end_time = time_range.start, time_range.end
+    except ValueError as e:
+        logger.warning("❌ Error parsing date-time: %s", e)
+        return "Sorry, I couldn't understand the time you meant. Could you rephrase?"
 
-    # Firestore collections to search
-    task_collections = {
-        "tasks_self": "Personal",
-        "tasks_team": "Team",
-        "tasks_family": "Family",
-        "tasks_self_work": "Work"
-    }
-    
-    task_list = []
+    # Read to the end of that working day too, for a "next free slot" suggestion when busy
+    day_end = max(end_time, working_hours(start_time.astimezone(tz).date(), tz)[1])
 
-    for collection, category_name in task_collections.items():
-        tasks_ref = db.collection(collection)
-        tasks_query = db.collection(collection) \
-        .where("DueDate", ">=", start_time) \
-        .where("DueDate", "<=", end_time) \
-        .where("userId", "==", user_id) \
-        .stream()
+    def answer(index):
+        asked = span_label(start_time, end_time, tz)
+        clashes = index.conflicts(start_time, end_time)
+        if not clashes:
+            return f"✅ You're free {asked}."
+        lines = [f"• {busy.title} ({span_label(busy.start, busy.end, tz)})" for busy in clashes[:PAGE_ITEMS]]
+        reply = f"⛔ You're busy {asked}:\n" + "\n".join(lines)
+        slot = index.first_free(start_time, day_end, end_time - start_time)
+        if slot:
+            reply += f"\n\n🟢 You're free again {span_label(*slot, tz)}."
+        return reply
 
+    return AvailabilityReply(start_time, day_end, answer)
 
-        for task in tasks_query:
-            task_data = task.to_dict()
-            task_due_time = task_data.get('DueDate')
 
-            if task_due_time:
-               ist = pytz.timezone("Asia/Kolkata")
-               task_due_time = task_due_time.astimezone(ist).strftime('%Y-%m-%d %I:%M %p IST')
+def plan_find_free_slot(parameters, timezone=None):
+    """Works out where to look for a free slot and how long it must be (no I/O here).
 
-            else:
-                task_due_time = "No due date specified"
+    A time range is searched as given; days are searched within working hours.
+    """
+    tz = get_timezone(timezone)
+    length = duration_delta(parameters.get("duration")) or timedelta(minutes=DEFAULT_SLOT_MINUTES)
 
-            task_list.append(f"📌 *{task_data.get('title', 'Unnamed Task')}\n📅 *Due: {task_due_time}\n📂 Category: {category_name}\n")
+    try:
+        time_range = parse_date_time(parameters.get("date-time")) or TimeRange.day(today(tz))
+    except ValueError as e:
+        logger.warning("❌ Error parsing date-time: %s", e)
+        return "Sorry, I couldn't understand when you meant. Could you rephrase?"
+
+    if time_range.kind == "time":
+        start_time, end_time = time_range.start, time_range.end
+    else:
+        first_day, last_day = ((time_range.start.date(), time_range.end.date()) if time_range.kind == "day"
+                               else (time_range.local_start.date(), time_range.local_end.date()))
+        start_time, end_time = working_hours(first_day, tz)[0], working_hours(last_day, tz)[1]
+    start_time = max(start_time, datetime.now(pytz.utc))
+    if start_time + length > end_time:
+        return "That time's already gone by ⌛ — try a later day or time."
+    minutes = int(length.total_seconds() // 60)
+
+    def answer(index):
+        if time_range.kind == "time":
+            slot = index.first_free(start_time, end_time, length)
+        else:
+            slot = first_free_during_work(index, start_time, end_time, length, tz)
+        if slot is None:
+            return f"😕 I couldn't find a free {minutes}-minute slot {span_label(start_time, end_time, tz)}."
+        return f"🟢 You're free {span_label(*slot, tz)}."
 
-    if not task_list:
-        return f"Great news! You have no pending tasks in the next {time_duration} {time_unit}. Enjoy your free time! 😊"
+    return AvailabilityReply(start_time, end_time, answer)
 
-    return f"Here’s what’s due in the next {time_duration} {time_unit}:\n\n" + "\n".join(task_list)
 
 def handle_acknowledgment_response(parameters):
     responses = [
@@ -560,26 +1211,8 @@ def handle_acknowledgment_response(parameters):
     ]
     return random.choice(responses)
 
-from dateutil import parser
-
-def extract_date(parameters):
-    """Extracts and returns a date object from Dialogflow parameters."""
-    date_str = parameters.get("date-time")
-
-    if isinstance(date_str, list) and len(date_str) > 0:
-        date_str = date_str[0]
-
-    if isinstance(date_str, str):
-        try:
-            return parser.parse(date_str).date()
-        except Exception as e:
-            print(f"❌ Failed to parse date-time: {e}")
-
-    # Default to today's date if parsing fails
-    return datetime.today().date()
-
 def send_fcm_notification(token, title, body):
-    print(f"🚀 Sending FCM notification: token={token}, title={title}, body={body}")
+    logger.info("🚀 Sending FCM notification %r", title)
     from firebase_admin import messaging
 
     try:
@@ -588,18 +1221,18 @@ def send_fcm_notification(token, title, body):
             token=token,
         )
         response = messaging.send(message)
-        print(f"✅ Notification sent: {response}")
+        logger.info("✅ Notification sent: %s", response)
     except Exception as e:
-        print(f"❌ Error sending FCM notification: {e}")
+        logger.error("❌ Error sending FCM notification: %s", e)
 
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
-    print(f"❌ 404 Error: {request.path} not found")
+    logger.warning("❌ 404 Error: %s not found", request.path)
     return jsonify(error=str(e)), 404
 
 
 # ✅ Run Flask API
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    get_app().run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""Async serving mode: `gunicorn asgi:app -k uvicorn.workers.UvicornWorker`.
+
+/webhook is handled natively on the event loop, with Firestore reads going through
+the async Firestore client, so one process can hold many chats waiting on I/O.
+Intents without Firestore reads (holidays included, whose lookups sit behind
+thread-safe caches) reuse the sync handlers on the router's thread pool. Every
+other route is served by the regular Flask app through an ASGI adapter.
+"""
+import asyncio
+import json
+import logging
+from itertools import islice
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    get_app, init_firebase, router as sync_router, agenda_cache, agenda_digests, TASK_COLLECTIONS,
+    plan_fetch_events, plan_fetch_events_by_time, plan_get_tasks, plan_get_tasks_by_time, resume_list,
+    plan_check_availability, plan_find_free_slot,
+)
+from free_slots import BusyIndex, busy_intervals
+from intents import IntentRouter, DialogflowRequest, fulfillment
+from lazy import LazyProxy, resolve
+from log_config import new_request_id
+from queries import (BUSY_EVENT_FIELDS, BUSY_TASK_FIELDS, EVENT_FIELDS, MAX_CHAT_RESULTS, TASK_FIELDS,
+                     events_between, tasks_between)
+from recurrence import auser_series, with_occurrences
+
+logger = logging.getLogger(__name__)
+
+
+def _create_async_client():
+    from firebase_admin import firestore_async
+
+    init_firebase()
+    return firestore_async.client()
+
+
+adb = LazyProxy(_create_async_client, "firestore_async")
+# Built at lifespan startup (or by the first request), not on import, so importing this
+# module doesn't start logging, warm-up or the schedulers
+wsgi_app = LazyProxy(lambda: WsgiToAsgi(get_app()), "wsgi_app")
+
+
+def _warm_in_background(user_id):
+    # Fill the user's cached window off the event loop, so their next message is a hit
+    if user_id:
+        asyncio.get_running_loop().run_in_executor(None, agenda_cache.warm, user_id)
+
+
+async def find_events_async(user_id, start_time, end_time, limit=MAX_CHAT_RESULTS):
+    events = agenda_cache.events_between(user_id, start_time, end_time, load=False)
+    if events is None:
+        events = await agenda_digests.aevents_between(adb, user_id, start_time, end_time)
+    if events is not None:
+        return events[:limit]
+
+    _warm_in_background(user_id)
+    return await _query_events(user_id, start_time, end_time, limit)
+
+
+async def find_tasks_async(user_id, start_time, end_time, limit=MAX_CHAT_RESULTS):
+    tasks = agenda_cache.tasks_between(user_id, start_time, end_time, load=False)
+    if tasks is None:
+        tasks = await agenda_digests.atasks_between(adb, user_id, start_time, end_time)
+    if tasks is not None:
+        return tasks[:limit]
+
+    _warm_in_background(user_id)
+    return await _query_tasks(user_id, start_time, end_time, limit)
+
+
+async def _query_events(user_id, start_time, end_time, limit, fields=EVENT_FIELDS):
+    singles, series = await asyncio.gather(
+        events_between(user_id, start_time, end_time, fields=fields).afetch(adb, max_results=limit),
+        auser_series(adb, "events", user_id))
+    found = with_occurrences(singles, series, "start", start_time, end_time)
+    return [event.to_dict() for event in islice(found, limit)]
+
+
+async def _query_tasks(user_id, start_time, end_time, limit, fields=TASK_FIELDS):
+    async def query(collection):
+        singles, series = await asyncio.gather(
+            tasks_between(collection, user_id, start_time, end_time, fields=fields).afetch(adb, max_results=limit),
+            auser_series(adb, collection, user_id))
+        tasks = islice(with_occurrences(singles, series, "DueDate", start_time, end_time), limit)
+        return [(collection, task.to_dict()) for task in tasks]
+
+    results = await asyncio.gather(*(query(collection) for collection in TASK_COLLECTIONS))
+    tasks = [item for batch in results for item in batch if item[1].get("DueDate")]
+    tasks.sort(key=lambda item: item[1]["DueDate"])
+    return tasks[:limit]
+
+
+async def busy_index_async(user_id, start_time, end_time):
+    index = agenda_cache.busy_index(user_id, start_time, end_time, load=False)
+    if index is None:
+        # Straight to Firestore with the busy projection: digest items have no end/allDay/completed
+        _warm_in_background(user_id)
+        events, tasks = await asyncio.gather(
+            _query_events(user_id, start_time, end_time, None, fields=BUSY_EVENT_FIELDS),
+            _query_tasks(user_id, start_time, end_time, None, fields=BUSY_TASK_FIELDS))
+        index = BusyIndex(busy_intervals(events, tasks))
+    return index
+
+
+async def run_availability_async(plan, user_id):
+    if isinstance(plan, str):
+        return plan
+    return plan.answer(await busy_index_async(user_id, *plan.read_range()))
+
+
+async def run_plan_async(plan, find, user_id, intent, parameters, cursor=None):
+    if isinstance(plan, str):
+        return plan
+    start_time, end_time, limit = plan.read_range(cursor)
+    return plan.page(await find(user_id, start_time, end_time, limit), intent, parameters, user_id, cursor)
+
+
+# Same intents as app.router, with the Firestore-bound ones swapped for async versions
+router = IntentRouter(deadline_seconds=sync_router.deadline_seconds)
+router.handlers.update(sync_router.handlers)
+
+
+@router.intent("check_events")
+async def check_events_intent(df_request):
+    return await run_plan_async(plan_fetch_events(df_request.parameters, df_request.timezone), find_events_async, df_request.user_id,
+                                "check_events", df_request.parameters)
+
+
+@router.intent("check_events_by_time")
+async def check_events_by_time_intent(df_request):
+    return await run_plan_async(plan_fetch_events_by_time(df_request.parameters, df_request.timezone), find_events_async,
+                                df_request.user_id, "check_events_by_time", df_request.parameters)
+
+
+@router.intent("get_tasks")
+async def get_tasks_intent(df_request):
+    return await run_plan_async(plan_get_tasks(df_request.parameters, df_request.timezone), find_tasks_async, df_request.user_id,
+                                "get_tasks", df_request.parameters)
+
+
+@router.intent("get_tasks_by_time")
+async def get_tasks_by_time_intent(df_request):
+    return await run_plan_async(plan_get_tasks_by_time(df_request.parameters, df_request.timezone), find_tasks_async,
+                                df_request.user_id, "get_tasks_by_time", df_request.parameters)
+
+
+@router.intent("show_more")
+async def show_more_intent(df_request):
+    resumed = resume_list(df_request)
+    if isinstance(resumed, str):
+        return resumed
+    plan, kind, cursor = resumed
+    find = {"events": find_events_async, "tasks": find_tasks_async}[kind]
+    return await run_plan_async(plan, find, df_request.user_id, cursor.intent, cursor.parameters, cursor)
+
+
+@router.intent("check_availability")
+async def check_availability_intent(df_request):
+    return await run_availability_async(plan_check_availability(df_request.parameters, df_request.timezone),
+                                        df_request.user_id)
+
+
+@router.intent("find_free_slot")
+async def find_free_slot_intent(df_request):
+    return await run_availability_async(plan_find_free_slot(df_request.parameters, df_request.timezone),
+                                        df_request.user_id)
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, payload, status=200, request_id=None):
+    body = json.dumps(payload).encode()
+    headers = [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")]
+    if request_id:
+        headers.append((b"x-request-id", request_id.encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def webhook(scope, receive, send):
+    # Each ASGI request runs in its own task, so the id stays scoped to this chat turn
+    incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode() or None
+    request_id = new_request_id(incoming)
+    try:
+        req = json.loads(await _read_body(receive))
+    except ValueError:
+        await _send_json(send, {"error": "Invalid JSON"}, status=400, request_id=request_id)
+        return
+    df_request = DialogflowRequest.from_json(req)
+    logger.info("✅ Detected intent: %s (async)", df_request.intent,
+                extra={"fields": {"intent": df_request.intent, "user_id": df_request.user_id}})
+    await _send_json(send, fulfillment(df_request, await router.dispatch_async(df_request)), request_id=request_id)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                resolve(wsgi_app)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    flask_app = resolve(wsgi_app)  # a no-op once lifespan startup has built it
+    if scope["type"] == "http" and scope["path"] == "/webhook" and scope["method"] == "POST":
+        await webhook(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,402 @@
+"""⏱ Offline benchmark: `python benchmark.py --users 200 --requests 1000 --concurrency 16`.
+
+The script boots app.py against the in-memory stand-ins in benchmark_fakes.py. With
+--emulator it uses the Firestore emulator at FIRESTORE_EMULATOR_HOST instead. FCM
+and the holiday APIs are stubbed either way. It then seeds synthetic users, events
+and tasks and drives:
+- /webhook for every registered intent, with the parameters a real question carries
+- /holidays
+- /schedule_notification
+- the reminder sweep
+
+For each scenario it prints requests/sec and p50/p95/p99 latency. --json saves a run
+and --compare diffs a run against a saved one, so a performance change can be checked
+before and after without touching live Firebase.
+
+Settings read by app.py (AGENDA_CACHE_USERS, REMINDER_CLAIM_POOL_SIZE, ...) can be set
+in the environment as usual to compare configurations.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import pytz
+
+from benchmark_fakes import FakeFirestore, AsyncFakeFirestore, StubFCM, StubUpstreamAdapter
+
+SCENARIOS = ["webhook", "holidays", "schedule_notification", "reminder_sweep"]
+
+# Parameters shaped like the ones Dialogflow sends for each intent
+_DURATIONS = [{"amount": 2, "unit": "h"}, {"amount": 6, "unit": "hours"}, {"amount": 90, "unit": "min"}]
+_SLOT_DURATIONS = [{"amount": 30, "unit": "min"}, {"amount": 1, "unit": "h"}, {"amount": 2, "unit": "h"}]
+
+
+class Call:
+    __slots__ = ("scenario", "method", "path", "body", "headers")
+
+    def __init__(self, scenario, method, path, body=None, headers=None):
+        self.scenario = scenario
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+
+
+def boot(args):
+    """Imports app.py with Firebase, FCM and the holiday APIs pointed at offline stand-ins."""
+    os.environ.setdefault("RUN_REMINDER_SCHEDULER", "false")  # the sweep is benchmarked on its own
+    os.environ.setdefault("AGENDA_CACHE_LISTENERS", "false")
+    os.environ.setdefault("WARM_ON_START", "false")  # the warm-up requests do this instead
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("NOTIFICATION_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="taskmate-bench-"),
+                                                               "notification_jobs.sqlite3"))
+
+    import firebase_admin
+    from firebase_admin import auth, credentials, firestore, firestore_async, messaging
+
+    if args.emulator:
+        if "FIRESTORE_EMULATOR_HOST" not in os.environ:
+            sys.exit("--emulator needs FIRESTORE_EMULATOR_HOST, e.g. localhost:8080")
+        from google.cloud import firestore as cloud_firestore
+        project = os.environ.get("GCLOUD_PROJECT", "taskmate-bench")
+        db = cloud_firestore.Client(project=project)
+        adb = cloud_firestore.AsyncClient(project=project)
+    else:
+        db = FakeFirestore(latency=args.firestore_latency_ms / 1000)
+        adb = AsyncFakeFirestore(db)
+
+    fcm = StubFCM(latency=args.fcm_latency_ms / 1000, failure_rate=args.fcm_failure_rate)
+    upstream = StubUpstreamAdapter(latency=args.upstream_latency_ms / 1000)
+
+    credentials.Certificate = lambda *a, **k: None
+    firebase_admin.initialize_app = lambda *a, **k: None
+    firestore.client = lambda *a, **k: db
+    firestore_async.client = lambda *a, **k: adb
+    messaging.send_each = fcm.send_each
+    auth.verify_id_token = lambda id_token, *a, **k: {"uid": id_token.removeprefix("bench-id-")}
+
+    import app
+    app.http.session.mount("https://", upstream)
+    return app, db, fcm, upstream
+
+
+def seed(db, users, events_per_user, tasks_per_user, spread_days):
+    """Writes synthetic events and tasks spread over today ± spread_days."""
+    from task_store import TASK_COLLECTIONS
+
+    now = datetime.now(pytz.utc)
+    batch, pending = db.batch(), 0
+    for u in range(users):
+        user_id = user_name(u)
+        docs = [("events", "start", i) for i in range(events_per_user)]
+        docs += [(random.choice(list(TASK_COLLECTIONS)), "DueDate", i) for i in range(tasks_per_user)]
+
+        for collection, time_field, i in docs:
+            when = now + timedelta(minutes=random.randint(-spread_days * 1440, spread_days * 1440))
+            fields = {
+                "userId": user_id,
+                "title": f"{'Event' if collection == 'events' else 'Task'} {i}",
+                time_field: when,
+                "location": "Conference room",
+                "token": f"bench-token-{user_id}",
+                "reminderTime": when - timedelta(minutes=15),
+                "reminderSent": when - timedelta(minutes=15) <= now,
+            }
+            # Meetings of different lengths, some all-day events and some finished tasks,
+            # so the availability intents have real busy time to work through
+            if collection == "events":
+                fields["end"] = when + timedelta(minutes=random.choice((30, 60, 90, 180)))
+                fields["allDay"] = random.random() < 0.1
+            else:
+                fields["completed"] = random.random() < 0.25
+            batch.set(db.collection(collection).document(), fields)
+            pending += 1
+            if pending == 500:  # WriteBatch limit
+                batch.commit()
+                batch, pending = db.batch(), 0
+    batch.commit()
+
+
+def seed_due_reminders(db, count, users):
+    from task_store import TASK_COLLECTIONS
+
+    now = datetime.now(pytz.utc)
+    batch = db.batch()
+    for i in range(count):
+        collection = "events" if i % 2 else random.choice(list(TASK_COLLECTIONS))
+        user_id = user_name(random.randrange(users))
+        batch.set(db.collection(collection).document(), {
+            "userId": user_id,
+            "title": f"Due reminder {i}",
+            "start" if collection == "events" else "DueDate": now + timedelta(minutes=10),
+            "token": f"bench-token-{user_id}",  # one phone per user, like the app writes it
+            "reminderTime": now - timedelta(seconds=random.randint(1, 300)),
+            "reminderSent": False,
+        })
+        if i % 500 == 499:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+
+def user_name(n):
+    return f"bench-user-{n:05d}"
+
+
+def build_calls(scenario, count, users):
+    now = datetime.now(pytz.timezone("Asia/Kolkata"))
+    calls = []
+    for i in range(count):
+        user_id = user_name(random.randrange(users))
+        day = (now + timedelta(days=random.randint(-3, 3))).date()
+        if scenario == "holidays":
+            day = now.date().replace(month=1, day=1) + timedelta(days=random.randrange(365))
+            calls.append(Call(scenario, "GET", "/holidays?" + urlencode({"date": day.isoformat()})))
+        elif scenario == "schedule_notification":
+            calls.append(Call(scenario, "POST", "/schedule_notification", {
+                "token": f"bench-token-{user_id}",
+                "title": "Benchmark",
+                "body": f"Notification {i}",
+                "send_time": (now + timedelta(hours=1)).isoformat(),
+                "idempotency_key": f"bench-{random.getrandbits(64):x}",
+            }, {"Authorization": f"Bearer bench-id-{user_id}"}))
+        else:
+            intent = scenario.split(":", 1)[1]
+            calls.append(Call(scenario, "POST", "/webhook", webhook_body(intent, user_id, now, day, i)))
+    return calls
+
+
+def webhook_body(intent, user_id, now, day, i):
+    """A Dialogflow request for `intent` with the parameters a real user's question would carry."""
+    query_result = {"intent": {"displayName": intent}, "parameters": {}}
+    ahead = (now + timedelta(days=random.randint(0, 3))).date()  # availability questions look forward
+    if intent in ("check_events", "get_tasks"):
+        query_result["parameters"] = {"date-time": f"{day.isoformat()}T12:00:00+05:30"}
+    elif intent in ("check_events_by_time", "get_tasks_by_time"):
+        query_result["parameters"] = {"duration": random.choice(_DURATIONS)}
+    elif intent == "check_availability":
+        # "Am I free at 3pm?" and "am I free between 10 and 12?"
+        hour = random.randint(9, 17)
+        if i % 2:
+            value = f"{ahead.isoformat()}T{hour:02d}:00:00+05:30"
+        else:
+            value = {"startTime": f"{ahead.isoformat()}T{hour:02d}:00:00+05:30",
+                     "endTime": f"{ahead.isoformat()}T{hour + 2:02d}:00:00+05:30"}
+        query_result["parameters"] = {"date-time": value, "duration": random.choice(_SLOT_DURATIONS)}
+    elif intent == "find_free_slot":
+        # "Find me an hour tomorrow" and "find me 2 hours this week"
+        if i % 2:
+            value = f"{ahead.isoformat()}T12:00:00+05:30"
+        else:
+            value = {"startDate": f"{now.date().isoformat()}T00:00:00+05:30",
+                     "endDate": f"{(now + timedelta(days=6)).date().isoformat()}T23:59:59+05:30"}
+        query_result["parameters"] = {"date-time": value, "duration": random.choice(_SLOT_DURATIONS)}
+    elif intent == "show_more":
+        # The second page of a month-long list, as the continuation context hands it back
+        from pagination import Cursor, PAGE_ITEMS
+
+        start, end = now - timedelta(days=15), now + timedelta(days=15)
+        listed = random.choice(["check_events", "get_tasks"])
+        parameters = {"date-time": {"startDate": start.isoformat(), "endDate": end.isoformat()}}
+        after = (start + timedelta(days=random.randint(0, 10))).astimezone(pytz.utc)
+        token = Cursor(listed, parameters, user_id, start.astimezone(pytz.utc), end.astimezone(pytz.utc),
+                       after, 0, PAGE_ITEMS).encode()
+        query_result["outputContexts"] = [{"name": f"bench/sessions/{user_id}/contexts/list-continuation",
+                                           "parameters": {"continuation_token": token}}]
+    return {"session": f"bench/sessions/{user_id}", "queryResult": query_result,
+            "originalDetectIntentRequest": {"payload": {"userId": user_id}}}
+
+
+def run_wsgi(flask_app, calls, concurrency):
+    """Drives the Flask app in-process from `concurrency` threads; returns (latencies, errors, wall time)."""
+    local = threading.local()
+
+    def one(call):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        started = time.perf_counter()
+        try:
+            ok = client.open(call.path, method=call.method, json=call.body, headers=call.headers).status_code < 500
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, calls))
+    return [elapsed for elapsed, _ in results], sum(not ok for _, ok in results), time.perf_counter() - started
+
+
+def run_asgi(asgi_app, calls, concurrency):
+    """Same as run_wsgi, through asgi.py's event loop with `concurrency` requests in flight."""
+
+    async def one(call, semaphore):
+        path, _, query = call.path.partition("?")
+        body = json.dumps(call.body).encode() if call.body is not None else b""
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+            "method": call.method, "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": query.encode(), "server": ("bench", 80), "client": ("127.0.0.1", 0),
+            "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode())]
+                       + [(name.lower().encode(), value.encode()) for name, value in call.headers.items()],
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = []
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await asgi_app(scope, receive, send)
+                ok = bool(status) and status[0] < 500
+            except Exception:
+                ok = False
+            return time.perf_counter() - started, ok
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(one(call, semaphore) for call in calls))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    return [elapsed for elapsed, _ in results], sum(not ok for _, ok in results), time.perf_counter() - started
+
+
+def run_sweeps(db, sweeps, due_reminders, users):
+    from reminders import check_and_send_reminders
+
+    latencies = []
+    for _ in range(sweeps):
+        seed_due_reminders(db, due_reminders, users)
+        started = time.perf_counter()
+        check_and_send_reminders(db)
+        latencies.append(time.perf_counter() - started)
+    return latencies, 0, sum(latencies)
+
+
+def summarize(scenario, latencies, errors, wall, items=None):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return round(1000 * latencies[max(0, math.ceil(q * len(latencies)) - 1)], 2) if latencies else None
+
+    result = {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1) if wall else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": percentile(1.0),
+    }
+    if items is not None:
+        result["items_per_sec"] = round(items / wall, 1) if wall else None
+    return result
+
+
+def print_report(results, baseline=None):
+    baseline = {r["scenario"]: r for r in (baseline or [])}
+    header = f"{'scenario':<36}{'reqs':>7}{'errs':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header + ("   vs baseline" if baseline else ""))
+    print("-" * (len(header) + (14 if baseline else 0)))
+    for r in results:
+        line = (f"{r['scenario']:<36}{r['requests']:>7}{r['errors']:>6}{r['rps'] or 0:>10.1f}"
+                f"{r['p50_ms'] or 0:>10.2f}{r['p95_ms'] or 0:>10.2f}{r['p99_ms'] or 0:>10.2f}")
+        before = baseline.get(r["scenario"])
+        if before and before["rps"] and before["p95_ms"]:
+            line += (f"   req/s {100 * (r['rps'] - before['rps']) / before['rps']:+.0f}%,"
+                     f" p95 {100 * (r['p95_ms'] - before['p95_ms']) / before['p95_ms']:+.0f}%")
+        print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    arg_parser.add_argument("--users", type=int, default=100)
+    arg_parser.add_argument("--events-per-user", type=int, default=20)
+    arg_parser.add_argument("--tasks-per-user", type=int, default=20)
+    arg_parser.add_argument("--spread-days", type=int, default=30, help="seeded items fall within today ± this")
+    arg_parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    arg_parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help="comma-separated: webhook (every intent), webhook:<intent>, " + ", ".join(SCENARIOS[1:]))
+    arg_parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi",
+                            help="drive app.app, or asgi.app with its async /webhook")
+    arg_parser.add_argument("--sweeps", type=int, default=5)
+    arg_parser.add_argument("--due-reminders", type=int, default=500, help="reminders due at each sweep")
+    arg_parser.add_argument("--firestore-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--fcm-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--fcm-failure-rate", type=float, default=0.0)
+    arg_parser.add_argument("--upstream-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--emulator", action="store_true", help="use the Firestore emulator instead of the fake")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--compare", help="a --json file from an earlier run to compare against")
+    args = arg_parser.parse_args()
+
+    random.seed(args.seed)
+    app, db, fcm, upstream = boot(args)
+    target = app.app
+    if args.server == "asgi":
+        import asgi
+        target = asgi.app
+
+    started = time.perf_counter()
+    seed(db, args.users, args.events_per_user, args.tasks_per_user, args.spread_days)
+    print(f"🌱 Seeded {args.users} users × ({args.events_per_user} events + {args.tasks_per_user} tasks) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    scenarios = []
+    for name in args.scenarios.split(","):
+        name = name.strip()
+        if name == "webhook":
+            scenarios += [f"webhook:{intent}" for intent in app.router.handlers]
+        elif name:
+            scenarios.append(name)
+
+    results = []
+    for scenario in scenarios:
+        if scenario == "reminder_sweep":
+            latencies, errors, wall = run_sweeps(db, args.sweeps, args.due_reminders, args.users)
+            results.append(summarize(scenario, latencies, errors, wall, items=args.sweeps * args.due_reminders))
+            continue
+
+        run = run_asgi if args.server == "asgi" else run_wsgi
+        run(target, build_calls(scenario, args.warmup, args.users), args.concurrency)
+        latencies, errors, wall = run(target, build_calls(scenario, args.requests, args.users),
+                                      args.concurrency)
+        results.append(summarize(scenario, latencies, errors, wall))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+    print(f"📨 FCM: {fcm.messages} messages in {fcm.calls} calls · 🌍 upstream calls: {upstream.calls}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
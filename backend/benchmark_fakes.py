@@ -0,0 +1,539 @@
+"""🧪 Offline stand-ins used by benchmark.py: an in-memory Firestore, stubbed FCM
+and canned holiday APIs. Each one can add a fixed latency so runs model network
+round-trips instead of measuring a zero-cost backend.
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import DELETE_FIELD, Increment
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: b in a,
+}
+_UNARY_OPS = {"IS_NULL": ("==", None), "IS_NOT_NULL": ("!=", None)}
+
+
+class FakeFirestore:
+    """Just enough of firestore.Client for this backend, held in dicts.
+
+    Equality filters are answered from a per-field index built on first use, so
+    queries scale like an indexed Firestore query rather than a full scan.
+    Update times are a version counter, which is all the compare-and-set claims need.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency  # seconds added to every query and commit
+        self._docs = {}  # collection path -> {doc id: fields}
+        self._versions = {}  # document path -> version
+        self._indexes = {}  # (collection path, field) -> {value: set(doc ids)}
+        self._clock = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def collection(self, path):
+        return FakeQuery(self, path)
+
+    def document(self, path):
+        collection, _, doc_id = path.rpartition("/")
+        return FakeDocumentReference(self, collection, doc_id)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self):
+        return FakeWriteBatch(self, autocommit=True)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None):
+        self._wait()
+        snapshots = [reference._snapshot() for reference in references]
+        if field_paths is not None:
+            for snapshot in snapshots:
+                if snapshot._fields is not None:
+                    snapshot._fields = {name: snapshot._fields[name] for name in field_paths if name in snapshot._fields}
+        return snapshots
+
+    def write_option(self, last_update_time=None, exists=None):
+        return ("last_update_time", last_update_time) if last_update_time is not None else ("exists", exists)
+
+    def count(self, collection):
+        return len(self._docs.get(collection, {}))
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    # Writes — always called with self._lock held
+
+    def _write(self, collection, doc_id, fields, merge=False, option=None, must_exist=False, must_not_exist=False):
+        docs = self._docs.setdefault(collection, {})
+        path = f"{collection}/{doc_id}"
+        current = docs.get(doc_id)
+
+        if must_exist and current is None:
+            raise api_exceptions.NotFound(f"No document to update: {path}")
+        if must_not_exist and current is not None:
+            raise api_exceptions.AlreadyExists(f"Document already exists: {path}")
+        if option and option[0] == "last_update_time" and self._versions.get(path) != option[1]:
+            raise api_exceptions.FailedPrecondition(f"{path} was modified since it was read")
+
+        updated = dict(current) if current is not None and (merge or must_exist) else {}
+        for field, value in fields.items():
+            if value is DELETE_FIELD:
+                updated.pop(field, None)
+            elif isinstance(value, Increment):
+                updated[field] = updated.get(field, 0) + value.value
+            else:
+                updated[field] = value
+
+        self._unindex(collection, doc_id, current)
+        docs[doc_id] = updated
+        self._versions[path] = next(self._clock)
+        self._index(collection, doc_id, updated)
+
+    def _delete(self, collection, doc_id):
+        current = self._docs.get(collection, {}).pop(doc_id, None)
+        self._unindex(collection, doc_id, current)
+        self._versions.pop(f"{collection}/{doc_id}", None)
+
+    def _index(self, collection, doc_id, fields):
+        for (indexed_collection, field), index in self._indexes.items():
+            if indexed_collection == collection and field in fields and _hashable(fields[field]):
+                index.setdefault(fields[field], set()).add(doc_id)
+
+    def _unindex(self, collection, doc_id, fields):
+        if not fields:
+            return
+        for (indexed_collection, field), index in self._indexes.items():
+            if indexed_collection == collection and field in fields and _hashable(fields[field]):
+                index.get(fields[field], set()).discard(doc_id)
+
+    def _candidates(self, collection, filters):
+        """Doc ids worth checking: those matching the first equality filter, via its index."""
+        docs = self._docs.get(collection, {})
+        for field, op, value in filters:
+            if op == "==" and _hashable(value):
+                index = self._indexes.get((collection, field))
+                if index is None:
+                    index = self._indexes[(collection, field)] = {}
+                    for doc_id, fields in docs.items():
+                        if field in fields and _hashable(fields[field]):
+                            index.setdefault(fields[field], set()).add(doc_id)
+                return list(index.get(value, ()))
+        return list(docs)
+
+
+def _hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+class FakeSnapshot:
+    def __init__(self, reference, fields, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._fields = fields
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._fields is not None
+
+    def to_dict(self):
+        return dict(self._fields) if self._fields is not None else None
+
+    def get(self, field):
+        return self._fields[field]  # KeyError for a missing field, like the real client
+
+
+class FakeDocumentReference:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    def collection(self, name):
+        return FakeQuery(self._db, f"{self.path}/{name}")
+
+    def get(self, *args, **kwargs):
+        self._db._wait()
+        return self._snapshot()
+
+    def set(self, fields, merge=False):
+        self._db._wait()
+        with self._db._lock:
+            self._db._write(self._collection, self.id, fields, merge=merge)
+
+    def create(self, fields):
+        self._db._wait()
+        with self._db._lock:
+            self._db._write(self._collection, self.id, fields, must_not_exist=True)
+
+    def update(self, fields, option=None):
+        self._db._wait()
+        with self._db._lock:
+            self._db._write(self._collection, self.id, fields, option=option, must_exist=True)
+
+    def delete(self):
+        self._db._wait()
+        with self._db._lock:
+            self._db._delete(self._collection, self.id)
+
+    def _snapshot(self):
+        with self._db._lock:
+            fields = self._db._docs.get(self._collection, {}).get(self.id)
+            return FakeSnapshot(self, dict(fields) if fields is not None else None,
+                                self._db._versions.get(self.path))
+
+
+class FakeQuery:
+    """A collection reference and the queries built from it (they're immutable, like the real ones)."""
+
+    def __init__(self, db, collection, filters=(), orders=(), limit=None, fields=None, cursor=None):
+        self._db = db
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._fields = fields
+        self._cursor = cursor
+
+    @property
+    def id(self):
+        return self._collection.rpartition("/")[2]
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     fields=self._fields, cursor=self._cursor)
+        state.update(changes)
+        return FakeQuery(self._db, self._collection, **state)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, self._collection, doc_id or f"{random.getrandbits(64):016x}")
+
+    def add(self, fields):
+        reference = self.document()
+        reference.set(fields)
+        return None, reference
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if not isinstance(op_string, str):
+            # FieldFilter turns == / != None into a unary IS_NULL / IS_NOT_NULL operator
+            op_string, value = _UNARY_OPS[op_string.name]
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def stream(self, *args, **kwargs):
+        self._db._wait()
+        return iter(self._run())
+
+    def get(self, *args, **kwargs):
+        return list(self.stream())
+
+    def _run(self):
+        db = self._db
+        with db._lock:
+            docs = db._docs.get(self._collection, {})
+            matches = []
+            for doc_id in db._candidates(self._collection, self._filters):
+                fields = docs.get(doc_id)
+                if fields is not None and self._matches(fields):
+                    matches.append((doc_id, dict(fields), db._versions.get(f"{self._collection}/{doc_id}")))
+
+        matches.sort(key=lambda match: match[0])  # ties come back in document id order, like Firestore
+        for field, direction in reversed(self._orders):
+            matches.sort(key=lambda match: match[1].get(field), reverse=direction == "DESCENDING")
+        if self._cursor is not None:
+            matches = self._after_cursor(matches)
+        if self._limit is not None:
+            matches = matches[:self._limit]
+
+        snapshots = []
+        for doc_id, fields, version in matches:
+            if self._fields is not None:
+                fields = {name: fields[name] for name in self._fields if name in fields}
+            snapshots.append(FakeSnapshot(FakeDocumentReference(db, self._collection, doc_id), fields, version))
+        return snapshots
+
+    def _matches(self, fields):
+        if any(field not in fields for field, _ in self._orders):
+            return False  # nor one missing a field it's ordered by
+        for field, op, value in self._filters:
+            if field not in fields:
+                return False  # Firestore never matches a document missing the filtered field
+            try:
+                if not _OPS[op](fields[field], value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def _after_cursor(self, matches):
+        cursor = self._cursor
+        if isinstance(cursor, FakeSnapshot):
+            cursor = cursor.to_dict()
+        key = tuple(cursor.get(field) for field, _ in self._orders)
+        for position, (_, fields, _) in enumerate(matches):
+            if tuple(fields.get(field) for field, _ in self._orders) == key:
+                return matches[position + 1:]
+        return matches
+
+
+class FakeWriteBatch:
+    """A WriteBatch (applied atomically on commit) or, with autocommit, a BulkWriter."""
+
+    def __init__(self, db, autocommit=False):
+        self._db = db
+        self._autocommit = autocommit
+        self._writes = []
+        self._on_error = lambda failure, _: failure.attempts < 15  # BulkWriter's default
+
+
+    def set(self, reference, fields, merge=False):
+        self._add(lambda: self._db._write(reference._collection, reference.id, fields, merge=merge))
+
+    def create(self, reference, fields):
+        self._add(lambda: self._db._write(reference._collection, reference.id, fields, must_not_exist=True))
+
+    def update(self, reference, fields, option=None):
+        self._add(lambda: self._db._write(reference._collection, reference.id, fields, option=option,
+                                          must_exist=True))
+
+    def delete(self, reference):
+        self._add(lambda: self._db._delete(reference._collection, reference.id))
+
+    def commit(self):
+        self._db._wait()
+        with self._db._lock:
+            if not self._autocommit:
+                for write in self._writes:
+                    write()
+            else:
+                # A BulkWriter's writes fail one at a time, each retried while the callback says so
+                for write in self._writes:
+                    for attempt in itertools.count(1):
+                        try:
+                            write()
+                            break
+                        except api_exceptions.GoogleAPICallError as e:
+                            if not self._on_error(FakeWriteFailure(e, attempt), self):
+                                break
+        self._writes = []
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.commit()
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def _add(self, write):
+        self._writes.append(write)
+        if self._autocommit and len(self._writes) >= 20:
+            self.commit()
+
+
+class FakeWriteFailure:
+    """The BulkWriteFailure handed to a BulkWriter's on_write_error callback."""
+
+    def __init__(self, error, attempts):
+        self.code = error.grpc_status_code.value[0] if error.grpc_status_code else 2  # UNKNOWN
+        self.message = error.message
+        self.attempts = attempts
+
+
+class FakeTransaction(FakeWriteBatch):
+    """A Transaction for firestore.transactional: it holds the store's lock from begin to
+    commit, so nothing is written between its reads and its writes."""
+
+    _read_only = False
+    _max_attempts = 1  # nothing can conflict while the lock is held
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+
+    def _clean_up(self):
+        self._writes = []
+
+    def _begin(self, retry_id=None):
+        self._db._lock.acquire()
+        self._id = next(self._db._clock)
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._release()
+
+    def _rollback(self):
+        self._writes = []
+        self._release()
+
+    def _release(self):
+        if self._id is not None:
+            self._id = None
+            self._db._lock.release()
+
+
+class AsyncFakeFirestore:
+    """firestore_async.client() over the same data as a FakeFirestore."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def collection(self, path):
+        return _AsyncQuery(self._db.collection(path))
+
+
+class _AsyncQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def __getattr__(self, name):
+        method = getattr(self._query, name)
+        return lambda *args, **kwargs: _AsyncQuery(method(*args, **kwargs))
+
+    async def stream(self, *args, **kwargs):
+        if self._query._db.latency:
+            await asyncio.sleep(self._query._db.latency)
+        for snapshot in self._query._run():
+            yield snapshot
+
+    def document(self, *path):
+        return _AsyncDocument(self._query.document(*path))
+
+
+class _AsyncDocument:
+    def __init__(self, reference):
+        self._reference = reference
+
+    async def get(self, *args, **kwargs):
+        if self._reference._db.latency:
+            await asyncio.sleep(self._reference._db.latency)
+        return self._reference._snapshot()
+
+
+class StubFCM:
+    """Replaces messaging.send_each: waits `latency` per call and fails a `failure_rate`
+    fraction of messages with UnregisteredError, like a stale device token would."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def send_each(self, messages, dry_run=False):
+        from firebase_admin import messaging
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.messages += len(messages)
+
+        responses = []
+        for _ in messages:
+            if self.failure_rate and random.random() < self.failure_rate:
+                responses.append(_SendResponse(False, messaging.UnregisteredError("Requested entity was not found.")))
+            else:
+                responses.append(_SendResponse(True, None, f"projects/bench/messages/{random.getrandbits(48):x}"))
+        return _BatchResponse(responses)
+
+
+class _SendResponse:
+    def __init__(self, success, exception, message_id=None):
+        self.success = success
+        self.exception = exception
+        self.message_id = message_id
+
+
+class _BatchResponse:
+    def __init__(self, responses):
+        self.responses = responses
+        self.success_count = sum(r.success for r in responses)
+        self.failure_count = len(responses) - self.success_count
+
+
+class StubUpstreamAdapter(requests.adapters.BaseAdapter):
+    """Answers Calendarific and Free Astrology API calls with canned payloads.
+
+    Mounted on the OutboundClient's session, so timeouts, breakers and stats still run.
+    """
+
+    HOLIDAYS = [("01-14", "Makar Sankranti"), ("01-26", "Republic Day"), ("03-14", "Holi"),
+                ("08-15", "Independence Day"), ("10-02", "Gandhi Jayanti"), ("10-20", "Diwali"),
+                ("12-25", "Christmas")]
+    TITHIS = ["Pratipada", "Dwitiya", "Tritiya", "Chaturthi", "Panchami", "Shashthi", "Saptami",
+              "Ashtami", "Navami", "Dashami", "Ekadashi", "Dwadashi", "Trayodashi", "Chaturdashi", "Purnima"]
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+
+        if "calendarific" in request.url:
+            year = parse_qs(urlparse(request.url).query)["year"][0]
+            payload = {"meta": {"code": 200}, "response": {"holidays": [
+                {"name": name, "date": {"iso": f"{year}-{day}"}} for day, name in self.HOLIDAYS]}}
+        else:
+            body = json.loads(request.body)
+            day = datetime(body["year"], body["month"], body["date"]).toordinal()
+            payload = {"statusCode": 200, "output": json.dumps({"name": self.TITHIS[day % len(self.TITHIS)]})}
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(payload).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
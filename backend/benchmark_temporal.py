@@ -0,0 +1,139 @@
+"""⏱ Microbenchmarks for temporal.py: `python benchmark_temporal.py [--number N]`.
+
+Times the date/duration/timezone work one chat request does, the way the handlers
+used to do it (inline dateutil parsing, twice per string, and a pytz lookup per
+request or per rendered item) against temporal.py. No Firebase or network needed.
+
+temporal.py caches parsed strings, so it's timed twice: cold, on a different string
+every call with the caches cleared first (what a new request's dates cost), and
+warm, on one string over and over (a cache hit, e.g. a retried webhook).
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil import parser
+
+import temporal
+
+IST = pytz.timezone("Asia/Kolkata")
+BASE = IST.localize(datetime(2027, 3, 5))
+DURATION = {"duration": {"amount": 3, "unit": "h"}}
+ITEMS = [datetime(2027, 3, 5, 4, 0, tzinfo=pytz.utc) + timedelta(minutes=15 * i) for i in range(10)]
+
+
+# Parameters for input number i: each i gives different timestamp strings
+
+def time_range(i):
+    start = BASE + timedelta(hours=9, minutes=i)
+    return {"date-time": [{"startTime": start.isoformat(), "endTime": (start + timedelta(hours=9)).isoformat()}]}
+
+
+def date_range(i):
+    start = BASE + timedelta(minutes=i)
+    return {"date-time": {"startDate": start.isoformat(), "endDate": (start + timedelta(days=3, seconds=-1)).isoformat()}}
+
+
+def single_date(i):
+    return {"date-time": (BASE + timedelta(hours=12, minutes=i)).isoformat()}
+
+
+# The previous inline versions, kept here only as the baseline
+
+def before_range(parameters):
+    ist = pytz.timezone("Asia/Kolkata")
+    dt_range = parameters.get("date-time")
+    if isinstance(dt_range, list) and len(dt_range) > 0:
+        dt_range = dt_range[0]
+    if isinstance(dt_range, dict) and "startTime" in dt_range:
+        start, end, fmt = dt_range["startTime"], dt_range["endTime"], '%I:%M %p'
+    elif isinstance(dt_range, dict):
+        start, end, fmt = dt_range["startDate"], dt_range["endDate"], '%d %b %Y'
+    else:
+        selected_date = parser.parse(dt_range).date()
+        return (datetime.combine(selected_date, datetime.min.time()).replace(tzinfo=pytz.utc),
+                datetime.combine(selected_date, datetime.max.time()).replace(tzinfo=pytz.utc))
+    return (parser.isoparse(start).astimezone(pytz.utc), parser.isoparse(end).astimezone(pytz.utc),
+            parser.isoparse(start).astimezone(ist).strftime(fmt), parser.isoparse(end).astimezone(ist).strftime(fmt))
+
+
+def before_duration(parameters):
+    duration = parameters["duration"]
+    units = {"h": "hours", "hour": "hours", "hours": "hours", "min": "minutes", "minute": "minutes", "minutes": "minutes"}
+    return datetime.now(pytz.utc) + timedelta(**{units[duration["unit"].lower()]: duration["amount"]})
+
+
+def before_render(items):
+    lines = []
+    for due in items:
+        ist = pytz.timezone("Asia/Kolkata")  # looked up per task, as get_tasks_by_time did
+        lines.append(due.astimezone(ist).strftime('%Y-%m-%d %I:%M %p IST'))
+    return lines
+
+
+def after_range(parameters):
+    time_range = temporal.parse_date_time(parameters.get("date-time"))
+    if time_range.is_range:
+        return time_range.start, time_range.end, *time_range.labels(temporal.get_timezone())
+    return time_range.start, time_range.end
+
+
+def after_duration(parameters):
+    return datetime.now(pytz.utc) + temporal.duration_delta(parameters["duration"])
+
+
+def after_render(items):
+    tz = temporal.get_timezone()
+    return [temporal.format_when(due, tz) for due in items]
+
+
+# (name, parameters for input i, before, after)
+CASES = [
+    ("time range (startTime/endTime)", time_range, before_range, after_range),
+    ("date range (startDate/endDate)", date_range, before_range, after_range),
+    ("single date", single_date, before_range, after_range),
+    ("duration", lambda i: DURATION, before_duration, after_duration),
+    ("render 10 items", lambda i: ITEMS, before_render, after_render),
+]
+
+
+def clear_caches():
+    temporal.parse_datetime.cache_clear()
+    temporal.parse_date.cache_clear()
+
+
+def per_call_us(function, inputs, repeat, setup=None):
+    """Best of `repeat` passes over `inputs`, in µs per call; `setup` runs before each pass."""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        for parameters in inputs:
+            function(parameters)
+        best = min(best, time.perf_counter() - started)
+    return best / len(inputs) * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--number", type=int, default=20000, help="calls per measurement")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="measurements per case (best one is kept)")
+    args = arg_parser.parse_args()
+
+    print(f"{'case':<34}{'before µs':>12}{'cold µs':>12}{'warm µs':>12}{'cold ×':>9}{'warm ×':>9}")
+    print("-" * 88)
+    for name, make, before, after in CASES:
+        # Both sides must produce the same result (durations are relative to now, so skip those)
+        assert name == "duration" or all(before(make(i)) == after(make(i)) for i in (0, 1, 997)), name
+        distinct = [make(i) for i in range(args.number)]  # built up front so only the parsing is timed
+        before_us = per_call_us(before, distinct, args.repeat)
+        cold_us = per_call_us(after, distinct, args.repeat, setup=clear_caches)
+        warm_us = per_call_us(after, [make(0)] * args.number, args.repeat)
+        print(f"{name:<34}{before_us:>12.2f}{cold_us:>12.2f}{warm_us:>12.2f}"
+              f"{before_us / cold_us:>8.1f}x{before_us / warm_us:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
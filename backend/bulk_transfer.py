@@ -0,0 +1,595 @@
+"""📦 Bulk import and export of a user's events and tasks, as iCalendar or NDJSON.
+
+Both directions stream: imports parse the input a line at a time and write through
+a Firestore BulkWriter, exports page through Firestore and yield the file in chunks,
+so memory stays flat however many years of history a file holds.
+
+NDJSON has one document per line: {"collection": "events"|"tasks_*", "id": ..., ...fields},
+timestamps as ISO 8601 strings — the same shape export writes. iCalendar VEVENTs
+become events and VTODOs tasks (in X-TASKMATE-COLLECTION, else the collection asked
+for); an RRULE makes a recurring series (see recurrence.py) and a VALARM the reminder.
+
+Imported documents get ids derived from the user and the record's own id (UID in
+iCalendar, plus RECURRENCE-ID for an override of one occurrence), so importing the
+same file twice rewrites the same documents and a file can never overwrite another
+user's. An override is stored as a single item and its occurrence is added to the
+series' exdates, whichever of the two comes first in the file. Progress is
+checkpointed in `imports/{import_id}` every CHECKPOINT_RECORDS records; sending the
+same file with the same import_id again skips what's already written and carries on
+(start_import() hands out an id before the upload, for clients to resume with).
+
+Reminders that are already past are imported as sent, so history doesn't set off a
+flood of notifications. The rest get a device token of the user's (see import_token);
+a user with none gets their reminders imported as sent, with a reminderError, rather
+than ones no sweep could ever deliver.
+
+CLI: `python bulk_transfer.py import FILE --user UID [--import-id ID]` and
+`python bulk_transfer.py export --user UID [--format ics] > FILE`.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+
+from device_tokens import registry
+from metrics import span, stream_query
+from queries import RangeQuery, field_filter
+from recurrence import check_series, is_series, next_reminder, time_field, user_series
+from task_store import TASK_COLLECTIONS
+from temporal import get_timezone, parse_datetime
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ("events", *TASK_COLLECTIONS)
+IMPORTS_COLLECTION = "imports"
+CHECKPOINT_RECORDS = int(os.environ.get("IMPORT_CHECKPOINT_RECORDS", 500))
+EXPORT_CHUNK_LINES = 200
+MAX_REPORTED_ERRORS = 20
+TOKEN_LOOKUP_DOCUMENTS = 20  # of a user's documents, per collection, looked at for a device token
+
+# Fields holding timestamps, which NDJSON carries as ISO strings
+TIMESTAMP_FIELDS = ("start", "end", "DueDate", "reminderTime", "dtstart", "timestamp")
+# Fields that belong to this deployment rather than the data: never exported or imported
+LOCAL_FIELDS = ("id", "collection", "userId", "token", "reminderLeaseUntil", "importId")
+
+FORMATS = {"ics": "text/calendar", "ndjson": "application/x-ndjson"}
+
+
+class SkippedRecord:
+    """A record the parser couldn't turn into a document; it still counts towards the position."""
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class ImportRecord:
+    def __init__(self, collection, fields, source_id=None, recurrence_id=None):
+        self.collection = collection
+        self.fields = fields
+        self.source_id = source_id
+        self.recurrence_id = recurrence_id  # the occurrence of series `source_id` this one replaces
+
+
+def guess_format(name):
+    """'ics' or 'ndjson' from a file name or content type, or None."""
+    name = (name or "").lower()
+    if name.endswith((".ics", ".ical")) or "calendar" in name:
+        return "ics"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in name or "jsonl" in name:
+        return "ndjson"
+    return None
+
+
+# 📥 Parsers — each yields one ImportRecord or SkippedRecord per record, in file order
+
+def ndjson_records(lines, default_collection="tasks_self"):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield SkippedRecord(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(fields, dict):
+            yield SkippedRecord("Not a JSON object")
+            continue
+        yield ImportRecord(fields.get("collection") or default_collection, fields,
+                           None if fields.get("id") is None else str(fields["id"]))
+
+
+def ical_records(lines, default_collection="tasks_self", timezone=None):
+    """Reads VEVENTs and VTODOs from iCalendar lines; nested components other than VALARM are ignored."""
+    tz = get_timezone(timezone)
+    component, properties, alarm = None, [], None
+    for line in _unfold(lines):
+        name, params, value = _content_line(line)
+        if name == "BEGIN":
+            if value.upper() in ("VEVENT", "VTODO") and component is None:
+                component, properties, alarm = value.upper(), [], None
+            elif value.upper() == "VALARM" and component is not None:
+                alarm = []
+        elif name == "END":
+            if value.upper() == "VALARM":
+                if alarm is not None:
+                    properties.append(("VALARM", {}, alarm))
+                alarm = None
+            elif value.upper() == component:
+                try:
+                    yield _ical_record(component, properties, default_collection, tz)
+                except (ValueError, KeyError, OverflowError) as e:
+                    yield SkippedRecord(f"Invalid {component}: {e}")
+                component = None
+        elif alarm is not None and component is not None:
+            alarm.append((name, params, value))
+        elif component is not None:
+            properties.append((name, params, value))
+
+
+def _unfold(lines):
+    """RFC 5545 content lines, with continuation lines (leading space or tab) joined back on."""
+    current = None
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _content_line(line):
+    """'DTSTART;TZID=Asia/Kolkata:20270305T090000' -> ('DTSTART', {'TZID': 'Asia/Kolkata'}, '20270305T090000')."""
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        head, value = line, ""
+    name, *params = head.split(";")
+    return name.upper(), {key.upper(): val.strip('"') for key, _, val in (p.partition("=") for p in params)}, value
+
+
+def _ical_text(value):
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ical_time(value, params, tz):
+    """(aware UTC datetime, is a date) for a DATE or DATE-TIME value; floating times are in `tz`."""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        day = datetime.strptime(value[:8], "%Y%m%d")
+        return tz.localize(day).astimezone(pytz.utc), True
+    moment = datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return moment.replace(tzinfo=pytz.utc), False
+    return get_timezone(params.get("TZID") or tz.zone).localize(moment).astimezone(pytz.utc), False
+
+
+_DURATION = re.compile(r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+def _ical_duration(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f"Not a duration: {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+
+def _ical_record(component, properties, default_collection, tz):
+    values = {}
+    exdates = []
+    alarm = None
+    for name, params, value in properties:
+        if name == "EXDATE":
+            exdates += [_ical_time(part, params, tz)[0] for part in value.split(",") if part]
+        elif name == "VALARM":
+            alarm = alarm or {alarm_name: (alarm_params, alarm_value) for alarm_name, alarm_params, alarm_value in value}
+        else:
+            values.setdefault(name, (params, value))
+
+    def text(name):
+        return _ical_text(values[name][1]) if name in values else None
+
+    def moment(name):
+        return _ical_time(values[name][1], values[name][0], tz) if name in values else (None, False)
+
+    fields = {"title": text("SUMMARY") or "Untitled"}
+    if text("DESCRIPTION"):
+        fields["description"] = text("DESCRIPTION")
+
+    if component == "VEVENT":
+        collection = "events"
+        start, all_day = moment("DTSTART")
+        if start is None:
+            raise ValueError("no DTSTART")
+        end = moment("DTEND")[0] or (start + _ical_duration(values["DURATION"][1]) if "DURATION" in values else None)
+        fields.update({"start": start, "location": text("LOCATION") or "Not specified"})
+        if end:
+            fields["end"] = end
+        if all_day:
+            fields["allDay"] = True
+    else:
+        collection = text("X-TASKMATE-COLLECTION") or default_collection
+        start = moment("DUE")[0] or moment("DTSTART")[0]
+        if start is None:
+            raise ValueError("no DUE or DTSTART")
+        fields.update({"DueDate": start, "completed": (text("STATUS") or "").upper() == "COMPLETED"})
+
+    if "RRULE" in values:
+        # A series keeps its first occurrence in dtstart instead of start/DueDate
+        field = time_field(collection)
+        fields["dtstart"] = fields.pop(field)
+        fields["rrule"] = values["RRULE"][1]
+        # A TZID that isn't an IANA name (Outlook's "W. Europe Standard Time") was read in the
+        # default timezone by _ical_time, so the series repeats in that one too
+        fields["timezone"] = get_timezone(values["DTSTART" if "DTSTART" in values else "DUE"][0].get("TZID")
+                                          or tz.zone).zone
+        if exdates:
+            fields["exdates"] = exdates
+
+    if alarm and "TRIGGER" in alarm:
+        params, value = alarm["TRIGGER"]
+        if params.get("VALUE") == "DATE-TIME":
+            fields["reminderTime"] = _ical_time(value, params, tz)[0]
+        else:
+            fields["reminderTime"] = fields.get("start") or fields.get("DueDate") or fields["dtstart"]
+            fields["reminderTime"] += _ical_duration(value)
+
+    uid = text("UID")
+    recurrence_id = moment("RECURRENCE-ID")[0] if uid else None
+    return ImportRecord(collection, fields, uid[:-len("@taskmate")] if uid and uid.endswith("@taskmate") else uid,
+                        recurrence_id)
+
+
+# 📥 Writing
+
+def to_document(user_id, record, now):
+    """The Firestore fields for an ImportRecord; raises ValueError if it can't be one."""
+    if record.collection not in COLLECTIONS:
+        raise ValueError(f"Unknown collection {record.collection!r}")
+    fields = {key: value for key, value in record.fields.items() if key not in LOCAL_FIELDS}
+    for field in TIMESTAMP_FIELDS:
+        if isinstance(fields.get(field), str):
+            fields[field] = parse_datetime(fields[field]).astimezone(pytz.utc)
+        if fields.get(field) is not None and not isinstance(fields[field], datetime):
+            raise ValueError(f"{field} must be a timestamp")
+    exdates = fields.get("exdates")
+    if exdates is not None:
+        if not isinstance(exdates, list) or not all(isinstance(value, (str, datetime)) for value in exdates):
+            raise ValueError("exdates must be a list of timestamps")
+        fields["exdates"] = [parse_datetime(value).astimezone(pytz.utc) if isinstance(value, str) else value
+                             for value in exdates]
+    if not isinstance(fields.get("title", ""), str):
+        raise ValueError("title must be a string")
+
+    field = time_field(record.collection)
+    if fields.get("rrule") is not None:
+        # Every read expands a series, so one that can't be is refused here rather than stored
+        check_series(fields)
+    elif not isinstance(fields.get(field), datetime):
+        raise ValueError(f"Missing {field}")
+    fields.setdefault("title", "Untitled")
+    fields["userId"] = user_id
+
+    if isinstance(fields.get("reminderTime"), datetime):
+        fields.setdefault("reminderSent", False)
+        if fields["reminderTime"] <= now and not fields["reminderSent"]:
+            # A series moves on to its next reminder; anything else in the past counts as sent
+            fields.update(next_reminder(fields, now) if is_series(fields) else {"reminderSent": True})
+    return fields
+
+
+def document_id(user_id, record):
+    """Stable per user and record, so re-imports overwrite; records without an id are keyed by content.
+    An override is keyed by its series' id and the occurrence it replaces."""
+    source = record.source_id or json.dumps(record.fields, sort_keys=True, default=str)
+    if record.source_id and record.recurrence_id:
+        source += f"@{record.recurrence_id.astimezone(pytz.utc).isoformat()}"
+    return hashlib.sha256(f"{user_id}:{record.collection}:{source}".encode()).hexdigest()[:40]
+
+
+def series_id(user_id, record):
+    """The document id of the series an override belongs to."""
+    return document_id(user_id, ImportRecord(record.collection, {}, record.source_id))
+
+
+def import_token(db, user_id):
+    """A device token for a user's imported reminders: a registered device's, else the one
+    on any of their existing events and tasks; None when they have neither."""
+    tokens = registry.tokens_for(db, [user_id]).get(user_id)
+    if tokens:
+        return tokens[0]
+    for collection in COLLECTIONS:
+        query = db.collection(collection).where(filter=field_filter("userId", "==", user_id)) \
+            .select(["token"]).limit(TOKEN_LOOKUP_DOCUMENTS)
+        for snapshot in stream_query(query, collection, "import_token"):
+            token = snapshot.to_dict().get("token")
+            if token and not registry.is_dead(token):
+                return token
+    return None
+
+
+def start_import(db, user_id, source=None):
+    """Creates a pending import and returns its progress document, so a client knows the
+    import_id to resume with before it sends a single byte."""
+    import_id = uuid.uuid4().hex
+    progress = _new_progress(import_id, user_id, source, datetime.now(pytz.utc))
+    progress["status"] = "pending"
+    db.collection(IMPORTS_COLLECTION).document(import_id).set(progress)
+    return progress
+
+
+def _new_progress(import_id, user_id, source, now):
+    return {"importId": import_id, "userId": user_id, "source": source, "startedAt": now,
+            "position": 0, "written": 0, "skipped": 0, "errors": []}
+
+
+def import_records(db, user_id, records, import_id=None, source=None):
+    """Writes parsed records for a user through a BulkWriter, checkpointing as it goes.
+
+    Returns the import's progress document. With the import_id of an unfinished
+    import, the records it already got through are skipped.
+    """
+    import_id = import_id or uuid.uuid4().hex
+    checkpoint_ref = db.collection(IMPORTS_COLLECTION).document(import_id)
+    snapshot = checkpoint_ref.get()
+    progress = snapshot.to_dict() if snapshot.exists else None
+    if progress and progress.get("userId") != user_id:
+        raise ValueError("That import_id belongs to another user")
+    if progress and progress.get("status") == "done":
+        return progress
+    now = datetime.now(pytz.utc)
+    progress = progress or _new_progress(import_id, user_id, source, now)
+    progress["status"] = "running"
+    token = import_token(db, user_id)
+    resume_at = progress["position"]
+    if resume_at:
+        logger.info("📦 Resuming import %s after %d records", import_id, resume_at)
+
+    writer = db.bulk_writer()
+    failed = []
+
+    def on_write_error(failure, _):
+        # BulkWriter retries a failed write for as long as this returns True
+        if failure.attempts < 3:
+            return True
+        failed.append(failure.message)
+        return False
+
+    writer.on_write_error(on_write_error)
+
+    # Series id -> occurrences overridden anywhere in the file, for a series written after its overrides;
+    # `unapplied` holds those still to add to series written before them, at the next checkpoint
+    overridden, unapplied = {}, {}
+
+    def add_exdates():
+        if not unapplied:
+            return
+        writer.flush()
+        # Document ids include the collection, so they're unique across the keys
+        keys = {master: (collection, master) for collection, master in unapplied}
+        references = [db.collection(collection).document(master) for collection, master in keys.values()]
+        for snapshot in db.get_all(references):
+            data = snapshot.to_dict() if snapshot.exists else None
+            if not is_series(data) or data.get("userId") != user_id:
+                continue  # its series isn't written yet, and will carry the exdates itself
+            moments = unapplied[keys[snapshot.id]]
+            writer.update(snapshot.reference, {"exdates": sorted(set(data.get("exdates") or ()) | moments)})
+        unapplied.clear()
+
+    def checkpoint(status="running"):
+        add_exdates()
+        writer.flush()
+        progress.update(status=status, updatedAt=datetime.now(pytz.utc), failedWrites=progress.get("failedWrites", 0) + len(failed))
+        failed.clear()
+        checkpoint_ref.set(progress)
+
+    position = 0
+    with span("bulk_import", user_id=user_id, import_id=import_id):
+        try:
+            for record in records:
+                position += 1
+                override = isinstance(record, ImportRecord) and record.source_id and record.recurrence_id
+                if override:
+                    # Noted for records skipped on a resume too: their series may still be to come
+                    key = (record.collection, series_id(user_id, record))
+                    overridden.setdefault(key, set()).add(record.recurrence_id)
+                    if position > resume_at:
+                        unapplied.setdefault(key, set()).add(record.recurrence_id)
+                if position <= resume_at:
+                    continue
+                try:
+                    if isinstance(record, SkippedRecord):
+                        raise ValueError(record.reason)
+                    fields = to_document(user_id, record, now)
+                except (ValueError, TypeError, OverflowError) as e:
+                    progress["skipped"] += 1
+                    if len(progress["errors"]) < MAX_REPORTED_ERRORS:
+                        progress["errors"].append(f"Record {position}: {e}")
+                else:
+                    doc_id = document_id(user_id, record)
+                    if is_series(fields) and (record.collection, doc_id) in overridden:
+                        fields["exdates"] = sorted(set(fields.get("exdates") or ()) |
+                                                   overridden[(record.collection, doc_id)])
+                    if fields.get("reminderSent") is False:
+                        if token:
+                            fields["token"] = token
+                        else:
+                            fields.update(reminderSent=True, reminderError="No device token")
+                    fields["importId"] = import_id
+                    writer.set(db.collection(record.collection).document(doc_id), fields)
+                    progress["written"] += 1
+                progress["position"] = position
+                if position % CHECKPOINT_RECORDS == 0:
+                    checkpoint()
+        except Exception:
+            # Whatever got written is kept; the same import_id picks up from the last checkpoint
+            checkpoint("failed")
+            raise
+        checkpoint("done")
+        writer.close()
+
+    logger.info("📦 Import %s: %d written, %d skipped", import_id, progress["written"], progress["skipped"])
+    return progress
+
+
+# 📤 Export
+
+def user_documents(db, user_id):
+    """Yields (collection, snapshot) for all of a user's events and tasks, page by page."""
+    for collection in COLLECTIONS:
+        # Index: events (userId, start) and tasks_* (userId, DueDate)
+        plan = RangeQuery("export", collection, time_field(collection), equals={"userId": user_id})
+        for snapshot in plan.stream(db):
+            yield collection, snapshot
+        for snapshot in user_series(db, collection, user_id):
+            yield collection, snapshot
+
+
+def _exported(collection, snapshot):
+    data = {key: value for key, value in snapshot.to_dict().items() if key not in LOCAL_FIELDS}
+    return {"collection": collection, "id": snapshot.id, **data}
+
+
+def export_ndjson(db, user_id):
+    for collection, snapshot in user_documents(db, user_id):
+        yield json.dumps(_exported(collection, snapshot), default=_json_value, ensure_ascii=False) + "\n"
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def export_ics(db, user_id):
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//TaskMate AI//Export//EN\r\n"
+    stamp = _ics_time(datetime.now(pytz.utc))
+    for collection, snapshot in user_documents(db, user_id):
+        data = snapshot.to_dict()
+        component = "VEVENT" if collection == "events" else "VTODO"
+        series = is_series(data)
+        first = data.get("dtstart") if series else data.get(time_field(collection))
+        lines = [f"BEGIN:{component}", f"UID:{snapshot.id}@taskmate", f"DTSTAMP:{stamp}",
+                 f"SUMMARY:{_ics_text(data.get('title', 'Untitled'))}"]
+        if component == "VEVENT":
+            lines.append(f"DTSTART;VALUE=DATE:{first.astimezone(get_timezone()):%Y%m%d}" if data.get("allDay")
+                         else f"DTSTART:{_ics_time(first)}")
+            if data.get("end") and not data.get("allDay"):
+                lines.append(f"DTEND:{_ics_time(data['end'])}")
+            if data.get("location"):
+                lines.append(f"LOCATION:{_ics_text(data['location'])}")
+        else:
+            lines += [f"DUE:{_ics_time(first)}", f"X-TASKMATE-COLLECTION:{collection}"]
+            if data.get("completed"):
+                lines.append("STATUS:COMPLETED")
+        if data.get("description"):
+            lines.append(f"DESCRIPTION:{_ics_text(data['description'])}")
+        if series:
+            lines.append(f"RRULE:{data['rrule']}")
+            lines += [f"EXDATE:{_ics_time(moment)}" for moment in data.get("exdates") or ()]
+        if data.get("reminderTime") and not data.get("reminderSent"):
+            lines += ["BEGIN:VALARM", "ACTION:DISPLAY", f"DESCRIPTION:{_ics_text(data.get('title', 'Reminder'))}",
+                      f"TRIGGER;VALUE=DATE-TIME:{_ics_time(data['reminderTime'])}", "END:VALARM"]
+        lines.append(f"END:{component}")
+        yield "".join(_fold(line) + "\r\n" for line in lines)
+    yield "END:VCALENDAR\r\n"
+
+
+def _ics_time(moment):
+    return moment.astimezone(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _ics_text(value):
+    return str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line, limit=75):
+    """Splits a content line into 75-octet pieces, continuation lines starting with a space."""
+    encoded = line.encode()
+    if len(encoded) <= limit:
+        return line
+    pieces, current = [], b""
+    for char in line:
+        piece = char.encode()
+        if len(current) + len(piece) > (limit if not pieces else limit - 1):
+            pieces.append(current.decode())
+            current = b""
+        current += piece
+    pieces.append(current.decode())
+    return "\r\n ".join(pieces)
+
+
+def export_chunks(db, user_id, format="ndjson"):
+    """The export as a generator of text chunks, for a streamed (chunked) response."""
+    lines = export_ics(db, user_id) if format == "ics" else export_ndjson(db, user_id)
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_CHUNK_LINES:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def parse_records(lines, format, collection="tasks_self", timezone=None):
+    if format == "ics":
+        return ical_records(lines, collection, timezone)
+    return ndjson_records(lines, collection)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Bulk import/export of a user's events and tasks.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    importing = commands.add_parser("import", help="import an .ics or .ndjson file")
+    importing.add_argument("file")
+    importing.add_argument("--user", required=True)
+    importing.add_argument("--format", choices=FORMATS, help="default: from the file name")
+    importing.add_argument("--collection", default="tasks_self", choices=TASK_COLLECTIONS,
+                           help="where tasks without a collection go")
+    importing.add_argument("--timezone", help="for iCalendar times without one")
+    importing.add_argument("--import-id", help="resume this import (default: one derived from the file)")
+    exporting = commands.add_parser("export", help="write a user's data to stdout")
+    exporting.add_argument("--user", required=True)
+    exporting.add_argument("--format", choices=FORMATS, default="ndjson")
+    args = arg_parser.parse_args()
+
+    from app import db
+
+    if args.command == "export":
+        for chunk in export_chunks(db, args.user, args.format):
+            sys.stdout.write(chunk)
+        return
+
+    format = args.format or guess_format(args.file)
+    if format is None:
+        arg_parser.error("Can't tell the format from the file name, pass --format")
+    # Re-running the same command resumes: the default id is the same for the same user and file
+    import_id = args.import_id or hashlib.sha256(f"{args.user}:{os.path.abspath(args.file)}".encode()).hexdigest()[:32]
+    with open(args.file, encoding="utf-8") as lines:
+        progress = import_records(db, args.user, parse_records(lines, format, args.collection, args.timezone),
+                                  import_id, source=os.path.basename(args.file))
+    print(json.dumps(progress, default=_json_value, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""🧪 pytest fixtures: app.py booted against the in-memory Firestore/FCM stand-ins from benchmark.py."""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("TITHI_PREFETCH", "false")
+os.environ.setdefault("RUN_REMINDER_SCHEDULER", "false")
+os.environ.setdefault("WARM_ON_START", "false")
+
+
+@pytest.fixture(scope="session")
+def booted():
+    """(app module, FakeFirestore, StubFCM), shared by the whole run — tests use their own user ids."""
+    import benchmark
+    app, db, fcm, _ = benchmark.boot(SimpleNamespace(emulator=False, firestore_latency_ms=0, fcm_latency_ms=0,
+                                                     fcm_failure_rate=0, upstream_latency_ms=0))
+    return app, db, fcm
+
+
+@pytest.fixture
+def client(booted):
+    return booted[0].get_app().test_client()
+
+
+@pytest.fixture(autouse=True)
+def id_tokens(monkeypatch):
+    """Firebase ID tokens for tests: "token-<uid>" verifies as <uid>, anything else is rejected."""
+    from firebase_admin import auth
+
+    def verify_id_token(id_token, app=None, check_revoked=False, clock_skew_seconds=0):
+        if not id_token.startswith("token-"):
+            raise auth.InvalidIdTokenError("Not a test token")
+        return {"uid": id_token[len("token-"):]}
+
+    monkeypatch.setattr(auth, "verify_id_token", verify_id_token)
+
+
+@pytest.fixture
+def signed_in_as():
+    """Request headers for a user: signed_in_as("u1") -> {"Authorization": "Bearer token-u1"}."""
+    return lambda uid: {"Authorization": f"Bearer token-{uid}"}
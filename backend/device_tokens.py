@@ -0,0 +1,199 @@
+"""📱 FCM device tokens: every user's devices, in one registry.
+
+`devices` holds one document per token, with the SHA-256 of the token as its id:
+{userId, token, platform, lastSeen}. A user has as many as they have devices. Keying
+by token means a token is stored once however many events and tasks its owner has,
+registering it for another user (a phone changing hands) moves it with one write,
+a refreshed token replaces the old one in the same transaction (only when the old
+one is registered to the same user), and pruning dead tokens is a batch of deletes
+by id, with no query.
+
+The app doesn't call /devices yet: it writes a `token` field on each event and task,
+and that stays the primary address. Sends resolve tokens through DeviceRegistry,
+which caches each user's list for DEVICE_TOKEN_CACHE_SECONDS: the document's token
+first, plus any other device the user registered. A document token of a user with
+no registered device is adopted into the registry as it's sent to (set
+DEVICE_TOKEN_ADOPT=false to stop that), so the registry fills from the data that
+exists instead of waiting for the client. Tokens FCM rejects for good
+(UNREGISTERED, INVALID_ARGUMENT) are pruned in bulk after each send and remembered,
+so no other document's copy of them is tried again.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+from google.cloud.firestore_v1 import transactional
+
+from metrics import stream_query
+from queries import field_filter
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "devices"
+IN_QUERY_LIMIT = 30  # values per Firestore "in" filter
+WRITE_BATCH_SIZE = 500
+ADOPT_DOCUMENT_TOKENS = os.environ.get("DEVICE_TOKEN_ADOPT", "true").lower() == "true"
+
+
+def device_id(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+@transactional
+def _register_device(transaction, reference, retired, fields):
+    """Writes a device and deletes the token it was refreshed from, if that one is the same user's.
+
+    Returns the device's previous owner, if it had one.
+    """
+    previous = reference.get(transaction=transaction)
+    if retired is not None:
+        old = retired.get(transaction=transaction)
+        if old.exists and old.to_dict().get("userId") == fields["userId"]:
+            transaction.delete(retired)
+        elif old.exists:
+            logger.warning("🔐 Not retiring a replaced token registered to another user")
+    transaction.set(reference, fields)
+    return previous.to_dict().get("userId") if previous.exists else None
+
+
+class DeviceRegistry:
+    """Reads, registers and prunes device tokens, with a per-user LRU cache of them."""
+
+    def __init__(self, max_users=10000, ttl_seconds=300, max_dead=100000):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_dead = max_dead
+        self._users = OrderedDict()  # user id -> (loaded at, [tokens])
+        self._dead = OrderedDict()  # tokens FCM has rejected for good, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tokens_for(self, db, user_ids):
+        """{user id: [registered tokens]} for each of user_ids, reading only users not cached."""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in dict.fromkeys(user_ids):
+                entry = self._users.get(user_id)
+                if entry and now - entry[0] <= self.ttl_seconds:
+                    self._users.move_to_end(user_id)
+                    found[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        for i in range(0, len(missing), IN_QUERY_LIMIT):
+            chunk = missing[i:i + IN_QUERY_LIMIT]
+            loaded = {user_id: [] for user_id in chunk}
+            query = db.collection(COLLECTION).where(filter=field_filter("userId", "in", chunk))
+            for snapshot in stream_query(query, COLLECTION, "devices"):
+                data = snapshot.to_dict()
+                loaded[data["userId"]].append(data["token"])
+            with self._lock:
+                for user_id, tokens in loaded.items():
+                    self._users[user_id] = (now, tokens)
+                    self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def resolve(self, db, targets):
+        """For (user id, document token) pairs, the tokens to send each to: the document's
+        token, then the user's other registered devices. Tokens known to be dead are left out."""
+        registered = self.tokens_for(db, [user_id for user_id, _ in targets if user_id])
+        resolved, orphans = [], {}
+        for user_id, token in targets:
+            tokens = dict.fromkeys(([token] if token else []) + registered.get(user_id, []))
+            resolved.append([token for token in tokens if not self.is_dead(token)])
+            if user_id and token and not registered.get(user_id) and not self.is_dead(token):
+                orphans.setdefault(user_id, token)
+        if orphans and ADOPT_DOCUMENT_TOKENS:
+            self.adopt(db, orphans)
+        return resolved
+
+    def adopt(self, db, tokens):
+        """Registers {user id: token} found on documents, for users with no device yet.
+        Tokens already registered (to anyone) are left as they are."""
+        references = {device_id(token): (user_id, token) for user_id, token in tokens.items()}
+        collection = db.collection(COLLECTION)
+        existing = {snapshot.id for snapshot in db.get_all([collection.document(key) for key in references])
+                    if snapshot.exists}
+        adopted = [(key, owner) for key, owner in references.items() if key not in existing]
+        now = datetime.now(pytz.utc)
+        for i in range(0, len(adopted), WRITE_BATCH_SIZE):
+            batch = db.batch()
+            for key, (user_id, token) in adopted[i:i + WRITE_BATCH_SIZE]:
+                batch.set(collection.document(key), {"userId": user_id, "token": token, "platform": None,
+                                                     "lastSeen": now, "adopted": True})
+            batch.commit()
+        with self._lock:
+            for _, (user_id, _) in adopted:
+                self._users.pop(user_id, None)
+        if adopted:
+            logger.info("📱 Adopted %d device tokens from users' documents", len(adopted))
+
+    def is_dead(self, token):
+        return token in self._dead
+
+    def register(self, db, user_id, token, platform=None, replaces=None):
+        """Adds (or moves) a device to a user; `replaces` is the token it was refreshed from."""
+        reference = db.collection(COLLECTION).document(device_id(token))
+        retired = db.collection(COLLECTION).document(device_id(replaces)) if replaces and replaces != token else None
+        previous_owner = _register_device(db.transaction(), reference, retired, {
+            "userId": user_id, "token": token, "platform": platform, "lastSeen": datetime.now(pytz.utc)})
+
+        with self._lock:
+            self._dead.pop(token, None)
+            for owner in {user_id, previous_owner}:
+                self._users.pop(owner, None)
+        logger.info("📱 Registered a device for %s%s", user_id,
+                    f" (moved from {previous_owner})" if previous_owner not in (None, user_id) else "")
+
+    def unregister(self, db, user_id, token):
+        """Removes a user's device; returns False if the token isn't registered to them."""
+        reference = db.collection(COLLECTION).document(device_id(token))
+        snapshot = reference.get()
+        if not snapshot.exists or snapshot.to_dict().get("userId") != user_id:
+            return False
+        reference.delete()
+        with self._lock:
+            self._users.pop(user_id, None)
+        return True
+
+    def prune(self, db, tokens):
+        """Deletes tokens FCM rejected for good, in batched writes, and remembers them as dead."""
+        tokens = set(tokens)
+        if not tokens:
+            return
+        with self._lock:
+            for token in tokens:
+                self._dead[token] = True
+                self._dead.move_to_end(token)
+            while len(self._dead) > self.max_dead:
+                self._dead.popitem(last=False)
+            for user_id in [user_id for user_id, (_, cached) in self._users.items() if tokens.intersection(cached)]:
+                del self._users[user_id]
+
+        collection = db.collection(COLLECTION)
+        ordered = sorted(tokens)
+        for i in range(0, len(ordered), WRITE_BATCH_SIZE):
+            batch = db.batch()
+            for token in ordered[i:i + WRITE_BATCH_SIZE]:
+                batch.delete(collection.document(device_id(token)))  # a no-op for unregistered tokens
+            batch.commit()
+        logger.info("🧹 Pruned %d dead device tokens", len(tokens))
+
+    def stats(self):
+        return {"users": len(self._users), "dead": len(self._dead), "hits": self.hits, "misses": self.misses}
+
+
+registry = DeviceRegistry(max_users=int(os.environ.get("DEVICE_TOKEN_CACHE_USERS", 10000)),
+                          ttl_seconds=int(os.environ.get("DEVICE_TOKEN_CACHE_SECONDS", 300)))
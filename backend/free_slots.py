@@ -0,0 +1,217 @@
+"""🟢 Free/busy answers from a per-user interval index.
+
+BusyIndex turns a user's events and tasks into busy intervals once, then answers
+"is this range free?", "what clashes with it?" and "where's the first free slot this
+long?" with binary searches instead of a scan over every item:
+
+- the intervals merged into disjoint busy blocks, as parallel sorted `starts`/`ends`
+  arrays, answer a free check with one bisect;
+- the raw intervals sorted by start, with a running maximum of their ends, list the
+  conflicts: bisect to the last one starting before the range, then walk back only
+  while the running maximum still reaches into it;
+- a max-tree over the gaps between blocks finds the first gap long enough in
+  O(log n), however many shorter gaps come before it.
+
+UserAgendaCache keeps one BusyIndex per cached user window, built on first use.
+Timed events are busy from `start` to `end`; all-day events don't block time; open
+tasks block the FREE_SLOT_TASK_MINUTES before their DueDate.
+"""
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+
+import pytz
+
+EVENT_MINUTES = int(os.environ.get("FREE_SLOT_EVENT_MINUTES", 60))  # events with no usable `end`
+TASK_MINUTES = int(os.environ.get("FREE_SLOT_TASK_MINUTES", 30))
+DEFAULT_SLOT_MINUTES = int(os.environ.get("FREE_SLOT_DEFAULT_MINUTES", 60))
+# Slot searches for a whole day stay inside these local hours
+DAY_START_HOUR = int(os.environ.get("FREE_SLOT_DAY_START_HOUR", 9))
+DAY_END_HOUR = int(os.environ.get("FREE_SLOT_DAY_END_HOUR", 18))
+# Items are read from this long before a range, to catch events already running when it starts
+LOOKBACK = timedelta(hours=int(os.environ.get("FREE_SLOT_LOOKBACK_HOURS", 12)))
+
+
+class Busy:
+    """One busy interval and what it came from ("event" or a tasks_* collection)."""
+
+    __slots__ = ("start", "end", "title", "source")
+
+    def __init__(self, start, end, title, source):
+        self.start = start
+        self.end = end
+        self.title = title
+        self.source = source
+
+    def to_json(self):
+        return {"title": self.title, "source": self.source,
+                "start": self.start.isoformat(), "end": self.end.isoformat()}
+
+
+def event_interval(event):
+    if event.get("allDay") or event.get("start") is None:
+        return None
+    start, end = event["start"], event.get("end")
+    if not end or end <= start:
+        end = start + timedelta(minutes=EVENT_MINUTES)
+    return Busy(start, end, event.get("title", "Untitled"), "event")
+
+
+def task_interval(collection, task):
+    due = task.get("DueDate")
+    if due is None or task.get("completed"):
+        return None
+    return Busy(due - timedelta(minutes=TASK_MINUTES), due, task.get("title", "Untitled"), collection)
+
+
+def busy_intervals(events, tasks):
+    """Busy intervals from event dicts and (collection, task dict) pairs."""
+    intervals = [event_interval(event) for event in events]
+    intervals += [task_interval(collection, task) for collection, task in tasks]
+    return [busy for busy in intervals if busy is not None]
+
+
+class _MaxTree:
+    """Max segment tree over a list, for "the first position ≥ i holding at least x"."""
+
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        self.tree = [float("-inf")] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def first_at_least(self, i, x):
+        return self._find(1, 0, self.size, i, x)
+
+    def _find(self, node, lo, hi, i, x):
+        if hi <= i or self.tree[node] < x:
+            return None
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._find(2 * node, lo, mid, i, x)
+        return found if found is not None else self._find(2 * node + 1, mid, hi, i, x)
+
+
+class BusyIndex:
+    """A user's (or a team's) busy intervals, indexed for free/conflict/slot queries.
+
+    Every query takes aware datetimes and treats ranges as half-open, [start, end).
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda busy: busy.start)
+        self._interval_starts = [busy.start.timestamp() for busy in self.intervals]
+        self._reach = list(accumulate((busy.end.timestamp() for busy in self.intervals), max))
+
+        # Merged into disjoint blocks; touching intervals become one block
+        self.starts, self.ends = [], []
+        for busy in self.intervals:
+            start, end = busy.start.timestamp(), busy.end.timestamp()
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+        # gap i lies between block i and block i + 1
+        self._gaps = _MaxTree([self.starts[i + 1] - self.ends[i] for i in range(len(self.starts) - 1)])
+
+    @classmethod
+    def union(cls, indexes):
+        """One index busy whenever any of `indexes` is — its free time is their common free time."""
+        return cls([busy for index in indexes for busy in index.intervals])
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def is_free(self, start, end):
+        i = bisect_right(self.ends, start.timestamp())  # the first block still running after start
+        return i == len(self.starts) or self.starts[i] >= end.timestamp()
+
+    def conflicts(self, start, end):
+        """The intervals overlapping [start, end), by start time."""
+        low, high = start.timestamp(), end.timestamp()
+        found = []
+        i = bisect_left(self._interval_starts, high) - 1
+        while i >= 0 and self._reach[i] > low:
+            if self.intervals[i].end.timestamp() > low:
+                found.append(self.intervals[i])
+            i -= 1
+        found.reverse()
+        return found
+
+    def first_free(self, start, end, duration):
+        """The earliest free (start, end) of `duration` inside [start, end), or None."""
+        low, high, length = start.timestamp(), end.timestamp(), duration.total_seconds()
+        i = bisect_right(self.ends, low)
+        if i == len(self.starts) or self.starts[i] - low >= length:
+            slot = low
+        else:
+            # The slot starts where some block j ≥ i ends: the first one followed by a long enough gap, or the last
+            j = self._gaps.first_at_least(i, length)
+            slot = self.ends[len(self.ends) - 1 if j is None else j]
+        if slot + length > high:
+            return None
+        return _moment(slot), _moment(slot + length)
+
+    def free_windows(self, start, end, min_duration=timedelta(0)):
+        """Every free (start, end) window inside [start, end) lasting at least min_duration."""
+        low, high, length = start.timestamp(), end.timestamp(), min_duration.total_seconds()
+        windows, cursor = [], low
+        i = bisect_right(self.ends, low)
+        while cursor < high:
+            gap_end = min(self.starts[i], high) if i < len(self.starts) else high
+            if gap_end > cursor and gap_end - cursor >= length:
+                windows.append((_moment(cursor), _moment(gap_end)))
+            if i == len(self.starts):
+                break
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        return windows
+
+
+def _moment(timestamp):
+    return datetime.fromtimestamp(timestamp, pytz.utc)
+
+
+def span_label(start, end, tz):
+    """A range worded for a reply, in the user's timezone."""
+    start, end = start.astimezone(tz), end.astimezone(tz)
+    if start.date() == end.date():
+        return f"from {start:%I:%M %p} to {end:%I:%M %p} on {start:%a %d %b}"
+    return f"from {start:%a %d %b %I:%M %p} to {end:%a %d %b %I:%M %p}"
+
+
+def working_hours(day, tz):
+    """The UTC range of DAY_START_HOUR..DAY_END_HOUR on a local calendar day."""
+    start = tz.localize(datetime.combine(day, time(DAY_START_HOUR))).astimezone(pytz.utc)
+    return start, tz.localize(datetime.combine(day, time(DAY_END_HOUR))).astimezone(pytz.utc)
+
+
+def first_free_during_work(index, start, end, duration, tz):
+    """The earliest free slot inside working hours between start and end, day by day."""
+    day, last_day = start.astimezone(tz).date(), end.astimezone(tz).date()
+    while day <= last_day:
+        work_start, work_end = working_hours(day, tz)
+        slot = index.first_free(max(start, work_start), min(end, work_end), duration)
+        if slot is not None:
+            return slot
+        day += timedelta(days=1)
+    return None
+
+
+class AvailabilityReply:
+    """What an availability intent resolved to, before any I/O: the range to look at,
+    and `answer(index)` to word the reply from that range's BusyIndex."""
+
+    def __init__(self, start_time, end_time, answer):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.answer = answer
+
+    def read_range(self):
+        return self.start_time - LOOKBACK, self.end_time
@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HolidayCache:
+    """Keeps one holiday index per (country, year) in memory, with TTL expiry
+    and an optional JSON snapshot on disk so restarts don't refetch."""
+
+    def __init__(self, loader, ttl_seconds=7 * 24 * 3600, snapshot_dir=None):
+        self.loader = loader  # loader(country, year) -> list of Calendarific holiday dicts
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_dir = snapshot_dir
+        self._years = {}  # (country, year) -> (loaded_at, {iso_date: [names]})
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, country, date):
+        """Returns the holiday names for an ISO date (YYYY-MM-DD)."""
+        year = date[:4]
+        index = self._get_year(country, year)
+        return list(index.get(date, []))
+
+    def invalidate(self, country=None, year=None):
+        with self._lock:
+            for key in list(self._years):
+                if (country is None or key[0] == country) and (year is None or key[1] == year):
+                    del self._years[key]
+
+    def __len__(self):
+        return len(self._years)
+
+    def _get_year(self, country, year):
+        key = (country, year)
+        entry = self._years.get(key)
+        if entry and not self._expired(entry[0]):
+            return entry[1]
+
+        # One loader per key, so a burst of misses only fetches the year once
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            entry = self._years.get(key)
+            if entry and not self._expired(entry[0]):
+                return entry[1]
+
+            snapshot = self._read_snapshot(country, year)
+            if snapshot and not self._expired(snapshot[0]):
+                self._years[key] = snapshot
+                return snapshot[1]
+
+            try:
+                index = self._build_index(self.loader(country, year))
+            except Exception as e:
+                logger.warning("⚠ Error loading holidays for %s %s: %s", country, year, e)
+                # Serve stale data rather than nothing when the upstream is down
+                stale = entry or snapshot
+                return stale[1] if stale else {}
+
+            loaded_at = time.time()
+            self._years[key] = (loaded_at, index)
+            self._write_snapshot(country, year, loaded_at, index)
+            logger.info("📦 Cached %d holidays for %s %s", sum(len(v) for v in index.values()), country, year)
+            return index
+
+    def _expired(self, loaded_at):
+        return time.time() - loaded_at > self.ttl_seconds
+
+    @staticmethod
+    def _build_index(holidays):
+        index = {}
+        for h in holidays:
+            iso = h.get("date", {}).get("iso")
+            if iso:
+                index.setdefault(iso, []).append(h["name"])
+        return index
+
+    def _snapshot_path(self, country, year):
+        return os.path.join(self.snapshot_dir, f"holidays_{country}_{year}.json")
+
+    def _read_snapshot(self, country, year):
+        if not self.snapshot_dir:
+            return None
+        try:
+            with open(self._snapshot_path(country, year)) as f:
+                data = json.load(f)
+            return data["loaded_at"], data["holidays"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("⚠ Ignoring unreadable holiday snapshot: %s", e)
+            return None
+
+    def _write_snapshot(self, country, year, loaded_at, index):
+        if not self.snapshot_dir:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = self._snapshot_path(country, year)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"loaded_at": loaded_at, "holidays": index}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("⚠ Could not write holiday snapshot: %s", e)
@@ -0,0 +1,180 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_ERRORS, UPSTREAM_CIRCUIT_OPEN, span
+
+# Statuses worth another attempt; any other 4xx is the request's fault, not the upstream's
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when an upstream call's attempts have used up its total deadline."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single
+    trial request through once `reset_after` seconds have passed."""
+
+    def __init__(self, failure_threshold=5, reset_after=30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """Shared keep-alive session for outbound API calls, with per-host timeouts, a
+    total deadline per call, bounded retries and a circuit breaker per upstream. Calls,
+    errors, latency and breaker state are exported through metrics.py on /metrics.
+
+    Retries happen here rather than in urllib3 so they stay inside the deadline:
+    failures to connect are retried for any method (nothing was sent); read timeouts,
+    dropped connections and RETRY_STATUSES only for idempotent methods. Only 5xx, 429
+    and transport errors count towards the breaker: a 4xx means the upstream answered.
+    """
+
+    def __init__(self, pool_size=10, retries=2, backoff_factor=0.2, default_timeout=(3.05, 4),
+                 default_deadline=4.5):
+        self.default_timeout = default_timeout
+        self.default_deadline = default_deadline
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._upstreams = {}  # host -> (name, timeout, deadline, breaker)
+
+    def register(self, name, url, timeout=None, deadline=None, failure_threshold=5, reset_after=30):
+        """`timeout` is (connect, read) per attempt; `deadline` bounds all attempts of one call, in seconds."""
+        host = urlparse(url).netloc
+        self._upstreams[host] = (name, timeout or self.default_timeout, deadline or self.default_deadline,
+                                 CircuitBreaker(failure_threshold, reset_after))
+        UPSTREAM_CIRCUIT_OPEN.set(0, upstream=name)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        name, timeout, deadline, breaker = self._upstreams.get(
+            host, (host, self.default_timeout, self.default_deadline, None))
+        timeout = kwargs.pop("timeout", timeout)
+
+        if breaker and not breaker.allow():
+            UPSTREAM_REQUESTS.calls.inc(upstream=name, outcome="rejected")
+            raise CircuitOpenError(f"{name} is unavailable (circuit open)")
+
+        started = time.monotonic()
+        try:
+            with span("taskmate_upstream_request", upstream=name, method=method):
+                response = self._send(method, url, timeout, started + deadline, **kwargs)
+                response.raise_for_status()
+        except Exception as e:
+            UPSTREAM_REQUESTS.observe(time.monotonic() - started, "error", upstream=name)
+            UPSTREAM_ERRORS.inc(upstream=name, error=_error_label(e))
+            if breaker and _client_error(e):
+                breaker.record_success()
+            elif breaker:
+                breaker.record_failure()
+            self._export_circuit(name, breaker)
+            raise
+
+        UPSTREAM_REQUESTS.observe(time.monotonic() - started, upstream=name)
+        if breaker:
+            breaker.record_success()
+        self._export_circuit(name, breaker)
+        return response
+
+    @staticmethod
+    def _export_circuit(name, breaker):
+        if breaker:
+            UPSTREAM_CIRCUIT_OPEN.set(0 if breaker.opened_at is None else 1, upstream=name)
+
+    def _send(self, method, url, timeout, deadline_at, **kwargs):
+        """Sends with up to `retries` more attempts, none of them past deadline_at."""
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{method} {urlparse(url).netloc} ran out of time after {attempt} attempts")
+            try:
+                response = self.session.request(method, url, timeout=(min(connect_timeout, remaining),
+                                                                      min(read_timeout, remaining)), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries or not (idempotent or _never_sent(e)):
+                    raise
+            else:
+                if attempt >= self.retries or not idempotent or response.status_code not in RETRY_STATUSES:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(max(0.0, min(self.backoff_factor * 2 ** (attempt - 1), deadline_at - time.monotonic())))
+
+
+def _client_error(error):
+    """True for a 4xx other than 429: the upstream answered, the request was at fault."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def _never_sent(error):
+    """True when the connection failed before any of the request went out."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    return isinstance(getattr(error.args[0] if error.args else None, "reason", None), NewConnectionError)
+
+
+def _error_label(error):
+    # Only the type/status: exception messages can echo URLs carrying API keys
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return type(error).__name__ + (f" ({status})" if status else "")
@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from metrics import INTENTS, span
+from pagination import ChatPage
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_REPLY = "That's taking longer than expected ⏳ — please ask me again in a moment."
+UNKNOWN_INTENT_REPLY = "I'm not sure how to help with that. Can you try rephrasing?"
+
+# 📄 Output context that carries a list's continuation token to the show_more intent
+CONTINUATION_CONTEXT = "list-continuation"
+CONTINUATION_LIFESPAN = 5
+
+
+class DialogflowRequest:
+    """The parts of a Dialogflow webhook payload the handlers use, parsed once."""
+
+    __slots__ = ("intent", "parameters", "user_id", "timezone", "fulfillment_messages", "session", "contexts", "raw")
+
+    def __init__(self, intent, parameters, user_id, fulfillment_messages, raw, session="", contexts=(),
+                 timezone=None):
+        self.intent = intent
+        self.parameters = parameters
+        self.user_id = user_id
+        self.timezone = timezone  # IANA name sent by the app, None for the default
+        self.fulfillment_messages = fulfillment_messages
+        self.session = session
+        self.contexts = contexts
+        self.raw = raw
+
+    @classmethod
+    def from_json(cls, req):
+        req = req or {}
+        query_result = req.get("queryResult") or {}
+        payload = (req.get("originalDetectIntentRequest") or {}).get("payload") or {}
+        return cls(
+            intent=(query_result.get("intent") or {}).get("displayName", ""),
+            parameters=query_result.get("parameters") or {},
+            user_id=payload.get("userId"),
+            fulfillment_messages=query_result.get("fulfillmentMessages") or [],
+            raw=req,
+            session=req.get("session") or "",
+            contexts=query_result.get("outputContexts") or [],
+            timezone=payload.get("timeZone"),
+        )
+
+    def context_parameters(self, name):
+        """Parameters of the active output context called `name`, or {}."""
+        for context in self.contexts:
+            if context.get("name", "").rsplit("/", 1)[-1] == name:
+                return context.get("parameters") or {}
+        return {}
+
+    def continuation_token(self):
+        return self.parameters.get("continuation_token") or \
+            self.context_parameters(CONTINUATION_CONTEXT).get("continuation_token")
+
+
+def fulfillment(df_request, reply):
+    """The webhook response body for a handler's reply (a string or a ChatPage).
+
+    A ChatPage with more to show sets the continuation context for show_more; a last
+    page expires it, so "show more" can't resume a list that has already ended.
+    """
+    if not isinstance(reply, ChatPage):
+        return {"fulfillmentText": reply}
+
+    response = {"fulfillmentText": reply.text}
+    if df_request.session:
+        context = {"name": f"{df_request.session}/contexts/{CONTINUATION_CONTEXT}"}
+        if reply.token:
+            context.update(lifespanCount=CONTINUATION_LIFESPAN, parameters={"continuation_token": reply.token})
+        else:
+            context["lifespanCount"] = 0
+        response["outputContexts"] = [context]
+    return response
+
+
+class IntentRouter:
+    """Dispatches Dialogflow intents through a dict of registered handlers.
+
+    Every handler takes a DialogflowRequest and returns the fulfillment text. Calls
+    are timed per intent in taskmate_intent_seconds / taskmate_intent_total{outcome}
+    on /metrics, and any call that runs past `deadline_seconds` is answered
+    with TIMEOUT_REPLY so the user gets a reply before Dialogflow's 5s cut-off. The
+    late handler keeps running in the pool and still warms the caches it touches.
+    """
+
+    def __init__(self, deadline_seconds=4.5, pool_size=16):
+        self.deadline_seconds = deadline_seconds
+        self.handlers = {}
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="intents")
+
+    def intent(self, *names):
+        def register(handler):
+            for name in names:
+                self.handlers[name] = handler
+            return handler
+        return register
+
+    def dispatch(self, df_request):
+        handler = self.handlers.get(df_request.intent)
+        if handler is None:
+            logger.warning("⚠ Intent not recognized: %r", df_request.intent)
+            return UNKNOWN_INTENT_REPLY
+
+        started = time.monotonic()
+        with span("taskmate_intent", intent=df_request.intent):
+            # Run in a copy of this context so the handler logs (and traces) under this request
+            future = self._pool.submit(contextvars.copy_context().run, handler, df_request)
+            try:
+                reply = future.result(timeout=self.deadline_seconds)
+                self._observe(df_request.intent, started)
+                return reply
+            except FutureTimeout:
+                logger.warning("⏳ %s missed the %ss budget", df_request.intent, self.deadline_seconds)
+                self._observe(df_request.intent, started, outcome="timeout")
+                return TIMEOUT_REPLY
+            except Exception:
+                self._observe(df_request.intent, started, outcome="error")
+                raise
+
+    async def dispatch_async(self, df_request):
+        """Same as dispatch(), for coroutine handlers (sync handlers run on a thread)."""
+        handler = self.handlers.get(df_request.intent)
+        if handler is None:
+            logger.warning("⚠ Intent not recognized: %r", df_request.intent)
+            return UNKNOWN_INTENT_REPLY
+
+        started = time.monotonic()
+        with span("taskmate_intent", intent=df_request.intent):
+            call = handler(df_request) if inspect.iscoroutinefunction(handler) \
+                else asyncio.get_running_loop().run_in_executor(self._pool, contextvars.copy_context().run, handler, df_request)
+            task = asyncio.ensure_future(call)
+            try:
+                # shield() leaves a late handler running instead of cancelling it
+                reply = await asyncio.wait_for(asyncio.shield(task), timeout=self.deadline_seconds)
+                self._observe(df_request.intent, started)
+                return reply
+            except asyncio.TimeoutError:
+                logger.warning("⏳ %s missed the %ss budget", df_request.intent, self.deadline_seconds)
+                self._observe(df_request.intent, started, outcome="timeout")
+                return TIMEOUT_REPLY
+            except Exception:
+                self._observe(df_request.intent, started, outcome="error")
+                raise
+
+    def _observe(self, intent, started, outcome="ok"):
+        INTENTS.observe(time.monotonic() - started, outcome, intent=intent)
@@ -0,0 +1,43 @@
+import threading
+
+
+class LazyProxy:
+    """Stands in for a client that is expensive to import or connect, and creates it
+    on first attribute access. Creation runs once, even under concurrent first use.
+
+    Callers use the proxy exactly like the client; resolve() hands out the real one.
+    """
+
+    def __init__(self, factory, name):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def __getattr__(self, attribute):
+        return getattr(resolve(self), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(resolve(self), attribute, value)
+
+    def __repr__(self):
+        state = "created" if created(self) else "not created yet"
+        return f"<LazyProxy {self._name} ({state})>"
+
+
+def resolve(proxy):
+    """The object behind a LazyProxy, creating it if needed; anything else is returned as is."""
+    if not isinstance(proxy, LazyProxy):
+        return proxy
+    instance = proxy._instance
+    if instance is None:
+        with proxy._lock:
+            instance = proxy._instance
+            if instance is None:
+                instance = proxy._factory()
+                object.__setattr__(proxy, "_instance", instance)
+    return instance
+
+
+def created(proxy):
+    return proxy._instance is not None
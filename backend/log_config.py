@@ -0,0 +1,95 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+# 🪪 The id of the HTTP request (or background job) being handled on this thread/task
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.0))
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; anything passed as `extra={"fields": {...}}` is merged in."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        return f"{line} {json.dumps(fields, ensure_ascii=False, default=str)}" if fields else line
+
+
+def setup_logging():
+    """Routes all logging through a queue so request threads never block on stdout.
+
+    LOG_LEVEL (default INFO) sets the level and LOG_FORMAT=text switches from JSON
+    lines to plain text. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "json") == "text":
+        stream.setFormatter(TextFormatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    else:
+        stream.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())  # stamp the id on the request's own thread
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def new_request_id(incoming=None):
+    """Sets (and returns) the id for the current request, reusing a caller-supplied one."""
+    request_id = incoming or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def log_payload(logger, message, payload):
+    """Logs a full payload only at DEBUG or for a LOG_PAYLOAD_SAMPLE_RATE sample of calls.
+
+    The payload is serialized only when it is actually going to be written.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={"fields": {"payload": payload}})
+    elif PAYLOAD_SAMPLE_RATE and random.random() < PAYLOAD_SAMPLE_RATE:
+        logger.info(message, extra={"fields": {"payload": payload, "sampled": True}})
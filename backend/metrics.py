@@ -0,0 +1,225 @@
+"""📊 In-process counters, gauges and latency histograms, scraped from /metrics in the
+Prometheus text format, plus optional OpenTelemetry spans around the same calls.
+
+Metrics are per process, and gunicorn's workers share one port, so with several
+workers each scrape of /metrics is answered by whichever worker takes it: counters
+jump between workers' totals and look like resets, and no one scrape is the sum.
+Scrape a web process running a single worker (scale it with --threads or more
+instances, each scraped on its own), or read the numbers as one worker's sample.
+Tracing is off unless TRACING_EXPORTER is set:
+
+- TRACING_EXPORTER=otlp sends spans to a local collector (OTEL_EXPORTER_OTLP_ENDPOINT,
+  default http://localhost:4317) and needs opentelemetry-exporter-otlp.
+- TRACING_EXPORTER=file appends spans as JSON to TRACING_FILE (default spans.jsonl)
+  and needs opentelemetry-sdk.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds, from cache hits up to Dialogflow's 5s cut-off and beyond
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+_tracer = None
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class TimedOperation:
+    """A `<name>_total{..., outcome}` counter and a `<name>_seconds{...}` histogram
+    that are always recorded together."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.calls = Counter(f"{name}_total", f"{help_text}, by outcome", tuple(label_names) + ("outcome",))
+        self.latency = Histogram(f"{name}_seconds", f"{help_text}, latency in seconds", label_names)
+
+    def observe(self, seconds, outcome="ok", **labels):
+        self.calls.inc(outcome=outcome, **labels)
+        self.latency.observe(seconds, **labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """Times the block, counting it as "error" if it raises, inside a span of the same name."""
+        started = time.monotonic()
+        with span(self.name, **labels):
+            try:
+                yield
+            except BaseException:
+                self.observe(time.monotonic() - started, "error", **labels)
+                raise
+        self.observe(time.monotonic() - started, **labels)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# The hot paths we tune worker counts and intervals against
+INTENTS = TimedOperation("taskmate_intent", "Dialogflow intents handled", ("intent",))
+FIRESTORE_QUERIES = TimedOperation("taskmate_firestore_query", "Firestore queries run", ("collection", "query"))
+FIRESTORE_DOCUMENTS = Counter("taskmate_firestore_documents_read_total", "Documents returned by Firestore queries",
+                              ("collection", "query"))
+UPSTREAM_REQUESTS = TimedOperation("taskmate_upstream_request", "Outbound API calls", ("upstream",))
+UPSTREAM_ERRORS = Counter("taskmate_upstream_errors_total", "Failed outbound API calls, by exception type and status",
+                          ("upstream", "error"))
+UPSTREAM_CIRCUIT_OPEN = Gauge("taskmate_upstream_circuit_open",
+                              "1 while an upstream's circuit breaker is open or half-open", ("upstream",))
+JOBS = TimedOperation("taskmate_job", "Background job runs (reminder sweeps, timer fires, dispatches)", ("job",))
+REMINDERS = Counter("taskmate_reminders_total", "Reminders processed by a sweep or timer fire", ("outcome",))
+NOTIFICATIONS = Counter("taskmate_scheduled_notifications_total", "Scheduled notifications dispatched",
+                        ("outcome",))
+
+
+def stream_query(query, collection, name):
+    """Runs query.stream() to completion, timing it and counting the documents read."""
+    with FIRESTORE_QUERIES.time(collection=collection, query=name):
+        snapshots = list(query.stream())
+    FIRESTORE_DOCUMENTS.inc(len(snapshots), collection=collection, query=name)
+    return snapshots
+
+
+async def astream_query(query, collection, name):
+    """stream_query() for the async Firestore client."""
+    with FIRESTORE_QUERIES.time(collection=collection, query=name):
+        snapshots = [snapshot async for snapshot in query.stream()]
+    FIRESTORE_DOCUMENTS.inc(len(snapshots), collection=collection, query=name)
+    return snapshots
+
+
+def setup_tracing():
+    """Turns on OpenTelemetry spans when TRACING_EXPORTER is otlp or file. Safe to call more than once."""
+    global _tracer
+    exporter_name = os.environ.get("TRACING_EXPORTER", "").lower()
+    if _tracer is not None or exporter_name not in ("otlp", "file"):
+        return
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+        if exporter_name == "otlp":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()  # reads OTEL_EXPORTER_OTLP_ENDPOINT
+        else:
+            out = open(os.environ.get("TRACING_FILE", "spans.jsonl"), "a")
+            exporter = ConsoleSpanExporter(out=out, formatter=lambda s: s.to_json(indent=None) + "\n")
+    except ImportError as e:
+        logger.warning("⚠ TRACING_EXPORTER=%s but OpenTelemetry isn't installed, tracing stays off: %s",
+                       exporter_name, e)
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", "taskmate")}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))  # exported off the request thread
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("taskmate")
+    logger.info("🔭 Tracing enabled, exporting spans via %s", exporter_name)
+
+
+def span(name, **attributes):
+    """A tracing span when tracing is on, otherwise a no-op context manager."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes={k: str(v) for k, v in attributes.items()})
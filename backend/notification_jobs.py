@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import Increment
+
+from log_config import new_request_id
+from metrics import JOBS, NOTIFICATIONS
+from queries import RangeQuery
+from notifications import send_fcm_batch, is_permanent_failure, commit_updates, FIRESTORE_BATCH_SIZE
+from device_tokens import registry
+
+logger = logging.getLogger(__name__)
+
+# 📬 One-off notifications scheduled through /schedule_notification
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT_SECONDS = 120  # a claim older than this belonged to a crashed dispatcher
+DISPATCH_BATCH_SIZE = 500
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _job_dict(job_id, owner, token, title, body, send_at, status, idempotency_key, attempts=0):
+    return {
+        "job_id": job_id,
+        "owner": owner,
+        "token": token,
+        "title": title,
+        "body": body,
+        "send_time": send_at.isoformat(),
+        "status": status,
+        "idempotency_key": idempotency_key,
+        "attempts": attempts,
+    }
+
+
+class SQLiteJobStore:
+    """Durable job store in a local SQLite file, indexed by (status, send time)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_jobs (
+                    id TEXT PRIMARY KEY,
+                    idempotency_key TEXT UNIQUE,
+                    owner TEXT,
+                    token TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    send_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_by TEXT,
+                    claimed_at REAL,
+                    last_error TEXT
+                )""")
+            if "owner" not in {row[1] for row in conn.execute("PRAGMA table_info(notification_jobs)")}:
+                conn.execute("ALTER TABLE notification_jobs ADD COLUMN owner TEXT")  # files from before owners
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON notification_jobs (status, send_at)")
+
+    def _connect(self):
+        # One connection per thread; WAL lets the web workers and the dispatcher share the file
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_job(row):
+        send_at = datetime.fromtimestamp(row["send_at"], pytz.utc)
+        key = row["idempotency_key"]
+        if key and row["owner"] and key.startswith(f"{row['owner']}:"):
+            key = key[len(row["owner"]) + 1:]
+        return _job_dict(row["id"], row["owner"], row["token"], row["title"], row["body"], send_at,
+                         row["status"], key, row["attempts"])
+
+    def add_many(self, jobs):
+        """Inserts (owner, token, title, body, send_at, idempotency_key) jobs in one transaction.
+
+        Returns (job, created) pairs; an owner repeating an idempotency key gets the existing job.
+        """
+        conn = self._connect()
+        results = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for owner, token, title, body, send_at, key in jobs:
+                job_id = uuid.uuid4().hex
+                # Keys are scoped to their owner, so one user's key never matches another's job
+                scoped = f"{owner}:{key}" if key else None
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO notification_jobs (id, idempotency_key, owner, token, title, body, send_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, scoped, owner, token, title, body, send_at.timestamp()))
+                if cursor.rowcount:
+                    results.append((_job_dict(job_id, owner, token, title, body, send_at, "pending", key), True))
+                else:
+                    row = conn.execute("SELECT * FROM notification_jobs WHERE idempotency_key = ?",
+                                       (scoped,)).fetchone()
+                    results.append((self._row_to_job(row), False))
+        return results
+
+    def get(self, job_id, owner):
+        row = self._connect().execute("SELECT * FROM notification_jobs WHERE id = ? AND owner = ?",
+                                      (job_id, owner)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def cancel(self, job_id, owner):
+        cursor = self._connect().execute(
+            "UPDATE notification_jobs SET status = 'cancelled' WHERE id = ? AND owner = ? AND status = 'pending'",
+            (job_id, owner))
+        return cursor.rowcount > 0
+
+    def reschedule(self, job_id, owner, send_at):
+        cursor = self._connect().execute(
+            "UPDATE notification_jobs SET send_at = ? WHERE id = ? AND owner = ? AND status = 'pending'",
+            (send_at.timestamp(), job_id, owner))
+        return cursor.rowcount > 0
+
+    def claim_due(self, now, limit=DISPATCH_BATCH_SIZE):
+        """Atomically marks up to `limit` due jobs as ours and returns them."""
+        conn = self._connect()
+        now_ts = now.timestamp()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Hand back jobs whose dispatcher died mid-send
+            conn.execute(
+                "UPDATE notification_jobs SET status = 'pending', claimed_by = NULL "
+                "WHERE status = 'sending' AND claimed_at < ?", (now_ts - CLAIM_TIMEOUT_SECONDS,))
+            conn.execute(
+                "UPDATE notification_jobs SET status = 'sending', claimed_by = ?, claimed_at = ? "
+                "WHERE id IN (SELECT id FROM notification_jobs WHERE status = 'pending' AND send_at <= ? "
+                "ORDER BY send_at LIMIT ?)", (WORKER_ID, now_ts, now_ts, limit))
+            rows = conn.execute(
+                "SELECT * FROM notification_jobs WHERE status = 'sending' AND claimed_by = ? AND claimed_at = ?",
+                (WORKER_ID, now_ts)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def settle(self, outcomes):
+        """Applies (job, status, error) outcomes from a dispatch round."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, status, error in outcomes:
+                conn.execute(
+                    "UPDATE notification_jobs SET status = ?, attempts = attempts + 1, last_error = ?, "
+                    "claimed_by = NULL WHERE id = ?", (status, error, job["job_id"]))
+
+
+class FirestoreJobStore:
+    """Job store in a Firestore collection, for deployments without a shared disk.
+
+    Needs a composite index on (status, send_at).
+    """
+
+    def __init__(self, db, collection="scheduled_notifications"):
+        self.db = db
+        self.collection = db.collection(collection)
+
+    @staticmethod
+    def _doc_to_job(snapshot):
+        data = snapshot.to_dict()
+        return _job_dict(snapshot.id, data.get("owner"), data["token"], data["title"], data["body"],
+                         data["send_at"], data["status"], data.get("idempotency_key"), data.get("attempts", 0))
+
+    @staticmethod
+    def _doc_id(owner, key):
+        # Idempotency keys (scoped to their owner) become the document id, so a retry can't
+        # create a second job and nobody can work out another user's job ids from theirs
+        return hashlib.sha256(f"{owner}:{key}".encode()).hexdigest() if key else uuid.uuid4().hex
+
+    @staticmethod
+    def _fields(owner, token, title, body, send_at, key):
+        return {"owner": owner, "token": token, "title": title, "body": body, "send_at": send_at,
+                "status": "pending", "idempotency_key": key, "attempts": 0}
+
+    def add_many(self, jobs):
+        """Creates jobs with WriteBatch commits of up to 500; a repeated idempotency key
+        returns the existing job."""
+        results = []
+        for i in range(0, len(jobs), FIRESTORE_BATCH_SIZE):
+            results += self._add_chunk(jobs[i:i + FIRESTORE_BATCH_SIZE])
+        return results
+
+    def _add_chunk(self, jobs):
+        references = [self.collection.document(self._doc_id(owner, key)) for owner, *_, key in jobs]
+        # Keys seen before are found with one read instead of one failed create each
+        keyed = [reference for reference, (*_, key) in zip(references, jobs) if key]
+        existing = {snapshot.id: snapshot for snapshot in self.db.get_all(keyed) if snapshot.exists} if keyed else {}
+
+        batch, results, added = self.db.batch(), [], {}
+        for reference, (owner, token, title, body, send_at, key) in zip(references, jobs):
+            if reference.id in existing:
+                results.append((self._doc_to_job(existing[reference.id]), False))
+            elif reference.id in added:
+                results.append((added[reference.id], False))  # the same key twice in one request
+            else:
+                batch.create(reference, self._fields(owner, token, title, body, send_at, key))
+                added[reference.id] = _job_dict(reference.id, owner, token, title, body, send_at, "pending", key)
+                results.append((added[reference.id], True))
+        if not added:
+            return results
+        try:
+            batch.commit()
+        except api_exceptions.AlreadyExists:
+            # A concurrent request created one of the keys since the read; the batch wrote nothing
+            return self._create_each(jobs)
+        return results
+
+    def _create_each(self, jobs):
+        results = []
+        for owner, token, title, body, send_at, key in jobs:
+            reference = self.collection.document(self._doc_id(owner, key))
+            try:
+                reference.create(self._fields(owner, token, title, body, send_at, key))
+                results.append((_job_dict(reference.id, owner, token, title, body, send_at, "pending", key), True))
+            except api_exceptions.AlreadyExists:
+                results.append((self._doc_to_job(reference.get()), False))
+        return results
+
+    def get(self, job_id, owner):
+        snapshot = self.collection.document(job_id).get()
+        if not snapshot.exists or snapshot.to_dict().get("owner") != owner:
+            return None
+        return self._doc_to_job(snapshot)
+
+    def _update_if_pending(self, job_id, owner, fields):
+        snapshot = self.collection.document(job_id).get()
+        if not snapshot.exists or snapshot.to_dict().get("owner") != owner or snapshot.get("status") != "pending":
+            return False
+        try:
+            snapshot.reference.update(fields, option=self.db.write_option(last_update_time=snapshot.update_time))
+            return True
+        except api_exceptions.FailedPrecondition:
+            return False
+
+    def cancel(self, job_id, owner):
+        return self._update_if_pending(job_id, owner, {"status": "cancelled"})
+
+    def reschedule(self, job_id, owner, send_at):
+        return self._update_if_pending(job_id, owner, {"send_at": send_at})
+
+    def claim_due(self, now, limit=DISPATCH_BATCH_SIZE):
+        # Indexes: scheduled_notifications (status, send_at) and (status, claimed_at)
+        due = RangeQuery("due_jobs", self.collection.id, "send_at", high=now,
+                         equals={"status": "pending"}).fetch(self.db, max_results=limit)
+        stale = RangeQuery("stale_claims", self.collection.id, "claimed_at",
+                           high=now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS), high_inclusive=False,
+                           equals={"status": "sending"}).fetch(self.db, max_results=limit)
+
+        claimed = []
+        for snapshot in due + stale:
+            try:
+                snapshot.reference.update(
+                    {"status": "sending", "claimed_by": WORKER_ID, "claimed_at": now},
+                    option=self.db.write_option(last_update_time=snapshot.update_time))
+                claimed.append(self._doc_to_job(snapshot))
+            except api_exceptions.FailedPrecondition:
+                pass  # another dispatcher took it
+        return claimed
+
+    def settle(self, outcomes):
+        commit_updates(self.db, [
+            (self.collection.document(job["job_id"]),
+             {"status": status, "attempts": Increment(1), "last_error": error, "claimed_by": None})
+            for job, status, error in outcomes
+        ])
+
+
+def dispatch_due_notifications(store, db=None):
+    """Sends every due job through the batched FCM pipeline and records the outcome.
+
+    Tokens FCM rejects for good are pruned from the device registry in `db`, if given.
+    """
+    new_request_id(f"notification-dispatch-{uuid.uuid4().hex[:8]}")
+    with JOBS.time(job="notification_dispatch"):
+        _dispatch_due_notifications(store, db)
+
+
+def _dispatch_due_notifications(store, db=None):
+    jobs = store.claim_due(datetime.now(pytz.utc))
+    if not jobs:
+        return
+
+    # A token already rejected for good fails its job without another send
+    rejected = {job["job_id"] for job in jobs if registry.is_dead(job["token"])}
+    errors = iter(send_fcm_batch([(job["token"], job["title"], job["body"])
+                                  for job in jobs if job["job_id"] not in rejected]))
+    outcomes, dead = [], []
+
+    for job in jobs:
+        if job["job_id"] in rejected:
+            outcomes.append((job, "failed", "Token rejected earlier"))
+            continue
+        error = next(errors)
+        if error is None:
+            outcomes.append((job, "sent", None))
+        elif is_permanent_failure(error) or job["attempts"] + 1 >= MAX_ATTEMPTS:
+            outcomes.append((job, "failed", str(error)))
+            if is_permanent_failure(error):
+                dead.append(job["token"])
+        else:
+            outcomes.append((job, "pending", str(error)))  # retried next round
+
+    try:
+        store.settle(outcomes)
+    finally:
+        if db is not None:
+            registry.prune(db, dead)
+    for _, status, _ in outcomes:
+        NOTIFICATIONS.inc(outcome=status)
+    sent = sum(1 for _, status, _ in outcomes if status == "sent")
+    logger.info("📬 Scheduled notifications: %d/%d sent", sent, len(jobs))
+
+
+def create_job_store(db):
+    """NOTIFICATION_JOB_STORE=firestore (default) or sqlite.
+
+    The web and worker processes run on separate hosts and a redeploy wipes the disk,
+    so only Firestore is shared and durable in production. SQLite (NOTIFICATION_DB_PATH)
+    is for running everything in one process locally.
+    """
+    if os.environ.get("NOTIFICATION_JOB_STORE", "firestore") == "sqlite":
+        return SQLiteJobStore(os.environ.get("NOTIFICATION_DB_PATH", "notification_jobs.sqlite3"))
+    return FirestoreJobStore(db)
+
+
+def schedule_notification_jobs(scheduler, store, db=None):
+    scheduler.add_job(func=lambda: dispatch_due_notifications(store, db), trigger="interval",
+                      seconds=int(os.environ.get("NOTIFICATION_DISPATCH_SECONDS", 15)),
+                      id="notification_dispatch")
@@ -0,0 +1,69 @@
+import logging
+
+from firebase_admin import exceptions, messaging
+
+logger = logging.getLogger(__name__)
+
+FCM_BATCH_SIZE = 500  # send_each accepts at most 500 messages per call
+FIRESTORE_BATCH_SIZE = 500  # and a WriteBatch at most 500 writes
+NOT_FOUND = 5  # gRPC status of an update to a document deleted since it was read
+
+# Errors that will never succeed on retry for this token
+PERMANENT_TOKEN_ERRORS = (messaging.UnregisteredError, exceptions.InvalidArgumentError,
+                          messaging.SenderIdMismatchError)
+
+
+def send_fcm_batch(notifications):
+    """Sends (token, title, body) notifications with FCM send_each, 500 at a time.
+
+    Returns one exception (or None on success) per notification, in order, so a
+    bad token only fails its own message and never the rest of the batch.
+    """
+    results = []
+
+    for i in range(0, len(notifications), FCM_BATCH_SIZE):
+        chunk = notifications[i:i + FCM_BATCH_SIZE]
+        messages = [
+            messaging.Message(notification=messaging.Notification(title=title, body=body), token=token)
+            for token, title, body in chunk
+        ]
+        try:
+            batch_response = messaging.send_each(messages)
+            results += [None if r.success else r.exception for r in batch_response.responses]
+        except Exception as e:
+            # The whole call failed (auth, network) — every message in the chunk is retryable
+            logger.error("❌ Error sending FCM batch of %d: %s", len(chunk), e)
+            results += [e] * len(chunk)
+
+    return results
+
+
+def is_permanent_failure(error):
+    return isinstance(error, PERMANENT_TOKEN_ERRORS)
+
+
+def commit_updates(db, updates):
+    """Applies (document_reference, fields) updates through a BulkWriter; returns how many failed.
+
+    Each update succeeds or fails on its own, so a document deleted since it was read
+    costs only its own write, and every other sent reminder is still marked.
+    """
+    if not updates:
+        return 0
+    writer = db.bulk_writer()
+    failed = []
+
+    def on_write_error(failure, _):
+        # BulkWriter retries a failed write for as long as this returns True
+        if failure.code != NOT_FOUND and failure.attempts < 3:
+            return True
+        failed.append(failure.message)
+        return False
+
+    writer.on_write_error(on_write_error)
+    for reference, fields in updates:
+        writer.update(reference, fields)
+    writer.close()
+    if failed:
+        logger.warning("⚠ %d of %d Firestore updates failed, e.g. %s", len(failed), len(updates), failed[0])
+    return len(failed)
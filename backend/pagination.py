@@ -0,0 +1,127 @@
+"""📄 Paged list replies for the event and task intents.
+
+A list reply stops at CHAT_PAGE_ITEMS items or CHAT_REPLY_MAX_CHARS characters,
+whichever comes first, and reads at most one item past the page from Firestore to
+know whether there is more. When there is, the reply carries a continuation token
+that the show_more intent hands back to pick up where the page ended.
+
+The token is the cursor itself (no server-side state): the intent and parameters
+that produced the list, its time range, and the position of the last item shown as
+(timestamp, items already shown at that timestamp).
+"""
+import base64
+import json
+import os
+from datetime import datetime
+
+PAGE_ITEMS = int(os.environ.get("CHAT_PAGE_ITEMS", 10))
+MAX_REPLY_CHARS = int(os.environ.get("CHAT_REPLY_MAX_CHARS", 1500))
+
+MORE_HINT = "\n…and there's more. Say \"show more\" to see the next ones. 👇"
+END_REPLY = "That's everything — nothing more to show. ✅"
+EXPIRED_REPLY = "I've lost track of that list ⌛ — could you ask for it again?"
+
+
+class ChatPage:
+    """A reply with one page of a list. `token` is set when more items remain, and is
+    None on the last page (which also clears any older token from the chat)."""
+
+    __slots__ = ("text", "token")
+
+    def __init__(self, text, token=None):
+        self.text = text
+        self.token = token
+
+    def __str__(self):
+        return self.text
+
+
+class Cursor:
+    """Where the next page starts: at `after`, skipping the first `skip` items there."""
+
+    __slots__ = ("intent", "parameters", "user_id", "start_time", "end_time", "after", "skip", "shown", "timezone")
+
+    def __init__(self, intent, parameters, user_id, start_time, end_time, after, skip, shown, timezone=None):
+        self.intent = intent
+        self.parameters = parameters
+        self.user_id = user_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.after = after
+        self.skip = skip
+        self.shown = shown
+        self.timezone = timezone
+
+    def encode(self):
+        payload = {
+            "i": self.intent, "p": self.parameters, "u": self.user_id,
+            "s": self.start_time.isoformat(), "e": self.end_time.isoformat(),
+            "a": self.after.isoformat(), "k": self.skip, "n": self.shown, "z": self.timezone,
+        }
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token):
+        """Parses a continuation token; raises ValueError if it's malformed."""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            return cls(payload["i"], payload["p"], payload["u"],
+                       datetime.fromisoformat(payload["s"]), datetime.fromisoformat(payload["e"]),
+                       datetime.fromisoformat(payload["a"]), int(payload["k"]), int(payload["n"]),
+                       payload.get("z"))
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError(f"Invalid continuation token: {e}") from e
+
+
+class ListReply:
+    """What a list intent resolved to, before any I/O: the range to read, how to word
+    the reply, `key` — the timestamp the items are ordered by — and the timezone name
+    the reply was worded in."""
+
+    def __init__(self, start_time, end_time, header, empty_reply, render_item, key, timezone=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.header = header
+        self.empty_reply = empty_reply
+        self.render_item = render_item
+        self.key = key
+        self.timezone = timezone
+
+    def read_range(self, cursor=None):
+        """(start, end, limit) to read: from the cursor on, one item past a full page."""
+        if cursor is None:
+            return self.start_time, self.end_time, PAGE_ITEMS + 1
+        return cursor.after, self.end_time, cursor.skip + PAGE_ITEMS + 1
+
+    def page(self, found, intent, parameters, user_id, cursor=None):
+        """Formats the items read for read_range(cursor) into one ChatPage."""
+        if cursor is not None:
+            found = found[cursor.skip:]
+        if not found:
+            return ChatPage(self.empty_reply if cursor is None else END_REPLY)
+
+        shown_before = cursor.shown if cursor else 0
+        header = self.header if cursor is None else f"Here's more ({shown_before + 1} onwards):\n\n"
+        lines, size = [], len(header) + len(MORE_HINT)
+        for item in found:
+            if len(lines) == PAGE_ITEMS:
+                break
+            line = self.render_item(item)
+            if lines and size + len(line) + 1 > MAX_REPLY_CHARS:
+                break
+            lines.append(line)
+            size += len(line) + 1
+
+        text = header + "\n".join(lines)
+        if len(found) == len(lines):
+            return ChatPage(text)
+
+        # Resume after the last item shown, counting the items already shown at its timestamp
+        after = self.key(found[len(lines) - 1])
+        skip = sum(1 for item in found[:len(lines)] if self.key(item) == after)
+        if cursor is not None and cursor.after == after:
+            skip += cursor.skip
+        following = Cursor(intent, parameters, user_id, self.start_time, self.end_time, after, skip,
+                           shown_before + len(lines), self.timezone)
+        return ChatPage(text + MORE_HINT, following.encode())
@@ -0,0 +1,122 @@
+"""🔎 Query planner for the range queries on the hot paths.
+
+Every one of them has the same shape: equality filters, a range on one time field,
+ordered by that field. RangeQuery builds it with FieldFilter in one place, reads it
+in cursor-paginated pages of QUERY_PAGE_SIZE, and projects only the fields the replies
+and reminders use. Each shape needs the composite index (equality fields..., range
+field) listed in firestore.indexes.json; deploy it with
+`firebase deploy --only firestore:indexes` from this directory.
+"""
+import os
+
+from metrics import stream_query, astream_query
+
+PAGE_SIZE = int(os.environ.get("QUERY_PAGE_SIZE", 200))
+# Chat replies list at most this many events/tasks; power users with thousands of
+# items in a range no longer stream them all into memory
+MAX_CHAT_RESULTS = int(os.environ.get("QUERY_MAX_CHAT_RESULTS", 200))
+
+# 🪶 Fields each kind of read actually uses
+EVENT_FIELDS = ("title", "start", "location")
+TASK_FIELDS = ("title", "DueDate")
+# ⛔ Free/busy needs how long an event runs and which tasks are already done
+BUSY_EVENT_FIELDS = ("title", "start", "end", "allDay")
+BUSY_TASK_FIELDS = ("title", "DueDate", "completed")
+REMINDER_FIELDS = ("title", "userId", "token", "reminderTime", "reminderSent", "reminderLeaseUntil",
+                   # 🔁 what a recurring series needs to move its reminder to the next occurrence
+                   "rrule", "dtstart", "timezone", "exdates", "reminderOffsetMinutes")
+
+
+def field_filter(field, op, value):
+    # Imported here so that importing this module doesn't pull in the Firestore client library
+    from google.cloud.firestore_v1 import FieldFilter
+    return FieldFilter(field, op, value)
+
+
+class RangeQuery:
+    """Equality filters plus a range on `range_field`, ordered by it.
+
+    `low`/`high` may be None for an open end; `low_inclusive`/`high_inclusive` pick
+    between >= and > (<= and <). `fields` limits the documents to a projection, which
+    always includes the range field so the page cursors work.
+    """
+
+    def __init__(self, name, collection, range_field, low=None, high=None, equals=None,
+                 fields=None, low_inclusive=True, high_inclusive=True):
+        self.name = name
+        self.collection = collection
+        self.range_field = range_field
+        self.low = low
+        self.high = high
+        self.equals = equals or {}
+        self.fields = tuple(dict.fromkeys((*fields, range_field))) if fields else None
+        self.low_inclusive = low_inclusive
+        self.high_inclusive = high_inclusive
+
+    def build(self, client):
+        query = client.collection(self.collection)
+        for field, value in self.equals.items():
+            query = query.where(filter=field_filter(field, "==", value))
+        if self.low is not None:
+            query = query.where(filter=field_filter(self.range_field, ">=" if self.low_inclusive else ">", self.low))
+        if self.high is not None:
+            query = query.where(filter=field_filter(self.range_field, "<=" if self.high_inclusive else "<", self.high))
+        query = query.order_by(self.range_field)
+        if self.fields:
+            query = query.select(self.fields)
+        return query
+
+    def stream(self, db, max_results=None, page_size=PAGE_SIZE):
+        """Yields matching snapshots page by page, resuming each page after the last one read."""
+        query, cursor, remaining = self.build(db), None, max_results
+        while remaining is None or remaining > 0:
+            limit = page_size if remaining is None else min(page_size, remaining)
+            page_query = (query.start_after(cursor) if cursor is not None else query).limit(limit)
+            page = stream_query(page_query, self.collection, self.name)
+            yield from page
+            if len(page) < limit:
+                return
+            cursor = page[-1]
+            remaining = None if remaining is None else remaining - len(page)
+
+    def fetch(self, db, max_results=None, page_size=PAGE_SIZE):
+        return list(self.stream(db, max_results, page_size))
+
+    async def afetch(self, adb, max_results=None, page_size=PAGE_SIZE):
+        """fetch() for the async Firestore client."""
+        query, cursor, results = self.build(adb), None, []
+        while max_results is None or len(results) < max_results:
+            limit = page_size if max_results is None else min(page_size, max_results - len(results))
+            page_query = (query.start_after(cursor) if cursor is not None else query).limit(limit)
+            page = await astream_query(page_query, self.collection, self.name)
+            results += page
+            if len(page) < limit:
+                break
+            cursor = page[-1]
+        return results
+
+
+# 🗺 The query shapes, one per read path
+
+def events_between(user_id, start_time, end_time, name="events_between", fields=EVENT_FIELDS):
+    # Index: events (userId, start)
+    return RangeQuery(name, "events", "start", start_time, end_time,
+                      equals={"userId": user_id}, fields=fields)
+
+
+def tasks_between(collection, user_id, start_time, end_time, name="tasks_between", fields=TASK_FIELDS):
+    # Index: tasks_* (userId, DueDate)
+    return RangeQuery(name, collection, "DueDate", start_time, end_time,
+                      equals={"userId": user_id}, fields=fields)
+
+
+def due_reminders(collection, now):
+    # Index: events and tasks_* (reminderSent, reminderTime)
+    return RangeQuery("due_reminders", collection, "reminderTime", high=now,
+                      equals={"reminderSent": False}, fields=REMINDER_FIELDS)
+
+
+def reminder_window(collection, after, until):
+    """Unsent reminders due in (after, until]; `after` may be None for everything up to `until`."""
+    return RangeQuery("reminder_window", collection, "reminderTime", low=after, high=until,
+                      equals={"reminderSent": False}, fields=REMINDER_FIELDS, low_inclusive=False)
@@ -0,0 +1,221 @@
+"""🔁 Recurring events and tasks: one Firestore document per series.
+
+A series lives in the same collection as single items, with these fields instead of
+`start`/`DueDate` (so the range queries for single items never see it):
+
+    rrule                  "FREQ=WEEKLY;BYDAY=MO,WE" — an RFC 5545 RRULE, COUNT/UNTIL optional
+    dtstart                the first occurrence
+    timezone               IANA name the rule repeats in (wall-clock times survive DST); default DEFAULT_TIMEZONE
+    exdates                optional list of cancelled occurrences
+    reminderTime           the next reminder to send, like a single item's
+    reminderOffsetMinutes  how long before each occurrence to remind; worked out from the
+                           first reminderTime when missing
+
+Occurrences are never stored. The event/task lookups read a user's series with one
+query per collection and expand them lazily, only inside the range asked for,
+merged in time order with the single items. A series whose fields don't check out
+(see check_series) is logged and skipped rather than failing the read, and no series
+yields more than SERIES_MAX_OCCURRENCES occurrences per range. After a series' reminder is sent the
+reminder engine moves its reminderTime on to the next occurrence instead of marking
+it sent, so reminder sweeps cost one read per series rather than per occurrence.
+"""
+import heapq
+import logging
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pytz
+from dateutil.rrule import rrulestr
+
+from metrics import stream_query, astream_query
+from queries import field_filter
+from temporal import get_timezone
+
+logger = logging.getLogger(__name__)
+
+# Collection -> the field single items keep their time in, and occurrences get theirs in
+TIME_FIELDS = {"events": "start"}
+DEFAULT_TIME_FIELD = "DueDate"  # every tasks_* collection
+SERIES_FIELDS = ("rrule", "dtstart", "timezone", "exdates", "reminderOffsetMinutes")
+# Far enough out for "every occurrence from now on", still a valid Firestore timestamp in any timezone
+FOREVER = datetime(9999, 1, 1, tzinfo=pytz.utc)
+# A FREQ=SECONDLY or MINUTELY rule could otherwise fill a week's window with millions
+MAX_OCCURRENCES = int(os.environ.get("SERIES_MAX_OCCURRENCES", 1000))
+
+
+def time_field(collection):
+    return TIME_FIELDS.get(collection, DEFAULT_TIME_FIELD)
+
+
+def is_series(data):
+    return bool(data and data.get("rrule"))
+
+
+class Occurrence:
+    """One occurrence of a series, shaped like the document snapshots it's merged with."""
+
+    __slots__ = ("series", "field", "moment", "reference", "duration")
+
+    def __init__(self, series, field, moment, reference=None, duration=None):
+        self.series = series  # the series document's fields
+        self.field = field
+        self.moment = moment
+        self.reference = reference  # the series document
+        self.duration = duration  # how long each occurrence of an event series lasts, if it has an end
+
+    @property
+    def id(self):
+        return f"{self.reference.id if self.reference else 'series'}@{self.moment.isoformat()}"
+
+    def to_dict(self):
+        data = {key: value for key, value in self.series.items() if key not in SERIES_FIELDS}
+        data[self.field] = self.moment
+        if self.duration is not None:
+            data["end"] = self.moment + self.duration
+        data["seriesId"] = self.reference.id if self.reference else None
+        return data
+
+    def get(self, field):
+        if field == self.field:
+            return self.moment
+        return self.series[field]
+
+
+@lru_cache(maxsize=1024)
+def _rule(text, local_start):
+    # The rule runs on naive wall-clock times, so a UTC UNTIL is read as wall-clock too
+    return rrulestr(text, dtstart=local_start, ignoretz=True)
+
+
+def _is_timestamp(value):
+    return isinstance(value, datetime) and value.tzinfo is not None
+
+
+def check_series(series):
+    """Raises ValueError naming the first field a series can't be expanded with."""
+    if not isinstance(series.get("rrule"), str):
+        raise ValueError("rrule must be a string")
+    if not _is_timestamp(series.get("dtstart")):
+        raise ValueError("dtstart must be a timestamp")
+    for field in ("end", "reminderTime"):
+        if series.get(field) is not None and not _is_timestamp(series[field]):
+            raise ValueError(f"{field} must be a timestamp")
+    exdates = series.get("exdates")
+    if exdates is not None and not (isinstance(exdates, list) and all(map(_is_timestamp, exdates))):
+        raise ValueError("exdates must be a list of timestamps")
+    offset = series.get("reminderOffsetMinutes")
+    if offset is not None and (isinstance(offset, bool) or not isinstance(offset, (int, float))):
+        raise ValueError("reminderOffsetMinutes must be a number")
+    timezone = series.get("timezone")
+    if timezone is not None:
+        try:
+            tz = pytz.timezone(timezone)
+        except (pytz.UnknownTimeZoneError, AttributeError, TypeError):
+            raise ValueError(f"Unknown timezone {timezone!r}") from None
+    else:
+        tz = get_timezone()
+    try:
+        _rule(series["rrule"], series["dtstart"].astimezone(tz).replace(tzinfo=None))
+    except Exception as e:  # dateutil raises ValueError, TypeError, KeyError... for a malformed rule
+        raise ValueError(f"Invalid rrule {series['rrule']!r}: {e}") from None
+
+
+def occurrence_times(series, low, high):
+    """Yields a series' occurrences in [low, high] as UTC datetimes, in order, computing only those."""
+    tz = get_timezone(series.get("timezone"))
+    dtstart = series["dtstart"]
+    if high < dtstart:
+        return
+    # Expand in the series' own wall-clock time, naive, so "every Monday 9:00" stays 9:00 across DST
+    rule = _rule(series["rrule"], dtstart.astimezone(tz).replace(tzinfo=None))
+    skipped = {moment.astimezone(pytz.utc) for moment in series.get("exdates") or ()}
+    local_low = max(low, dtstart).astimezone(tz).replace(tzinfo=None)
+    local_high = high.astimezone(tz).replace(tzinfo=None)
+
+    for local in rule.xafter(local_low, inc=True):
+        if local > local_high:
+            return
+        moment = tz.localize(local).astimezone(pytz.utc)
+        if moment not in skipped and low <= moment <= high:
+            yield moment
+
+
+def expand(snapshot, field, low, high, limit=MAX_OCCURRENCES):
+    """Yields the Occurrences of a series document between low and high, at most `limit` of them.
+
+    A series that can't be expanded is logged and yields nothing, so one bad document
+    never fails a lookup (or an agenda rebuild) that reads it along with others.
+    """
+    series = snapshot.to_dict()
+    try:
+        check_series(series)
+        # An event series' `end` belongs to its first occurrence; every occurrence lasts as long
+        duration = series["end"] - series["dtstart"] if series.get("end") and field == "start" else None
+        for count, moment in enumerate(occurrence_times(series, low, high)):
+            if count == limit:
+                logger.warning("⚠ Series %s has more than %d occurrences in range, the rest are left out",
+                               snapshot.reference.path, limit)
+                return
+            yield Occurrence(series, field, moment, snapshot.reference, duration)
+    except Exception as e:
+        logger.warning("⚠ Skipping series %s: %s", snapshot.reference.path, e)
+
+
+def series_query(db, collection, user_id):
+    # Index: events and tasks_* (userId, rrule)
+    return db.collection(collection) \
+        .where(filter=field_filter("userId", "==", user_id)) \
+        .where(filter=field_filter("rrule", "!=", None))
+
+
+def user_series(db, collection, user_id):
+    """A user's series documents in one collection — one query however many occurrences they have."""
+    return stream_query(series_query(db, collection, user_id), collection, "series")
+
+
+async def auser_series(adb, collection, user_id):
+    return await astream_query(series_query(adb, collection, user_id), collection, "series")
+
+
+def with_occurrences(singles, series, field, low, high):
+    """Merges time-ordered single snapshots with the occurrences of `series` in [low, high],
+    lazily: nothing past what the caller consumes is expanded (or read, for a stream)."""
+    expansions = [expand(snapshot, field, low, high) for snapshot in series]
+    if not expansions:
+        return iter(singles)
+    return heapq.merge(singles, *expansions, key=lambda item: item.get(field))
+
+
+# ⏰ Reminders
+
+def reminder_offset(series):
+    """How long before each occurrence the series reminds, or None if it doesn't."""
+    if series.get("reminderOffsetMinutes") is not None:
+        return timedelta(minutes=series["reminderOffsetMinutes"])
+    if series.get("reminderTime") is None:
+        return None
+    # Until the first reminder goes out, reminderTime belongs to the first occurrence
+    return series["dtstart"] - series["reminderTime"]
+
+
+def next_reminder(series, now):
+    """Fields that move a series' reminder on to its next occurrence still ahead of `now`,
+    or that mark it sent once the series has no occurrences left."""
+    try:
+        check_series(series)
+    except ValueError as e:
+        # It can't be expanded to find the next one, so stop reminding instead of failing every sweep
+        return {"reminderSent": True, "reminderError": str(e)}
+    offset = reminder_offset(series)
+    if offset is None:
+        return {"reminderSent": True}
+
+    current = series["reminderTime"] + offset  # the occurrence just reminded about
+    # Skip occurrences whose reminder time has already passed (e.g. after an outage)
+    after = max(current + timedelta(microseconds=1), now + offset)
+    upcoming = next(occurrence_times(series, after, FOREVER), None)
+    if upcoming is None:
+        return {"reminderSent": True}
+    return {"reminderTime": upcoming - offset, "reminderOffsetMinutes": offset.total_seconds() / 60,
+            "reminderLeaseUntil": None}
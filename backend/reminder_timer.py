@@ -0,0 +1,202 @@
+import contextvars
+import heapq
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+
+from log_config import new_request_id
+from metrics import JOBS
+from queries import REMINDER_FIELDS, RangeQuery, reminder_window
+from reminders import check_and_send_reminders, reminder_item, dispatch_reminders
+from task_store import TASK_COLLECTIONS
+
+logger = logging.getLogger(__name__)
+
+REMINDER_COLLECTIONS = ["events"] + list(TASK_COLLECTIONS)
+
+_pool = ThreadPoolExecutor(max_workers=len(REMINDER_COLLECTIONS), thread_name_prefix="reminder-timer")
+
+
+def reminder_watch(collection, until):
+    """Every unsent reminder due up to `until`, for a snapshot listener (listeners don't take projections)."""
+    # Index: events and tasks_* (reminderSent, reminderTime)
+    return RangeQuery("reminder_watch", collection, "reminderTime", high=until, equals={"reminderSent": False})
+
+
+class ReminderTimer:
+    """Fires reminders at their exact reminderTime from an in-memory min-heap.
+
+    With `listen` (the default), each collection has a snapshot listener on the
+    unsent reminders due up to the watermark, `horizon_seconds` ahead. Firestore
+    pushes every reminder created or moved into that range as it's written, so it
+    goes on the heap straight away. refresh() re-subscribes with a new watermark
+    once half the horizon has gone by, which reads the range once.
+
+    Without it, refresh() polls only the slice of time since the previous refresh
+    up to `horizon_seconds` ahead, so idle refreshes read nothing. Reminders created
+    or moved into a slice that was already loaded are then left to the catch-up sweep.
+    """
+
+    def __init__(self, db, horizon_seconds=600, listen=True):
+        self.db = db
+        self.horizon = timedelta(seconds=horizon_seconds)
+        self.listen = listen
+        self.watermark = None  # reminderTime up to which Firestore has been loaded (or is listened to)
+        self._heap = []  # (fire_at timestamp, path, collection)
+        self._scheduled = {}  # path -> fire_at, so stale heap entries can be skipped
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._watches = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reminder-timer", daemon=True)
+        self._thread.start()
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("⚠ Initial reminder load failed, will retry on the next refresh: %s", e)
+
+    def refresh(self):
+        with JOBS.time(job="reminder_refresh"):
+            self._refresh()
+
+    def _refresh(self):
+        if self.listen:
+            self._resubscribe()
+            return
+        now = datetime.now(pytz.utc)
+        low, high = self.watermark, now + self.horizon
+
+        def load(collection):
+            return [(collection, snapshot) for snapshot in reminder_window(collection, low, high).stream(self.db)]
+
+        futures = [_pool.submit(contextvars.copy_context().run, load, collection) for collection in REMINDER_COLLECTIONS]
+        loaded = [item for future in futures for item in future.result()]
+        for collection, snapshot in loaded:
+            self.schedule(collection, snapshot.reference.path, snapshot.to_dict()["reminderTime"])
+
+        self.watermark = high
+        if loaded:
+            logger.info("⏲ Loaded %d reminders due before %s", len(loaded), high)
+
+    def _resubscribe(self):
+        now = datetime.now(pytz.utc)
+        if self.watermark is not None and self.watermark - now > self.horizon / 2:
+            return
+        high = now + self.horizon
+        # The new listeners are up before the old ones stop, so nothing written in between is missed
+        watches = [reminder_watch(collection, high).build(self.db).on_snapshot(self._on_change(collection))
+                   for collection in REMINDER_COLLECTIONS]
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches, self.watermark = watches, high
+        logger.info("⏲ Listening for reminders due before %s", high)
+
+    def _on_change(self, collection):
+        def on_change(snapshots, changes, read_time):
+            # The first callback has every reminder in range as ADDED; then each write as it happens
+            now = datetime.now(pytz.utc)
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    continue  # a stale heap entry is skipped when it fires, after a re-read
+                data = change.document.to_dict()
+                if data.get("reminderTime") is None:
+                    continue
+                if change.type.name == "MODIFIED" and data["reminderTime"] <= now:
+                    # Claims and released leases modify overdue reminders too: firing on those would
+                    # retry a failing send in a tight loop, so retries stay with the sweep
+                    continue
+                self.schedule(collection, change.document.reference.path, data["reminderTime"])
+        return on_change
+
+    def stop(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+    def schedule(self, collection, path, reminder_time):
+        fire_at = reminder_time.timestamp()
+        with self._wakeup:
+            if self._scheduled.get(path) == fire_at:
+                return
+            self._scheduled[path] = fire_at
+            heapq.heappush(self._heap, (fire_at, path, collection))
+            self._wakeup.notify()
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._heap or self._heap[0][0] > datetime.now(pytz.utc).timestamp():
+                    timeout = self._heap[0][0] - datetime.now(pytz.utc).timestamp() if self._heap else None
+                    self._wakeup.wait(timeout)
+
+                # Everything due within the same instant goes out as one batch
+                now_ts = datetime.now(pytz.utc).timestamp()
+                ready = []
+                while self._heap and self._heap[0][0] <= now_ts:
+                    fire_at, path, collection = heapq.heappop(self._heap)
+                    if self._scheduled.get(path) == fire_at:
+                        del self._scheduled[path]
+                        ready.append((path, collection))
+
+            if ready:
+                try:
+                    self._fire(ready)
+                except Exception as e:
+                    logger.exception("❌ Error firing reminders: %s", e)
+
+    def _fire(self, ready):
+        # Re-read in one round-trip: the reminder may have been sent, edited or deleted
+        new_request_id(f"reminder-timer-{uuid.uuid4().hex[:8]}")
+        with JOBS.time(job="reminder_timer"):
+            self._fire_batch(ready)
+
+    def _fire_batch(self, ready):
+        references = [self.db.document(path) for path, _ in ready]
+        collections = {path: collection for path, collection in ready}
+        now = datetime.now(pytz.utc)
+        due = []
+
+        for snapshot in self.db.get_all(references, field_paths=list(REMINDER_FIELDS)):
+            data = snapshot.to_dict() if snapshot.exists else None
+            if not data or data.get("reminderSent"):
+                continue
+            collection = collections[snapshot.reference.path]
+            if data["reminderTime"] > now:
+                if data["reminderTime"] <= now + self.horizon:
+                    self.schedule(collection, snapshot.reference.path, data["reminderTime"])
+                continue
+            due.append(reminder_item(collection, snapshot))
+
+        dispatch_reminders(self.db, due, now)
+
+
+def schedule_reminder_jobs(scheduler, db):
+    """Adds the reminder jobs to an APScheduler scheduler.
+
+    REMINDER_MODE=timer (default) fires reminders from the in-memory timer, fed by
+    snapshot listeners unless REMINDER_TIMER_LISTEN=false, and keeps a catch-up sweep
+    for anything it misses (e.g. while a listener reconnects); REMINDER_MODE=sweep only
+    polls every 60 seconds.
+    """
+    if os.environ.get("REMINDER_MODE", "timer") == "sweep":
+        scheduler.add_job(func=lambda: check_and_send_reminders(db), trigger="interval", seconds=60,
+                          id="reminder_sweep")
+        return None
+
+    timer = ReminderTimer(db, horizon_seconds=int(os.environ.get("REMINDER_HORIZON_SECONDS", 600)),
+                          listen=os.environ.get("REMINDER_TIMER_LISTEN", "true").lower() == "true")
+    timer.start()
+    scheduler.add_job(func=timer.refresh, trigger="interval",
+                      seconds=int(os.environ.get("REMINDER_REFRESH_SECONDS", 60)), id="reminder_refresh")
+    scheduler.add_job(func=lambda: check_and_send_reminders(db), trigger="interval",
+                      seconds=int(os.environ.get("REMINDER_SWEEP_SECONDS", 60)), id="reminder_sweep")
+    return timer
@@ -0,0 +1,24 @@
+"""Runs reminders, scheduled notifications and the daily agendas as their own process: `python reminder_worker.py`.
+
+This is the designated scheduler process: web workers started alongside it should set
+RUN_REMINDER_SCHEDULER=false. Running more than one copy is safe, since reminders and
+jobs are claimed before they are sent. Scheduled notifications are shared with the web
+app through Firestore (NOTIFICATION_JOB_STORE, default firestore).
+"""
+import logging
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+import metrics
+from app import add_background_jobs
+from log_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+if __name__ == '__main__':
+    setup_logging()
+    metrics.setup_tracing()
+    scheduler = BlockingScheduler()
+    add_background_jobs(scheduler)
+    logger.info("⏰ Reminder worker started")
+    scheduler.start()
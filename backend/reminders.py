@@ -0,0 +1,150 @@
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+from google.api_core import exceptions as api_exceptions
+
+from device_tokens import registry
+from notifications import send_fcm_batch, is_permanent_failure, commit_updates
+from log_config import new_request_id
+from metrics import JOBS, REMINDERS
+from queries import due_reminders
+from recurrence import is_series, next_reminder
+from task_store import query_due_task_reminders
+
+logger = logging.getLogger(__name__)
+
+# 🔒 Every sweeping process claims a reminder before sending it, so it goes out exactly once
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_SECONDS = int(os.environ.get("REMINDER_LEASE_SECONDS", 120))
+
+_claim_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("REMINDER_CLAIM_POOL_SIZE", 16)),
+                                 thread_name_prefix="reminder-claims")
+
+
+def check_and_send_reminders(db):
+    new_request_id(f"reminder-sweep-{uuid.uuid4().hex[:8]}")
+    with JOBS.time(job="reminder_sweep"):
+        _check_and_send_reminders(db)
+
+
+def _check_and_send_reminders(db):
+    now = datetime.now(pytz.utc)
+    logger.debug("🔍 Checking reminders at %s", now)
+
+    due = []  # (snapshot, token, title, body, label)
+
+    # First: Check EVENTS
+    for event in due_reminders('events', now).stream(db):
+        due.append(reminder_item('events', event))
+
+    # Second: Check TASKS (all 4 collections, queried together)
+    for collection_name, task in query_due_task_reminders(db, now):
+        due.append(reminder_item(collection_name, task))
+
+    dispatch_reminders(db, due, now)
+
+
+def reminder_item(collection_name, snapshot):
+    """Builds the (snapshot, token, title, body, label) tuple dispatch_reminders sends."""
+    data = snapshot.to_dict()
+    if collection_name == 'events':
+        title = "⏰ Reminder: " + data.get('title', 'No Title')
+        body = "Your event is starting soon!"
+        return snapshot, data.get('token'), title, body, f"event: {data.get('title')}"
+
+    title = "📝 Task Reminder: " + data.get('title', 'No Title')
+    body = "Don't forget your task: " + data.get('title', 'No Title')
+    return snapshot, data.get('token'), title, body, f"task: {data.get('title')} from {collection_name}"
+
+
+def dispatch_reminders(db, due, now):
+    """Claims, sends and flags a list of reminder_item tuples.
+
+    Each reminder goes to the token on its document and every other device its user
+    registered (see device_tokens).
+    """
+    devices = registry.resolve(db, [((snapshot.to_dict() or {}).get('userId'), token)
+                                    for snapshot, token, _, _, _ in due])
+    sendable, updates = [], []
+    for item, tokens in zip(due, devices):
+        if tokens:
+            sendable.append((item, tokens))
+        elif item[1]:
+            # Its only token was rejected for good on an earlier send, so don't pay for another
+            logger.warning("❌ Dropping reminder for %s, its token was already rejected", item[4])
+            updates.append((item[0].reference, {'reminderSent': True, 'reminderError': "Token rejected earlier"}))
+            REMINDERS.inc(outcome="dropped")
+        else:
+            logger.warning("⚠ No FCM token available for %s", item[4])
+            REMINDERS.inc(outcome="no_token")
+
+    # Claim them first — anything another worker already holds is skipped
+    claimed = list(_claim_pool.map(lambda entry: claim_reminder(db, entry[0][0], now), sendable))
+    if not all(claimed):
+        REMINDERS.inc(len(claimed) - sum(claimed), outcome="claimed_elsewhere")
+    sendable = [entry for entry, ok in zip(sendable, claimed) if ok]
+
+    # Then send everything in FCM batches, and flag the sent ones in Firestore batches
+    errors = send_fcm_batch([(token, title, body) for (_, _, title, body, _), tokens in sendable for token in tokens])
+    dead = []
+    position = 0
+
+    for (snapshot, _, _, _, label), tokens in sendable:
+        results = errors[position:position + len(tokens)]
+        position += len(tokens)
+        dead += [token for token, error in zip(tokens, results) if error is not None and is_permanent_failure(error)]
+        failures = [error for error in results if error is not None]
+
+        if len(failures) < len(results):
+            # One device got it; retrying would repeat it on that one
+            logger.info("✅ Reminder sent for %s", label)
+            data = snapshot.to_dict()
+            # 🔁 A recurring series stays pending, with its reminder moved to the next occurrence
+            updates.append((snapshot.reference, next_reminder(data, now) if is_series(data) else {'reminderSent': True}))
+            REMINDERS.inc(outcome="sent")
+        elif all(is_permanent_failure(error) for error in failures):
+            # These tokens will never work, so don't retry them every sweep
+            logger.warning("❌ Dropping reminder for %s, token rejected: %s", label, failures[0])
+            updates.append((snapshot.reference, {'reminderSent': True, 'reminderError': str(failures[0])}))
+            REMINDERS.inc(outcome="dropped")
+        else:
+            # Release the lease so the next sweep (on any worker) can retry straight away
+            logger.warning("⚠ Reminder for %s failed, will retry next sweep: %s", label, failures[0])
+            updates.append((snapshot.reference, {'reminderLeaseUntil': None}))
+            REMINDERS.inc(outcome="retry")
+
+    try:
+        commit_updates(db, updates)
+    finally:
+        registry.prune(db, dead)  # dead tokens are dead whether or not the marks were written
+    if sendable:
+        logger.info("📨 Reminders: %d claimed by %s", len(sendable), WORKER_ID)
+
+
+def claim_reminder(db, snapshot, now):
+    """Takes a lease on a due reminder with a compare-and-set write.
+
+    The update only succeeds if the document is unchanged since we read it, so when
+    several workers race for the same reminder exactly one of them wins. A lease that
+    outlives a crashed worker expires after LEASE_SECONDS and can be claimed again.
+    """
+    lease_until = snapshot.to_dict().get('reminderLeaseUntil')
+    if lease_until and lease_until > now:
+        return False
+
+    try:
+        snapshot.reference.update(
+            {'reminderClaimedBy': WORKER_ID, 'reminderLeaseUntil': now + timedelta(seconds=LEASE_SECONDS)},
+            option=db.write_option(last_update_time=snapshot.update_time),
+        )
+        return True
+    except (api_exceptions.FailedPrecondition, api_exceptions.Aborted, api_exceptions.Conflict):
+        return False  # another worker got there first
+    except Exception as e:
+        logger.warning("⚠ Could not claim reminder %s: %s", snapshot.reference.path, e)
+        return False
@@ -0,0 +1,60 @@
+import contextvars
+import os
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from queries import MAX_CHAT_RESULTS, TASK_FIELDS, tasks_between, due_reminders
+from recurrence import user_series, with_occurrences
+
+# 📂 Task collections and the category label shown to users
+TASK_COLLECTIONS = {
+    "tasks_self": "Personal",
+    "tasks_team": "Team",
+    "tasks_family": "Family",
+    "tasks_self_work": "Work",
+}
+
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("TASK_QUERY_POOL_SIZE", 8)),
+                           thread_name_prefix="tasks")
+
+_FAR_FUTURE = datetime.max.replace(tzinfo=pytz.utc)
+
+
+def query_tasks(db, user_id, start_time, end_time, max_results=MAX_CHAT_RESULTS, fields=TASK_FIELDS):
+    """Returns (collection, snapshot) pairs for a user's tasks due between start_time and
+    end_time, queried from all task collections at once and merged by DueDate.
+
+    At most max_results come back (None for all of them); each collection is read in
+    DueDate order, so the earliest ones are kept. Recurring tasks come back as one
+    Occurrence per due date in the range. `fields` is the projection read from each one.
+    """
+    def fetch(name):
+        singles = tasks_between(name, user_id, start_time, end_time, fields=fields).stream(db, max_results)
+        tasks = with_occurrences(singles, user_series(db, name, user_id), "DueDate", start_time, end_time)
+        return list(islice(tasks, max_results))
+
+    results = _fan_out(fetch)
+    results.sort(key=lambda item: _due_date(item[1]))
+    return results if max_results is None else results[:max_results]
+
+
+def query_due_task_reminders(db, now):
+    """Returns (collection, snapshot) pairs for every task whose reminder is due and unsent."""
+    return _fan_out(lambda name: due_reminders(name, now).fetch(db))
+
+
+def _due_date(snapshot):
+    try:
+        return snapshot.get("DueDate") or _FAR_FUTURE
+    except KeyError:
+        return _FAR_FUTURE
+
+
+def _fan_out(fetch):
+    # copy_context() keeps each per-collection query span under the caller's span
+    futures = {name: _pool.submit(contextvars.copy_context().run, fetch, name)
+               for name in TASK_COLLECTIONS}
+    return [(name, snapshot) for name, future in futures.items() for snapshot in future.result()]
@@ -0,0 +1,152 @@
+"""🕰 Date, duration and timezone handling for the chat intents.
+
+Dialogflow's `date-time` parameter arrives as a string, a start/end dict, or a list
+of either; parse_date_time() turns any of them into one TimeRange, parsing each
+string once. Timestamp strings are parsed with datetime.fromisoformat() (falling
+back to dateutil for anything else) and memoized, since the same strings come back
+on every retry and "show more". Timezone objects are created once per name.
+
+Users get their own timezone from the `timeZone` field of the request payload;
+DEFAULT_TIMEZONE (Asia/Kolkata) covers everyone else.
+"""
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pytz
+from dateutil import parser
+
+DEFAULT_TIMEZONE = os.environ.get("DEFAULT_TIMEZONE", "Asia/Kolkata")
+WHEN_FORMAT = "%Y-%m-%d %I:%M %p %Z"
+
+# Every spelling of a @sys.duration unit we accept -> timedelta keyword
+DURATION_UNITS = {
+    "s": "seconds", "sec": "seconds", "second": "seconds", "seconds": "seconds",
+    "min": "minutes", "minute": "minutes", "minutes": "minutes",
+    "h": "hours", "hour": "hours", "hours": "hours",
+    "d": "days", "day": "days", "days": "days",
+    "wk": "weeks", "week": "weeks", "weeks": "weeks",
+}
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name=None):
+    """The tzinfo for an IANA name, created once; unknown names get DEFAULT_TIMEZONE."""
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(text):
+    """An ISO 8601 timestamp as an aware datetime (UTC when it has no offset)."""
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        parsed = parser.isoparse(text)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=pytz.utc)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """The calendar date a date or timestamp string names, in its own offset."""
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        return parser.parse(text).date()
+
+
+def utc_day_range(day):
+    """The [start, end] range the chat intents mean by "that day" (UTC midnight to midnight)."""
+    start = datetime.combine(day, datetime.min.time()).replace(tzinfo=pytz.utc)
+    return start, datetime.combine(day, datetime.max.time()).replace(tzinfo=pytz.utc)
+
+
+def today(tz=None):
+    return datetime.now(tz or get_timezone()).date()
+
+
+class TimeRange:
+    """A normalized `date-time` parameter: the UTC range to query, what kind of range
+    the user asked for ("time", "date" or "day"), and the ends as the user wrote them."""
+
+    __slots__ = ("start", "end", "kind", "local_start", "local_end")
+
+    def __init__(self, start, end, kind, local_start=None, local_end=None):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.local_start = local_start or start
+        self.local_end = local_end or end
+
+    @classmethod
+    def day(cls, day):
+        return cls(*utc_day_range(day), "day")
+
+    @property
+    def is_range(self):
+        return self.kind != "day"
+
+    def labels(self, tz):
+        """The two ends worded for a reply: clock times for a time range, dates otherwise."""
+        fmt = "%I:%M %p" if self.kind == "time" else "%d %b %Y"
+        return self.local_start.astimezone(tz).strftime(fmt), self.local_end.astimezone(tz).strftime(fmt)
+
+
+def parse_date_time(value):
+    """Normalizes a Dialogflow `date-time` value into a TimeRange, or None if there's none.
+
+    Raises ValueError when a string in it isn't a date.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+
+    if isinstance(value, dict):
+        if "startTime" in value and "endTime" in value:
+            kind, start, end = "time", value["startTime"], value["endTime"]
+        elif "startDate" in value and "endDate" in value:
+            kind, start, end = "date", value["startDate"], value["endDate"]
+        else:
+            return None
+        if not isinstance(start, str) or not isinstance(end, str):
+            raise ValueError(f"Not a {kind} range: {value!r}")
+        local_start, local_end = parse_datetime(start), parse_datetime(end)
+        return TimeRange(local_start.astimezone(pytz.utc), local_end.astimezone(pytz.utc), kind,
+                         local_start, local_end)
+
+    if isinstance(value, str) and value:
+        try:
+            return TimeRange.day(parse_date(value))
+        except (ValueError, OverflowError) as e:
+            raise ValueError(f"Not a date: {value!r}") from e
+    return None
+
+
+def extract_date(parameters, tz=None):
+    """The single date in a `date-time` parameter, or today in the user's timezone."""
+    try:
+        time_range = parse_date_time(parameters.get("date-time"))
+    except ValueError:
+        time_range = None
+    if time_range is None or time_range.kind != "day":
+        return today(tz)
+    return time_range.start.date()
+
+
+def duration_delta(duration):
+    """A @sys.duration value ({"amount": 2, "unit": "h"}) as a timedelta, or None for
+    a missing amount or a unit we don't handle."""
+    if not isinstance(duration, dict) or "amount" not in duration:
+        return None
+    unit = DURATION_UNITS.get(str(duration.get("unit", "")).lower())
+    if unit is None:
+        return None
+    try:
+        return timedelta(**{unit: duration["amount"]})
+    except (TypeError, OverflowError):
+        return None
+
+
+def format_when(moment, tz):
+    return moment.astimezone(tz).strftime(WHEN_FORMAT)
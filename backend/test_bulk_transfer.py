@@ -0,0 +1,167 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+import bulk_transfer
+from device_tokens import registry
+from recurrence import occurrence_times
+from temporal import get_timezone
+
+START = datetime(2030, 1, 7, 9, tzinfo=pytz.utc)  # a Monday
+
+MASTER = """BEGIN:VEVENT
+UID:standup-1
+DTSTART:20300107T090000Z
+DTEND:20300107T093000Z
+RRULE:FREQ=WEEKLY;COUNT=4
+SUMMARY:Standup
+END:VEVENT
+"""
+OVERRIDE = """BEGIN:VEVENT
+UID:standup-1
+RECURRENCE-ID:20300114T090000Z
+DTSTART:20300114T110000Z
+DTEND:20300114T113000Z
+SUMMARY:Standup (moved)
+END:VEVENT
+"""
+REMINDER = """BEGIN:VTODO
+UID:taxes
+DUE:20300401T170000Z
+SUMMARY:File taxes
+BEGIN:VALARM
+TRIGGER:-P1D
+END:VALARM
+END:VTODO
+"""
+
+
+def ics(*components):
+    return f"BEGIN:VCALENDAR\nVERSION:2.0\n{''.join(components)}END:VCALENDAR\n".splitlines(keepends=True)
+
+
+def run_import(db, user_id, *components):
+    return bulk_transfer.import_records(db, user_id, bulk_transfer.parse_records(ics(*components), "ics"))
+
+
+def user_events(db, user_id):
+    return {snapshot.id: snapshot.to_dict() for snapshot in db.collection("events").stream()
+            if snapshot.to_dict().get("userId") == user_id}
+
+
+@pytest.mark.parametrize("order", ["master_first", "override_first"])
+def test_override_is_kept_apart_from_its_series(booted, order):
+    db = booted[1]
+    user_id = f"ical-{order}"
+    components = (MASTER, OVERRIDE) if order == "master_first" else (OVERRIDE, MASTER)
+    progress = run_import(db, user_id, *components)
+    assert progress["written"] == 2 and progress["status"] == "done"
+
+    events = user_events(db, user_id)
+    assert len(events) == 2
+    series = next(data for data in events.values() if data.get("rrule"))
+    moved = next(data for data in events.values() if not data.get("rrule"))
+    assert series["title"] == "Standup" and moved["title"] == "Standup (moved)"
+    assert moved["start"] == START + timedelta(days=7, hours=2)
+    assert series["exdates"] == [START + timedelta(days=7)]
+    assert list(occurrence_times(series, START, START + timedelta(days=30))) == \
+        [START, START + timedelta(days=14), START + timedelta(days=21)]
+
+
+def test_reimporting_an_override_adds_its_exdate_once(booted):
+    db = booted[1]
+    run_import(db, "ical-again", MASTER, OVERRIDE)
+    run_import(db, "ical-again", OVERRIDE)
+    series = next(data for data in user_events(db, "ical-again").values() if data.get("rrule"))
+    assert series["exdates"] == [START + timedelta(days=7)]
+
+
+def task_reminder(db, user_id):
+    tasks = [snapshot.to_dict() for snapshot in db.collection("tasks_self").stream()
+             if snapshot.to_dict().get("userId") == user_id]
+    assert len(tasks) == 1
+    return tasks[0]
+
+
+def test_reminder_goes_to_a_registered_device(booted):
+    db = booted[1]
+    registry.register(db, "ical-device", "token-phone", platform="android")
+    run_import(db, "ical-device", REMINDER)
+    task = task_reminder(db, "ical-device")
+    assert task["token"] == "token-phone" and task["reminderSent"] is False
+
+
+def test_reminder_uses_the_token_on_existing_documents(booted):
+    db = booted[1]
+    db.collection("events").document("ical-legacy-1").set({
+        "userId": "ical-legacy", "title": "Old", "start": START, "token": "token-legacy"})
+    run_import(db, "ical-legacy", REMINDER)
+    assert task_reminder(db, "ical-legacy")["token"] == "token-legacy"
+
+
+def test_reminder_without_any_token_is_not_left_pending(booted):
+    db = booted[1]
+    run_import(db, "ical-no-device", REMINDER)
+    task = task_reminder(db, "ical-no-device")
+    assert "token" not in task
+    assert task["reminderSent"] is True and task["reminderError"] == "No device token"
+
+
+def test_import_id_is_known_before_the_upload(client, booted, signed_in_as):
+    headers = signed_in_as("ical-reserved")
+    reserved = client.post("/imports", json={"source": "cal.ics"}, headers=headers)
+    assert reserved.status_code == 201
+    import_id = reserved.get_json()["importId"]
+    assert booted[1].collection("imports").document(import_id).get().to_dict()["status"] == "pending"
+
+    response = client.post("/import?format=ics", data="".join(ics(REMINDER)),
+                           headers={**headers, "X-Import-Id": import_id})
+    assert response.status_code == 200
+    assert response.get_json()["importId"] == import_id
+    assert response.get_json()["status"] == "done"
+    assert client.get(f"/import/{import_id}", headers=headers).get_json()["status"] == "done"
+    assert client.get(f"/import/{import_id}", headers=signed_in_as("someone-else")).status_code == 404
+
+
+def test_import_and_export_need_the_users_own_id_token(client, signed_in_as):
+    body = "".join(ics(REMINDER))
+    assert client.post("/import?format=ics", data=body).status_code == 401
+    assert client.post("/import?format=ics&user_id=ical-victim", data=body,
+                       headers=signed_in_as("ical-attacker")).status_code == 403
+    assert client.get("/export").status_code == 401
+    assert client.get("/export?user_id=ical-victim", headers=signed_in_as("ical-attacker")).status_code == 403
+
+
+def test_export_is_the_signed_in_users(booted, client, signed_in_as):
+    run_import(booted[1], "ical-export", MASTER)
+    lines = client.get("/export", headers=signed_in_as("ical-export")).get_data(as_text=True).splitlines()
+    assert [json.loads(line)["title"] for line in lines] == ["Standup"]
+
+
+@pytest.mark.parametrize("fields", [
+    {"exdates": [5]},
+    {"exdates": "2030-01-14T09:00:00+00:00"},
+    {"end": 1700000000},
+    {"dtstart": ["2030-01-07"]},
+    {"timezone": "Mars/Olympus_Mons"},
+    {"rrule": "FREQ=FORTNIGHTLY"},
+    {"title": {"nested": True}},
+])
+def test_malformed_records_are_skipped_not_stored(booted, fields):
+    db = booted[1]
+    user_id = f"ndjson-{sorted(fields)[0]}-{len(str(fields))}"
+    record = {"collection": "events", "id": "series", "title": "Standup", "rrule": "FREQ=WEEKLY",
+              "dtstart": "2030-01-07T09:00:00+00:00", "timezone": "UTC", **fields}
+    progress = bulk_transfer.import_records(db, user_id, bulk_transfer.parse_records([json.dumps(record)], "ndjson"))
+    assert (progress["written"], progress["skipped"]) == (0, 1)
+    assert user_events(db, user_id) == {}
+
+
+def test_unknown_ical_tzid_falls_back_to_the_default_timezone(booted):
+    db = booted[1]
+    run_import(db, "ical-outlook", MASTER.replace("DTSTART:20300107T090000Z",
+                                                  "DTSTART;TZID=W. Europe Standard Time:20300107T090000"))
+    [series] = user_events(db, "ical-outlook").values()
+    assert series["timezone"] == get_timezone().zone
@@ -0,0 +1,54 @@
+from device_tokens import COLLECTION, DeviceRegistry, device_id
+
+
+def devices_of(db, user_id):
+    return sorted(snapshot.to_dict()["token"] for snapshot in db.collection(COLLECTION).stream()
+                  if snapshot.to_dict()["userId"] == user_id)
+
+
+def test_document_token_comes_first_then_registered_devices(booted):
+    db, registry = booted[1], DeviceRegistry()
+    registry.register(db, "tok-both", "token-tablet")
+    assert registry.resolve(db, [("tok-both", "token-phone"), ("tok-both", None)]) == \
+        [["token-phone", "token-tablet"], ["token-tablet"]]
+
+
+def test_document_tokens_are_adopted_for_users_without_devices(booted):
+    db, registry = booted[1], DeviceRegistry()
+    assert registry.resolve(db, [("tok-legacy", "token-legacy")]) == [["token-legacy"]]
+    assert devices_of(db, "tok-legacy") == ["token-legacy"]
+    # Once registered it's sent to from documents that have no token too
+    assert registry.resolve(db, [("tok-legacy", None)]) == [["token-legacy"]]
+
+
+def test_adoption_leaves_other_users_devices_alone(booted):
+    db, registry = booted[1], DeviceRegistry()
+    registry.register(db, "tok-new-owner", "token-handed-on")
+    registry.resolve(db, [("tok-old-owner", "token-handed-on")])
+    assert db.collection(COLLECTION).document(device_id("token-handed-on")).get().to_dict()["userId"] == "tok-new-owner"
+    assert devices_of(db, "tok-old-owner") == []
+
+
+def test_devices_are_registered_to_the_signed_in_user(booted, client, signed_in_as):
+    db = booted[1]
+    assert client.post("/devices", json={"token": "token-anon"}).status_code == 401
+    assert client.post("/devices", json={"user_id": "tok-victim", "token": "token-attacker"},
+                       headers=signed_in_as("tok-attacker")).status_code == 403
+    assert client.post("/devices", json={"token": "token-mine"}, headers=signed_in_as("tok-me")).status_code == 200
+    assert devices_of(db, "tok-me") == ["token-mine"] and devices_of(db, "tok-victim") == []
+
+    assert client.delete("/devices", json={"token": "token-mine"},
+                         headers=signed_in_as("tok-attacker")).status_code == 404
+    assert client.delete("/devices", json={"token": "token-mine"}, headers=signed_in_as("tok-me")).status_code == 200
+    assert devices_of(db, "tok-me") == []
+
+
+def test_a_refreshed_token_replaces_only_the_same_users_device(booted):
+    db, registry = booted[1], DeviceRegistry()
+    registry.register(db, "tok-refresher", "token-old")
+    registry.register(db, "tok-bystander", "token-theirs")
+
+    registry.register(db, "tok-refresher", "token-new", replaces="token-old")
+    registry.register(db, "tok-refresher", "token-newer", replaces="token-theirs")
+    assert devices_of(db, "tok-refresher") == ["token-new", "token-newer"]
+    assert devices_of(db, "tok-bystander") == ["token-theirs"]
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+NOON = datetime.now(pytz.utc).replace(hour=12, minute=0, second=0, microsecond=0) + timedelta(days=1)
+MORNING = NOON - timedelta(hours=3)
+
+
+@pytest.fixture(params=["cached", "live"])
+def busy_index(request, booted, monkeypatch):
+    """app.busy_index through the agenda cache's window, and with the cache turned off."""
+    app = booted[0]
+    if request.param == "live":
+        monkeypatch.setattr(app.agenda_cache, "max_users", 0)
+    return app.busy_index
+
+
+def seed(db, user_id):
+    db.collection("events").document(f"{user_id}-long").set({
+        "userId": user_id, "title": "Workshop", "start": MORNING, "end": NOON, "location": "Room 4"})
+    db.collection("tasks_self").document(f"{user_id}-done").set({
+        "userId": user_id, "title": "Done already", "DueDate": NOON + timedelta(hours=2), "completed": True})
+    db.collection("tasks_self").document(f"{user_id}-open").set({
+        "userId": user_id, "title": "Still open", "DueDate": NOON + timedelta(hours=4), "completed": False})
+
+
+def test_long_event_blocks_its_whole_span(booted, busy_index, request):
+    user_id = f"busy-{request.node.callspec.id}"
+    seed(booted[1], user_id)
+    index = busy_index(user_id, MORNING - timedelta(hours=12), NOON + timedelta(hours=6))
+    for hour in range(3):
+        start = MORNING + timedelta(hours=hour)
+        assert not index.is_free(start, start + timedelta(hours=1))
+    assert index.is_free(NOON, NOON + timedelta(hours=1))
+
+
+def test_completed_task_does_not_block(booted, busy_index, request):
+    user_id = f"tasks-{request.node.callspec.id}"
+    seed(booted[1], user_id)
+    index = busy_index(user_id, MORNING - timedelta(hours=12), NOON + timedelta(hours=6))
+    done = NOON + timedelta(hours=2)
+    assert index.is_free(done - timedelta(hours=1), done)
+    assert [busy.title for busy in index.conflicts(NOON, NOON + timedelta(hours=6))] == ["Still open"]
+
+
+def test_free_slots_answers_for_the_signed_in_user(booted, client, signed_in_as):
+    seed(booted[1], "route-user")
+    query = {"start": MORNING.isoformat(), "end": NOON.isoformat()}
+    response = client.get("/free_slots", query_string=query, headers=signed_in_as("route-user"))
+    assert response.status_code == 200
+    assert [busy["title"] for busy in response.get_json()["busy"]] == ["Workshop"]
+
+
+def test_free_slots_needs_a_valid_id_token(client, signed_in_as):
+    query = {"start": MORNING.isoformat(), "end": NOON.isoformat(), "user_id": "route-user"}
+    assert client.get("/free_slots", query_string=query).status_code == 401
+    assert client.get("/free_slots", query_string=query,
+                      headers={"Authorization": "Bearer forged"}).status_code == 401
+    assert client.get("/free_slots", query_string=query, headers=signed_in_as("someone-else")).status_code == 403
+
+
+def test_team_free_slots_only_for_teammates(booted, client, signed_in_as):
+    booted[1].collection("teams").document("team-ab").set({"name": "Ops", "members": ["team-a", "team-b"]})
+    booted[1].collection("teams").document("team-bv").set({"name": "Other", "members": ["team-b", "team-victim"]})
+    body = {"user_ids": ["team-a", "team-b"], "start": MORNING.isoformat(), "end": NOON.isoformat()}
+    assert client.post("/free_slots/team", json=body, headers=signed_in_as("outsider")).status_code == 403
+    response = client.post("/free_slots/team", json=body, headers=signed_in_as("team-a"))
+    assert response.status_code == 200 and response.get_json()["members"] == 2
+
+    # Listing yourself next to someone you share no team with doesn't reveal their schedule
+    probe = {**body, "user_ids": ["team-a", "team-victim"]}
+    assert client.post("/free_slots/team", json=probe, headers=signed_in_as("team-a")).status_code == 403
+
+
+@pytest.mark.parametrize("bad", [
+    {"start": 1700000000},
+    {"start": ["2030-01-01"]},
+    {"duration_minutes": None},
+    {"duration_minutes": "inf"},
+    {"duration_minutes": "nan"},
+    {"duration_minutes": [30]},
+    {"duration_minutes": 10 ** 9},
+])
+def test_bad_free_slot_requests_are_400s(client, signed_in_as, bad):
+    body = {"start": MORNING.isoformat(), "end": NOON.isoformat(), **bad}
+    team = client.post("/free_slots/team", json={"user_ids": ["bad-input"], **body}, headers=signed_in_as("bad-input"))
+    assert team.status_code == 400
+    if all(isinstance(value, str) for value in bad.values()):
+        single = client.get("/free_slots", query_string=body, headers=signed_in_as("bad-input"))
+        assert single.status_code == 400
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from notification_jobs import FirestoreJobStore, SQLiteJobStore
+
+SEND_AT = datetime(2030, 1, 1, 9, tzinfo=pytz.utc)
+
+
+def test_jobs_are_only_visible_to_their_owner(client, signed_in_as):
+    job = {"token": "fcm-owner", "title": "Standup", "body": "In 5", "send_time": SEND_AT.isoformat()}
+    assert client.post("/schedule_notification", json=job).status_code == 401
+    reply = client.post("/schedule_notification", json=job, headers=signed_in_as("nj-owner"))
+    job_id = reply.get_json()["job_id"]
+
+    assert client.get(f"/schedule_notification/{job_id}").status_code == 401
+    assert client.get(f"/schedule_notification/{job_id}", headers=signed_in_as("nj-other")).status_code == 404
+    assert client.patch(f"/schedule_notification/{job_id}", json={"send_time": SEND_AT.isoformat()},
+                        headers=signed_in_as("nj-other")).status_code == 404
+    assert client.delete(f"/schedule_notification/{job_id}", headers=signed_in_as("nj-other")).status_code == 404
+
+    seen = client.get(f"/schedule_notification/{job_id}", headers=signed_in_as("nj-owner")).get_json()
+    assert seen["status"] == "pending" and "token" not in seen and "owner" not in seen
+    assert client.delete(f"/schedule_notification/{job_id}", headers=signed_in_as("nj-owner")).status_code == 200
+
+
+def test_bulk_scheduling_is_capped(booted, client, signed_in_as, monkeypatch):
+    monkeypatch.setattr(booted[0], "NOTIFICATION_BULK_MAX", 2)
+    job = {"token": "fcm-bulk", "title": "Hi", "body": "There", "send_time": SEND_AT.isoformat()}
+    assert client.post("/schedule_notifications/bulk", json={"notifications": [job] * 3},
+                       headers=signed_in_as("nj-bulk")).status_code == 413
+    assert client.post("/schedule_notifications/bulk", json={"notifications": [job] * 2},
+                       headers=signed_in_as("nj-bulk")).status_code == 200
+
+
+def check_idempotency_keys_are_per_owner(store):
+    (mine, created), = store.add_many([("nj-a", "fcm-a", "T", "B", SEND_AT, "same-key")])
+    (theirs, also_created), = store.add_many([("nj-b", "fcm-b", "T", "B", SEND_AT, "same-key")])
+    (again, created_again), = store.add_many([("nj-a", "fcm-a", "T", "B", SEND_AT, "same-key")])
+    assert created and also_created and not created_again
+    assert mine["job_id"] != theirs["job_id"] and again["job_id"] == mine["job_id"]
+    assert again["idempotency_key"] == "same-key"
+
+    assert store.get(mine["job_id"], "nj-b") is None
+    assert not store.cancel(mine["job_id"], "nj-b")
+    assert not store.reschedule(mine["job_id"], "nj-b", SEND_AT + timedelta(hours=1))
+    assert store.reschedule(mine["job_id"], "nj-a", SEND_AT + timedelta(hours=1))
+    assert store.get(mine["job_id"], "nj-a")["owner"] == "nj-a"
+
+
+def test_sqlite_idempotency_keys_are_per_owner(tmp_path):
+    check_idempotency_keys_are_per_owner(SQLiteJobStore(str(tmp_path / "jobs.sqlite3")))
+
+
+def test_firestore_idempotency_keys_are_per_owner(booted):
+    check_idempotency_keys_are_per_owner(FirestoreJobStore(booted[1], "nj_scheduled_notifications"))
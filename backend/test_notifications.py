@@ -0,0 +1,13 @@
+from notifications import commit_updates
+
+
+def test_a_deleted_document_fails_only_its_own_update(booted):
+    db = booted[1]
+    references = [db.collection("events").document(f"cu-{i}") for i in range(3)]
+    for reference in references:
+        reference.set({"userId": "cu-user", "reminderSent": False})
+    references[1].delete()
+
+    assert commit_updates(db, [(reference, {"reminderSent": True}) for reference in references]) == 1
+    assert [reference.get().to_dict() and reference.get().get("reminderSent") for reference in references] == \
+        [True, None, True]
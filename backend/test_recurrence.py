@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from recurrence import MAX_OCCURRENCES, check_series, expand, next_reminder
+
+START = datetime(2030, 3, 4, 9, tzinfo=pytz.utc)
+GOOD = {"userId": "series-user", "title": "Gym", "rrule": "FREQ=DAILY", "dtstart": START,
+        "end": START + timedelta(hours=1)}
+BAD = {
+    "exdates_not_timestamps": {"exdates": [5]},
+    "end_not_timestamp": {"end": "tomorrow"},
+    "dtstart_not_timestamp": {"dtstart": "2030-03-04"},
+    "unknown_timezone": {"timezone": "Mars/Olympus_Mons"},
+    "unparseable_rrule": {"rrule": "FREQ=FORTNIGHTLY"},
+}
+
+
+def stored(db, doc_id, fields):
+    reference = db.collection("events").document(doc_id)
+    reference.set(fields)
+    return reference.get()
+
+
+@pytest.mark.parametrize("problem", BAD)
+def test_bad_series_is_skipped(booted, problem):
+    series = stored(booted[1], f"bad-{problem}", {**GOOD, **BAD[problem]})
+    with pytest.raises(ValueError):
+        check_series(series.to_dict())
+    assert list(expand(series, "start", START, START + timedelta(days=2))) == []
+    assert next_reminder({**series.to_dict(), "reminderTime": START}, START)["reminderSent"] is True
+
+
+def test_bad_series_doesnt_break_the_users_other_items(booted):
+    app, db = booted[0], booted[1]
+    db.collection("events").document("mixed-good").set({**GOOD, "userId": "mixed"})
+    db.collection("events").document("mixed-bad").set({**GOOD, "userId": "mixed", "exdates": ["nope"], "title": "Bad"})
+    events = app.find_events("mixed", START, START + timedelta(days=1, hours=1), limit=None)
+    assert [(event["title"], event["end"] - event["start"]) for event in events] == [("Gym", timedelta(hours=1))] * 2
+
+
+def test_occurrences_are_capped_per_series(booted):
+    series = stored(booted[1], "secondly", {**GOOD, "rrule": "FREQ=SECONDLY"})
+    assert len(list(expand(series, "start", START, START + timedelta(days=7)))) == MAX_OCCURRENCES
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytz
+
+import reminder_timer
+from reminder_timer import REMINDER_COLLECTIONS, ReminderTimer
+
+
+class Watches:
+    """Stands in for Firestore snapshot listeners: keeps each one's callback and query."""
+
+    def __init__(self, monkeypatch):
+        self.active = []
+        monkeypatch.setattr(reminder_timer, "reminder_watch", self.watch)
+
+    def watch(self, collection, until):
+        watches = self
+
+        class Query:
+            def build(self, db):
+                return self
+
+            def on_snapshot(self, callback):
+                watch = SimpleNamespace(collection=collection, until=until, callback=callback)
+                watch.unsubscribe = lambda: watches.active.remove(watch)
+                watches.active.append(watch)
+                return watch
+
+        return Query()
+
+    def push(self, collection, change, path, fields):
+        document = SimpleNamespace(reference=SimpleNamespace(path=path), to_dict=lambda: fields)
+        for watch in self.active:
+            if watch.collection == collection:
+                watch.callback([], [SimpleNamespace(type=SimpleNamespace(name=change), document=document)], None)
+
+
+def test_reminder_moved_into_the_loaded_range_is_scheduled_at_once(monkeypatch):
+    watches = Watches(monkeypatch)
+    timer = ReminderTimer(db=None, horizon_seconds=600)
+    timer.refresh()
+    assert len(watches.active) == len(REMINDER_COLLECTIONS)
+
+    soon = datetime.now(pytz.utc) + timedelta(minutes=2)
+    watches.push("events", "ADDED", "events/new", {"reminderTime": soon})
+    watches.push("tasks_self", "MODIFIED", "tasks_self/moved", {"reminderTime": soon + timedelta(seconds=30)})
+    assert timer._scheduled == {"events/new": soon.timestamp(),
+                                "tasks_self/moved": (soon + timedelta(seconds=30)).timestamp()}
+
+
+def test_overdue_modifications_are_left_to_the_sweep(monkeypatch):
+    watches = Watches(monkeypatch)
+    timer = ReminderTimer(db=None, horizon_seconds=600)
+    timer.refresh()
+    past = datetime.now(pytz.utc) - timedelta(minutes=1)
+    watches.push("events", "MODIFIED", "events/released", {"reminderTime": past, "reminderLeaseUntil": None})
+    assert len(timer) == 0
+    watches.push("events", "ADDED", "events/overdue", {"reminderTime": past})
+    assert len(timer) == 1
+
+
+def test_listeners_move_on_after_half_the_horizon(monkeypatch):
+    watches = Watches(monkeypatch)
+    timer = ReminderTimer(db=None, horizon_seconds=600)
+    timer.refresh()
+    first = [watch.until for watch in watches.active]
+    timer.refresh()
+    assert [watch.until for watch in watches.active] == first
+
+    timer.watermark -= timedelta(minutes=6)
+    timer.refresh()
+    assert len(watches.active) == len(REMINDER_COLLECTIONS)
+    assert all(watch.until > until for watch, until in zip(watches.active, first))
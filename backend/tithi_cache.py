@@ -0,0 +1,80 @@
+import calendar
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TithiCache:
+    """Bounded LRU of tithi lookups keyed by (date, latitude, longitude, timezone).
+
+    Concurrent misses for the same key are coalesced so only one request goes
+    upstream; the other callers wait for its answer.
+    """
+
+    def __init__(self, loader, maxsize=1024):
+        self.loader = loader  # loader(date, latitude, longitude, timezone) -> tithi name or None
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, date, latitude, longitude, timezone):
+        key = (date, latitude, longitude, timezone)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self.loader(*key)
+            with self._lock:
+                self._entries[key] = call.value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def prefetch_month(self, year, month, latitude, longitude, timezone):
+        """Warms every day of a month on a background thread."""
+        def warm():
+            days = calendar.monthrange(year, month)[1]
+            for day in range(1, days + 1):
+                try:
+                    self.get(f"{year:04d}-{month:02d}-{day:02d}", latitude, longitude, timezone)
+                except Exception as e:
+                    logger.warning("⚠ Tithi prefetch failed for %d-%02d-%02d: %s", year, month, day, e)
+
+        thread = threading.Thread(target=warm, name=f"tithi-prefetch-{year}-{month:02d}", daemon=True)
+        thread.start()
+        return thread
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,210 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz
+
+from free_slots import BusyIndex, busy_intervals
+from queries import (BUSY_EVENT_FIELDS, BUSY_TASK_FIELDS, EVENT_FIELDS, TASK_FIELDS, events_between,
+                     field_filter)
+from recurrence import user_series, with_occurrences
+from task_store import TASK_COLLECTIONS, query_tasks
+
+
+class _Load:
+    """A window being read from Firestore, shared by every caller that misses meanwhile."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+        self.error = None
+        self.stale = False  # invalidated while loading, so neither cached nor handed out
+
+
+class _UserWindow:
+    def __init__(self, window_start, window_end, events, tasks):
+        self.loaded_at = time.monotonic()
+        self.window_start = window_start
+        self.window_end = window_end
+        # Sorted by time, with a parallel list of timestamps for bisecting
+        self.events = events  # [event dict]
+        self.event_keys = [e["start"].timestamp() for e in events]
+        self.tasks = tasks  # [(collection, task dict)]
+        self.task_keys = [t["DueDate"].timestamp() for _, t in tasks]
+        self.watches = []
+        self._busy = None
+
+    def busy_index(self):
+        # Built on first use; the window's items never change, a change replaces the whole entry
+        if self._busy is None:
+            self._busy = BusyIndex(busy_intervals(self.events, self.tasks))
+        return self._busy
+
+    def unsubscribe(self):
+        for watch in self.watches:
+            watch.unsubscribe()
+
+    def covers(self, start, end):
+        return self.window_start <= start and end <= self.window_end
+
+
+class UserAgendaCache:
+    """Per-user cache of events and tasks in a rolling window around today.
+
+    Range queries inside the window are answered with a bisect over the user's
+    sorted items. Entries expire after `ttl_seconds`, are evicted LRU beyond
+    `max_users`, and can be dropped early with invalidate() whenever the backend
+    writes to a user's events or tasks. With `listen=True`, Firestore snapshot
+    listeners also invalidate a user's entry as soon as their events or tasks change.
+
+    Concurrent misses for the same user are coalesced: one caller reads the window,
+    the others wait for it instead of all querying Firestore at once.
+    """
+
+    def __init__(self, db, max_users=1000, ttl_seconds=60, window_days=7, listen=False):
+        self.db = db
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.window = timedelta(days=window_days)
+        self.listen = listen
+        self._users = OrderedDict()
+        self._loading = {}  # user id -> _Load
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def events_between(self, user_id, start, end, load=True):
+        """Returns the user's event dicts with start in [start, end], or None if not cacheable.
+
+        With load=False a miss returns None instead of reading Firestore.
+        """
+        entry = self._entry(user_id, start, end, load)
+        if entry is None:
+            return None
+        lo = bisect_left(entry.event_keys, start.timestamp())
+        hi = bisect_right(entry.event_keys, end.timestamp())
+        return entry.events[lo:hi]
+
+    def tasks_between(self, user_id, start, end, load=True):
+        """Returns (collection, task dict) pairs with DueDate in [start, end], or None if not cacheable."""
+        entry = self._entry(user_id, start, end, load)
+        if entry is None:
+            return None
+        lo = bisect_left(entry.task_keys, start.timestamp())
+        hi = bisect_right(entry.task_keys, end.timestamp())
+        return entry.tasks[lo:hi]
+
+    def busy_index(self, user_id, start, end, load=True):
+        """Returns the BusyIndex of the user's cached window if it covers [start, end], or None."""
+        entry = self._entry(user_id, start, end, load)
+        return None if entry is None else entry.busy_index()
+
+    def warm(self, user_id):
+        """Loads a user's window now, e.g. from a background thread after a miss."""
+        now = datetime.now(pytz.utc)
+        self._entry(user_id, now, now)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if user_id in self._loading:
+                self._loading[user_id].stale = True
+        if entry:
+            entry.unsubscribe()
+
+    def stats(self):
+        return {"users": len(self._users), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+    def _entry(self, user_id, start, end, load=True):
+        if not user_id or self.max_users <= 0:  # AGENDA_CACHE_USERS=0 turns the cache off
+            return None
+
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry and time.monotonic() - entry.loaded_at <= self.ttl_seconds and entry.covers(start, end):
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry
+
+        # Only ranges inside the rolling window are worth caching
+        today = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        window_start, window_end = today - self.window, today + self.window + timedelta(days=1)
+        if not load or not (window_start <= start and end <= window_end):
+            return None
+
+        with self._lock:
+            pending = self._loading.get(user_id)
+            leader = pending is None
+            if leader:
+                pending = self._loading[user_id] = _Load()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.event.wait()
+            if pending.error:
+                raise pending.error
+            entry = pending.entry
+            return entry if entry is not None and entry.covers(start, end) else None
+
+        previous, evicted = None, []
+        try:
+            entry = self._load(user_id, window_start, window_end)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(user_id, None)
+                if pending.error is None and not pending.stale:
+                    pending.entry = entry
+                    previous = self._users.pop(user_id, None)
+                    self._users[user_id] = entry
+                    while len(self._users) > self.max_users:
+                        evicted.append(self._users.popitem(last=False)[1])
+            pending.event.set()
+
+        if pending.entry is None:
+            # Written to while it loaded: this read may predate the write, so callers query live
+            entry.unsubscribe()
+            return None
+        for old in [previous] + evicted:
+            if old:
+                old.unsubscribe()
+        return entry
+
+    def _load(self, user_id, window_start, window_end):
+        # The window is served as a whole later, so it's read in full (page by page), not capped
+        # The window serves both chat lists and free/busy, so it reads both projections
+        singles = events_between(user_id, window_start, window_end, name="agenda_window",
+                                 fields=EVENT_FIELDS + BUSY_EVENT_FIELDS).stream(self.db)
+        found = with_occurrences(singles, user_series(self.db, "events", user_id), "start", window_start, window_end)
+        events = [e.to_dict() for e in found]
+        tasks = [(collection, t.to_dict())
+                 for collection, t in query_tasks(self.db, user_id, window_start, window_end, max_results=None,
+                                                  fields=TASK_FIELDS + BUSY_TASK_FIELDS)]
+        tasks = [(collection, t) for collection, t in tasks if t.get("DueDate")]
+
+        entry = _UserWindow(window_start, window_end, events, tasks)
+        if self.listen:
+            entry.watches = [self._watch(user_id, entry, collection) for collection in ["events", *TASK_COLLECTIONS]]
+        return entry
+
+    def _watch(self, user_id, entry, collection):
+        initial = [True]
+
+        def on_change(snapshots, changes, read_time):
+            if initial[0]:
+                initial[0] = False  # the first callback is just the current state
+                return
+            with self._lock:
+                if self._users.get(user_id) is entry:
+                    del self._users[user_id]
+            # A listener can't be stopped from its own callback thread
+            threading.Thread(target=entry.unsubscribe, daemon=True).start()
+
+        return self.db.collection(collection).where(filter=field_filter("userId", "==", user_id)).on_snapshot(on_change)